@@ -0,0 +1,78 @@
+"""
+Measure the cold import time of pptagent modules with `python -X importtime`, each import in
+a fresh interpreter, and fail when the median exceeds a budget, to catch import time regressions.
+
+Usage:
+    python benchmark/import_time.py [module ...] [--runs N] [--budget SECONDS] [--top K]
+
+The default budget was set on a single vCPU Linux VM with CPython 3.11, where the medians are
+about 0.12s for pptagent, 0.35-0.5s for pptagent.presentation and 0.5-0.9s for pptagent.bulk,
+varying between runs. It leaves headroom for that noise while catching heavy dependencies,
+e.g. openai or torch, imported eagerly again. Pass a tighter budget on a quiet machine.
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+DEFAULT_MODULES = ["pptagent", "pptagent.presentation", "pptagent.bulk"]
+
+
+def import_times(module: str) -> dict[str, int]:
+    """
+    Import a module in a fresh interpreter.
+
+    Returns:
+        dict[str, int]: The cumulative import time in microseconds of each imported module.
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=1.5)
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    exceeded = []
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.runs)]
+        # the package is imported before a submodule and reported separately
+        package = module.split(".")[0]
+        totals = [
+            (times[module] + (times[package] if package != module else 0)) / 1e6
+            for times in runs
+        ]
+        median = statistics.median(totals)
+        print(f"{module}: median {median:.3f}s over {args.runs} runs")
+        slowest = sorted(runs[-1].items(), key=lambda x: x[1], reverse=True)
+        for name, cumulative in [
+            item for item in slowest if item[0] not in (module, package)
+        ][: args.top]:
+            print(f"    {name}: {cumulative / 1e6:.3f}s")
+        if median > args.budget:
+            exceeded.append(module)
+
+    if exceeded:
+        print(f"Import time over the budget of {args.budget}s: {', '.join(exceeded)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Measure `get_json_from_response` on long LLM responses: valid JSON surrounded by code,
+malformed JSON that needs repairing, and responses without any JSON.
+
+Usage:
+    python benchmark/json_extraction.py [--lines N] [--rounds N]
+"""
+
+import argparse
+import time
+
+from pptagent.utils import get_json_from_response
+
+CODE_LINE = "def f(x): return {x: [x, (x,)]} if x else {'k': []}\n"
+ANSWER = '{"action": "replace_paragraph", "args": [0, 1, "{text}"]}'
+
+
+def cases(lines: int) -> dict[str, str]:
+    code = CODE_LINE * lines
+    return {
+        "json after code": code + ANSWER,
+        "json between code": code + ANSWER + "\n" + code,
+        "trailing comma": code + ANSWER.replace("]}", "],}"),
+        "truncated": code + ANSWER[:-8],
+        "no json": "plain text " * lines * 5,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    for name, response in cases(args.lines).items():
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            try:
+                result = get_json_from_response(response)
+            except Exception:
+                result = None
+        elapsed = (time.perf_counter() - start) / args.rounds
+        print(
+            f"{name:<20} {len(response):>8} chars {elapsed * 1000:>10.2f} ms  -> {result}"
+        )
+
+
+if __name__ == "__main__":
+    main()
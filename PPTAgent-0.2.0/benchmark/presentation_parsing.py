@@ -0,0 +1,76 @@
+"""
+Measure `Presentation.from_file` on a large template, parsing slides in process
+versus in worker processes. The template is built by repeating the slides of a source
+template until it has the requested number of slides.
+
+Usage:
+    python benchmark/presentation_parsing.py [template.pptx] [--slides N] [--workers N]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from copy import deepcopy
+from os.path import join
+
+from pptx import Presentation as load_prs
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
+
+from pptagent.presentation import Presentation
+from pptagent.utils import Config, package_join
+
+R_NAMESPACE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+
+def build_large_template(template: str, num_slides: int, output: str) -> None:
+    prs = load_prs(template)
+    sources = list(prs.slides)
+    for i in range(num_slides - len(sources)):
+        source = sources[i % len(sources)]
+        slide = prs.slides.add_slide(source.slide_layout)
+        # relationships of the copied shapes, e.g. images, keep their ids in the copy
+        rids = {}
+        for rid, rel in source.part.rels.items():
+            if rel.reltype in (RT.SLIDE_LAYOUT, RT.NOTES_SLIDE):
+                continue
+            if rel.is_external:
+                rids[rid] = slide.part.relate_to(rel.target_ref, rel.reltype, True)
+            else:
+                rids[rid] = slide.part.relate_to(rel.target_part, rel.reltype)
+        c_sld = deepcopy(source._element.cSld)
+        for element in c_sld.iter():
+            for attr, value in element.attrib.items():
+                if attr.startswith(f"{{{R_NAMESPACE}}}") and value in rids:
+                    element.set(attr, rids[value])
+        slide._element.replace(slide._element.cSld, c_sld)
+    prs.save(output)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "template",
+        nargs="?",
+        default=package_join("templates", "default", "source.pptx"),
+    )
+    parser.add_argument("--slides", type=int, default=150)
+    parser.add_argument("--workers", type=int, default=min(os.cpu_count() or 1, 8))
+    args = parser.parse_args()
+
+    template = join(tempfile.mkdtemp(), "large.pptx")
+    build_large_template(args.template, args.slides, template)
+    for workers in sorted({1, args.workers}):
+        # a fresh image directory, so every run writes the images
+        config = Config(tempfile.mkdtemp())
+        start = time.perf_counter()
+        presentation = Presentation.from_file(template, config, max_workers=workers)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{workers:>2} workers: {len(presentation)} slides in {elapsed:.2f}s, "
+            f"{len(os.listdir(config.IMAGE_DIR))} images"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Compare the CPU time and memory of copying template slides for editing,
+`deepcopy(slide)` versus the copy-on-write `slide.fork()`, including building the edited slides.
+
+Usage:
+    python benchmark/slide_fork.py [template.pptx] [--rounds N]
+"""
+
+import argparse
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable
+from copy import deepcopy
+
+from pptagent.presentation import Presentation, SlidePage
+from pptagent.utils import Config, package_join
+
+
+def measure(
+    presentation: Presentation, copy_fn: Callable[[SlidePage], SlidePage], rounds: int
+) -> tuple[float, float, float]:
+    copy_time = build_time = 0
+    tracemalloc.start()
+    for _ in range(rounds):
+        start = time.perf_counter()
+        copies = [copy_fn(slide) for slide in presentation.slides]
+        copy_time += time.perf_counter() - start
+    # memory retained by the copies of the last round
+    copy_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    for _ in range(rounds):
+        prs = presentation.empty_copy()
+        start = time.perf_counter()
+        for slide in copies:
+            prs.build_slide(slide)
+        build_time += time.perf_counter() - start
+    return copy_time / rounds, build_time / rounds, copy_memory / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "template",
+        nargs="?",
+        default=package_join("templates", "default", "source.pptx"),
+    )
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    presentation = Presentation.from_file(args.template, Config(tempfile.mkdtemp()))
+    print(f"{len(presentation.slides)} slides, {args.rounds} rounds")
+    for name, copy_fn in [("deepcopy", deepcopy), ("fork", SlidePage.fork)]:
+        copy_time, build_time, memory = measure(presentation, copy_fn, args.rounds)
+        print(
+            f"{name:>8}: copy {copy_time * 1000:.2f} ms, build {build_time * 1000:.2f} ms, copy memory {memory:.2f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+pytest-benchmark suite of the non-LLM hot paths, compared against the baselines stored in
+`benchmark/baselines` so regressions show up in review.
+
+Usage:
+    # compare against the stored baseline, failing on a mean regression over 25%
+    pytest benchmark --benchmark-storage=benchmark/baselines \\
+        --benchmark-compare --benchmark-compare-fail=mean:25%
+
+    # store a new baseline, e.g. along with an intended performance change
+    pytest benchmark --benchmark-storage=benchmark/baselines --benchmark-save=baseline
+"""
+
+import asyncio
+import re
+import tempfile
+from copy import deepcopy
+
+import numpy as np
+import pytest
+
+from benchmark.json_extraction import cases
+from pptagent.apis import CodeExecutor
+from pptagent.document.doc_utils import get_tree_structure, split_markdown_by_headings
+from pptagent.presentation import Presentation, SlidePage
+from pptagent.utils import Config, get_json_from_response, package_join
+
+TEMPLATE = package_join("templates", "default", "source.pptx")
+
+
+@pytest.fixture(scope="module")
+def presentation() -> Presentation:
+    return Presentation.from_file(TEMPLATE, Config(tempfile.mkdtemp()))
+
+
+def test_presentation_from_file(benchmark):
+    # each round parses into a fresh run directory, so no image or cache of a previous round is reused
+    benchmark.pedantic(
+        Presentation.from_file,
+        setup=lambda: ((TEMPLATE, Config(tempfile.mkdtemp())), {}),
+        rounds=10,
+    )
+
+
+def test_slide_to_html(benchmark, presentation: Presentation):
+    def render(slides: list[SlidePage]) -> list[str]:
+        return [slide.to_html(show_image=False) for slide in slides]
+
+    # forks are rendered afresh, their render cache is empty
+    benchmark.pedantic(
+        render,
+        setup=lambda: (([slide.fork() for slide in presentation.slides],), {}),
+        rounds=50,
+    )
+
+
+def test_slide_to_html_cached(benchmark, presentation: Presentation):
+    benchmark(
+        lambda: [slide.to_html(show_image=False) for slide in presentation.slides]
+    )
+
+
+@pytest.mark.parametrize(
+    "copy_fn", [deepcopy, SlidePage.fork], ids=["deepcopy", "fork"]
+)
+def test_slide_copy(benchmark, presentation: Presentation, copy_fn):
+    benchmark(lambda: [copy_fn(slide) for slide in presentation.slides])
+
+
+def test_execute_actions(benchmark, presentation: Presentation):
+    slide = max(presentation.slides, key=lambda s: len(list(s.iter_paragraphs())))
+    actions = "\n".join(
+        f'replace_paragraph({shape.shape_idx}, {para.idx}, "benchmark paragraph")'
+        for shape in slide
+        if shape.text_frame.is_textframe
+        for para in shape.text_frame.paragraphs
+        if para.idx != -1
+    )
+
+    def execute(executor: CodeExecutor, edit_slide: SlidePage):
+        assert executor.execute_actions(actions, edit_slide, None, True) is None
+
+    benchmark.pedantic(
+        execute, setup=lambda: ((CodeExecutor(3), slide.fork()), {}), rounds=50
+    )
+
+
+def test_presentation_save(benchmark, presentation: Presentation, tmp_path):
+    benchmark(presentation.save, str(tmp_path / "final.pptx"))
+
+
+def test_markdown_preprocessing(benchmark):
+    # the non-LLM part of Document.from_markdown, the rest of it is made of model calls per chunk
+    sections = []
+    for i in range(40):
+        sections.append(f"# Chapter {i}\n\nIntroduction of chapter {i}. " * 3)
+        for j in range(4):
+            sections.append(
+                f"## Section {i}.{j}\n\n"
+                + f"Paragraph of section {i}.{j} with some content. " * 20
+                + f"\n\n![Figure {i}.{j}](images/figure_{i}_{j}.png)\n\n"
+                + "| a | b |\n| - | - |\n| 1 | 2 |\n"
+            )
+    markdown = "\n\n".join(sections)
+
+    async def stub_language_model(*args, **kwargs) -> dict:
+        # the logic headings are the chapters
+        return {"headings": [h for h in headings if h.startswith("# ")]}
+
+    def preprocess() -> list[str]:
+        document_tree = get_tree_structure(markdown)
+        return asyncio.run(
+            split_markdown_by_headings(
+                markdown, headings, document_tree, stub_language_model
+            )
+        )
+
+    headings = re.findall(r"^#+\s+.*", markdown, re.MULTILINE)
+    assert len(benchmark(preprocess)) > 1
+
+
+@pytest.mark.parametrize("num_points", [30, 60])
+def test_get_cluster(benchmark, num_points: int):
+    pytest.importorskip("torch")
+    from pptagent.model_utils import get_cluster
+
+    # blocks of similar points with noise
+    rng = np.random.default_rng(0)
+    labels = rng.integers(0, num_points // 6, num_points)
+    similarity = np.where(labels[:, None] == labels[None, :], 0.8, 0.3)
+    similarity = similarity + rng.uniform(-0.1, 0.1, similarity.shape)
+    similarity = (similarity + similarity.T) / 2
+    np.fill_diagonal(similarity, 1.0)
+    benchmark(get_cluster, similarity.tolist())
+
+
+@pytest.mark.parametrize("name", list(cases(1)))
+def test_get_json_from_response(benchmark, name: str):
+    response = cases(2000)[name]
+
+    def extract():
+        try:
+            return get_json_from_response(response)
+        except Exception:
+            return None
+
+    benchmark(extract)
@@ -13,6 +13,9 @@ __email__ = "wszh712811@gmail.com"
 
 # Check the version of python and python-pptx
 
+import importlib
+from typing import TYPE_CHECKING
+
 from packaging.version import Version
 from pptx import __version__ as PPTXVersion
 
@@ -24,15 +27,43 @@ except Exception as _:
         "You should install the customized `python-pptx` for this project, see https://github.com/Force1ess/python-pptx"
     )
 
-# __init__.py
-from .document import Document
-from .llms import LLM, AsyncLLM
-from .mcp_server import PPTAgentServer
-from .model_utils import ModelManager
-from .multimodal import ImageLabler
-from .pptgen import PPTAgent
-from .presentation import Presentation
-from .utils import Config, Language
+# Submodules are imported on first access of their exports (PEP 562), so importing the
+# package or one of its submodules does not load openai, fastmcp, torch and the like.
+_LAZY_EXPORTS = {
+    "Document": "pptagent.document",
+    "LLM": "pptagent.llms",
+    "AsyncLLM": "pptagent.llms",
+    "PPTAgentServer": "pptagent.mcp_server",
+    "ModelManager": "pptagent.model_utils",
+    "ImageLabler": "pptagent.multimodal",
+    "PPTAgent": "pptagent.pptgen",
+    "Presentation": "pptagent.presentation",
+    "Config": "pptagent.utils",
+    "Language": "pptagent.utils",
+}
+
+if TYPE_CHECKING:
+    from .document import Document
+    from .llms import LLM, AsyncLLM
+    from .mcp_server import PPTAgentServer
+    from .model_utils import ModelManager
+    from .multimodal import ImageLabler
+    from .pptgen import PPTAgent
+    from .presentation import Presentation
+    from .utils import Config, Language
+
+
+def __getattr__(name: str):
+    if name not in _LAZY_EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_EXPORTS[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(_LAZY_EXPORTS))
+
 
 __all__ = [
     "__version__",
@@ -1,14 +1,20 @@
-from dataclasses import asdict, dataclass
-from functools import partial
+import copy
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
 from math import ceil
 
-import yaml
-from jinja2 import Environment, StrictUndefined, Template
+from jinja2 import Environment, Template
 from PIL import Image
 from pydantic import BaseModel
 
 from pptagent.llms import AsyncLLM, ThinkMode
-from pptagent.utils import get_json_from_response, package_join
+from pptagent.telemetry import LLMUsage, trace_scope
+from pptagent.utils import (
+    get_jinja_env,
+    get_json_from_response,
+    get_prompt_template,
+    load_role_config,
+)
 
 RETRY_TEMPLATE = Template(
     """The previous output is invalid, please carefully analyze the traceback and feedback information, correct errors happened before.
@@ -33,20 +39,21 @@ class Turn:
     message: list
     retry: int = -1
     images: list[str] = None
-    input_chars: int = 0
-    output_chars: int = 0
+    usage: LLMUsage = field(default_factory=LLMUsage)
 
     def to_dict(self):
         return {k: v for k, v in asdict(self).items() if k != "embedding"}
 
-    def calc_token(self):
+    def estimate_usage(self, history: list["Turn"], system_message: str):
         """
-        Calculate the number of tokens for the turn.
+        Estimate the usage by characters, for providers which do not report token usage.
         """
+        self.usage.prompt_tokens = len(system_message) + len(self.prompt)
+        for turn in history:
+            self.usage.prompt_tokens += len(turn.prompt) + len(turn.response)
         if self.images is not None:
-            self.input_chars += calc_image_tokens(self.images)
-        self.input_chars += len(self.prompt)
-        self.output_chars = len(self.response)
+            self.usage.prompt_tokens += calc_image_tokens(self.images)
+        self.usage.completion_tokens = len(self.response)
 
     def __eq__(self, other):
         return self is other
@@ -73,15 +80,13 @@ class Agent:
         llm_mapping (dict): The mapping of the language model.
             record_cost (bool): Whether to record the token cost.
             llm (LLM): The language model.
-            config (dict): The configuration.
-            env (Environment): The Jinja2 environment.
+            config (dict): The configuration, defaults to the shared configuration of the role.
+            env (Environment): The Jinja2 environment, defaults to the shared environment.
         """
         self.name = name
         self.config = config
         if self.config is None:
-            with open(package_join("roles", f"{name}.yaml"), encoding="utf-8") as f:
-                self.config = yaml.safe_load(f)
-                assert isinstance(self.config, dict), "Agent config must be a dict"
+            self.config = load_role_config(name)
         self.llm_mapping = llm_mapping
         self.llm = self.llm_mapping[self.config["use_model"]]
         self.model = self.llm.model
@@ -89,27 +94,35 @@ class Agent:
         self.return_json = self.config.get("return_json", False)
         self.system_message = self.config["system_prompt"]
         self.prompt_args = set(self.config["jinja_args"])
-        self.env = env
-        if self.env is None:
-            self.env = Environment(undefined=StrictUndefined)
-        self.template = self.env.from_string(self.config["template"])
+        self.env = env or get_jinja_env()
+        if env is None and config is None:
+            # compiled once per process for all agents of the role
+            self.template = get_prompt_template(f"roles/{name}")
+        else:
+            self.template = self.env.from_string(self.config["template"])
         self.input_tokens = 0
         self.output_tokens = 0
         self._history: list[Turn] = []
-        run_args = self.config.get("run_args", {})
-        self.llm.__call__ = partial(self.llm.__call__, **run_args)
-        self.system_tokens = len(self.system_message)
+        self.run_args = self.config.get("run_args", {})
+
+    def clone(self) -> "Agent":
+        """
+        Copy the agent with an empty history and cost, sharing its configuration, template and models.
+        """
+        agent = copy.copy(self)
+        agent.input_tokens = 0
+        agent.output_tokens = 0
+        agent._history = []
+        return agent
 
-    def calc_cost(self, turns: list[Turn]):
+    def calc_cost(self, history: list[Turn], turn: Turn):
         """
-        Calculate the cost of a list of turns.
+        Accumulate the token usage of a turn, as reported by the provider.
         """
-        for turn in turns[:-1]:
-            self.input_tokens += turn.input_chars
-            self.input_tokens += turn.output_chars
-        self.input_tokens += turns[-1].input_chars
-        self.output_tokens += turns[-1].output_chars
-        self.input_tokens += self.system_tokens
+        if turn.usage.prompt_tokens == 0:
+            turn.estimate_usage(history, self.system_message)
+        self.input_tokens += turn.usage.prompt_tokens
+        self.output_tokens += turn.usage.completion_tokens
 
     @property
     def next_turn_id(self):
@@ -143,20 +156,22 @@ class Agent:
         history_msg = []
         for turn in history:
             history_msg.extend(turn.message)
-        response, message = await self.llm(
-            prompt,
-            history=history_msg,
-            return_message=True,
-            think_mode=think_mode,
-            response_format=response_format,
-            **client_kwargs,
-        )
+        with trace_scope(role=self.name) as scope:
+            response, message = await self.llm(
+                prompt,
+                history=history_msg,
+                return_message=True,
+                think_mode=think_mode,
+                response_format=response_format,
+                **(self.run_args | client_kwargs),
+            )
         turn = Turn(
             id=turn_id,
             prompt=prompt,
             response=response,
             message=message,
             retry=error_idx,
+            usage=scope.usage,
         )
         return await self.__post_process__(response, history, turn)
 
@@ -194,22 +209,24 @@ class Agent:
 
         if client_kwargs is None:
             client_kwargs = {}
-        response, message = await self.llm(
-            prompt,
-            think_mode=think_mode,
-            system_message=self.system_message,
-            history=history_msg,
-            images=images,
-            return_message=True,
-            response_format=response_format,
-            **client_kwargs,
-        )
+        with trace_scope(role=self.name) as scope:
+            response, message = await self.llm(
+                prompt,
+                think_mode=think_mode,
+                system_message=self.system_message,
+                history=history_msg,
+                images=images,
+                return_message=True,
+                response_format=response_format,
+                **(self.run_args | client_kwargs),
+            )
         turn = Turn(
             id=self.next_turn_id,
             prompt=prompt,
             response=response,
             message=message,
             images=images,
+            usage=scope.usage,
         )
         return turn.id, await self.__post_process__(response, history, turn)
 
@@ -229,8 +246,7 @@ class Agent:
         """
         self._history.append(turn)
         if self.record_cost:
-            turn.calc_token()
-            self.calc_cost(history + [turn])
+            self.calc_cost(history, turn)
         if self.return_json:
             response = get_json_from_response(response)
         return response
@@ -240,18 +256,23 @@ def calc_image_tokens(images: list[str]):
     """
     Calculate the number of tokens for a list of images.
     """
-    tokens = 0
-    for image in images:
-        with open(image, "rb") as f:
-            width, height = Image.open(f).size
-        if width > 1024 or height > 1024:
-            if width > height:
-                height = int(height * 1024 / width)
-                width = 1024
-            else:
-                width = int(width * 1024 / height)
-                height = 1024
-        h = ceil(height / 512)
-        w = ceil(width / 512)
-        tokens += 85 + 170 * h * w
-    return tokens
+    return sum(image_tokens(image) for image in images)
+
+
+@lru_cache(maxsize=1024)
+def image_tokens(image: str) -> int:
+    """
+    Calculate the number of tokens for an image, cached as the same images are sent repeatedly.
+    """
+    with open(image, "rb") as f:
+        width, height = Image.open(f).size
+    if width > 1024 or height > 1024:
+        if width > height:
+            height = int(height * 1024 / width)
+            width = 1024
+        else:
+            width = int(width * 1024 / height)
+            height = 1024
+    h = ceil(height / 512)
+    w = ceil(width / 512)
+    return 85 + 170 * h * w
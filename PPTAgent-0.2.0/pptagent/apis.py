@@ -421,8 +421,9 @@ def del_paragraph(slide: SlidePage, div_id: int, paragraph_id: int):
         if para.idx == paragraph_id:
             para.edited = True
             shape.text_frame.paragraphs.remove(para)
-            shape._closures[ClosureType.DELETE].append(
-                Closure(partial(del_para, para.real_idx), para.real_idx)
+            shape.add_closure(
+                ClosureType.DELETE,
+                Closure(partial(del_para, para.real_idx), para.real_idx),
             )
             return
     else:
@@ -469,7 +470,8 @@ def replace_paragraph(slide: SlidePage, div_id: int, paragraph_id: int, text: st
     for para in shape.text_frame.paragraphs:
         if para.idx == paragraph_id:
             para.text = text
-            shape._closures[ClosureType.REPLACE].append(
+            shape.add_closure(
+                ClosureType.REPLACE,
                 Closure(
                     partial(replace_para, para.real_idx, text),
                     para.real_idx,
@@ -548,7 +550,8 @@ def clone_paragraph(slide: SlidePage, div_id: int, paragraph_id: int):
         shape.text_frame.paragraphs.append(deepcopy(para))
         shape.text_frame.paragraphs[-1].idx = max_idx + 1
         shape.text_frame.paragraphs[-1].real_idx = len(shape.text_frame.paragraphs) - 1
-        shape._closures[ClosureType.CLONE].append(
+        shape.add_closure(
+            ClosureType.CLONE,
             Closure(
                 partial(clone_para, para.real_idx),
                 para.real_idx,
@@ -564,11 +567,9 @@ def replace_image_with_table(shape: Picture, doc: Document, image_path: str):
     table = doc.find_media(path=image_path)
     shape.is_table = True
     shape.grid = (len(table.cells), len(table.cells[0]))
-    shape._closures[ClosureType.REPLACE].append(
-        Closure(partial(add_table, table.cells))
-    )
-    shape._closures[ClosureType.MERGE].append(
-        Closure(partial(merge_cells, table.merge_area))
+    shape.add_closure(ClosureType.REPLACE, Closure(partial(add_table, table.cells)))
+    shape.add_closure(
+        ClosureType.MERGE, Closure(partial(merge_cells, table.merge_area))
     )
     return
 
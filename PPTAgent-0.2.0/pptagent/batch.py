@@ -0,0 +1,223 @@
+import asyncio
+import io
+import json
+import os
+import uuid
+from collections.abc import Awaitable, Callable
+from functools import partial
+from typing import TYPE_CHECKING
+
+from pptagent.utils import get_logger
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+    from openai.types.chat import ChatCompletion
+
+logger = get_logger(__name__)
+
+BATCH_SIZE = int(os.environ.get("PPTAGENT_BATCH_SIZE", 64))
+BATCH_WAIT = float(os.environ.get("PPTAGENT_BATCH_WAIT", 5))
+BATCH_POLL_INTERVAL = float(os.environ.get("PPTAGENT_BATCH_POLL_INTERVAL", 30))
+# `local` sends the requests of a batch concurrently, as the oaib batching did,
+# `provider` submits them to the batch endpoint, which may take hours to complete
+BATCH_MODE = os.environ.get("PPTAGENT_BATCH_MODE", "local")
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_DONE_STATUS = {"completed", "failed", "expired", "cancelled"}
+
+# A runner executes a list of batch requests and returns the result line of each custom_id
+BatchRunner = Callable[[list[dict]], Awaitable[dict[str, dict]]]
+
+
+async def run_provider_batch(
+    client: "AsyncOpenAI",
+    requests: list[dict],
+    poll_interval: float = BATCH_POLL_INTERVAL,
+) -> dict[str, dict]:
+    """
+    Run requests through the provider's batch API and wait for the results.
+
+    Args:
+        client (AsyncOpenAI): The client of the provider.
+        requests (list[dict]): The batch requests, each with `custom_id`, `method`, `url` and `body`.
+        poll_interval (float): Seconds between polls of the batch status.
+
+    Returns:
+        dict[str, dict]: The result line of each custom_id, with either `response` or `error`.
+    """
+    content = "\n".join(json.dumps(request, ensure_ascii=False) for request in requests)
+    input_file = await client.files.create(
+        file=("batch.jsonl", io.BytesIO(content.encode("utf-8"))), purpose="batch"
+    )
+    batch = await client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window="24h",
+    )
+    logger.info("Submitted batch %s with %d requests", batch.id, len(requests))
+    while batch.status not in BATCH_DONE_STATUS:
+        await asyncio.sleep(poll_interval)
+        batch = await client.batches.retrieve(batch.id)
+
+    results = {}
+    # expired batches still return the requests completed in time
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if file_id is None:
+            continue
+        output = await client.files.content(file_id)
+        for line in output.text.splitlines():
+            if line.strip():
+                result = json.loads(line)
+                results[result["custom_id"]] = result
+    if batch.status != "completed":
+        logger.warning("Batch %s ended with status %s", batch.id, batch.status)
+    return results
+
+
+async def run_local_batch(
+    client: "AsyncOpenAI", requests: list[dict]
+) -> dict[str, dict]:
+    """
+    Run batch requests concurrently against the chat completions endpoint,
+    a stand-in for providers without a batch API.
+
+    Args:
+        client (AsyncOpenAI): The client of the provider.
+        requests (list[dict]): The batch requests, see `run_provider_batch`.
+
+    Returns:
+        dict[str, dict]: The result line of each custom_id, see `run_provider_batch`.
+    """
+
+    async def run(request: dict) -> dict:
+        try:
+            completion = await client.chat.completions.create(**request["body"])
+            response = {"status_code": 200, "body": completion.model_dump()}
+            return {"custom_id": request["custom_id"], "response": response}
+        except Exception as e:
+            return {"custom_id": request["custom_id"], "error": {"message": str(e)}}
+
+    results = await asyncio.gather(*[run(request) for request in requests])
+    return {result["custom_id"]: result for result in results}
+
+
+class BatchCollector:
+    """
+    Collect chat completion requests into batches, flushed when `max_batch_size` requests are
+    pending or `max_wait` seconds after the first of them, and resolve each request with
+    its own result by custom_id.
+    """
+
+    def __init__(
+        self,
+        runner: BatchRunner,
+        max_batch_size: int = BATCH_SIZE,
+        max_wait: float = BATCH_WAIT,
+    ):
+        """
+        Initialize the BatchCollector.
+
+        Args:
+            runner (BatchRunner): Executes a batch, e.g. `run_provider_batch` bound to a client.
+            max_batch_size (int): The number of pending requests that triggers a flush.
+            max_wait (float): Seconds a request waits for others before its batch is flushed.
+        """
+        self.runner = runner
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending: dict[str, tuple[dict, asyncio.Future]] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    async def submit(self, body: dict) -> "ChatCompletion":
+        """
+        Enqueue a chat completion request and wait for its result.
+
+        Args:
+            body (dict): The keyword arguments of `chat.completions.create`.
+
+        Returns:
+            ChatCompletion: The completion of the request.
+
+        Raises:
+            RuntimeError: If the request failed or has no result in the batch.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # requests left by a closed event loop can never be awaited
+            self._loop = loop
+            self._pending.clear()
+            self._timer = None
+        custom_id = uuid.uuid4().hex
+        request = {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": body,
+        }
+        future = loop.create_future()
+        self._pending[custom_id] = (request, future)
+        if len(self._pending) >= self.max_batch_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self.flush)
+        return await future
+
+    def flush(self) -> None:
+        """
+        Submit the pending requests as a batch.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        task = asyncio.get_running_loop().create_task(self._run(pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, pending: dict[str, tuple[dict, asyncio.Future]]) -> None:
+        from openai.types.chat import ChatCompletion
+
+        try:
+            results = await self.runner([request for request, _ in pending.values()])
+        except Exception as e:
+            logger.error("Batch of %d requests failed: %s", len(pending), e)
+            for _, future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for custom_id, (_, future) in pending.items():
+            if future.done():
+                continue
+            result = results.get(custom_id)
+            response = (result or {}).get("response") or {}
+            if response.get("status_code") == 200:
+                future.set_result(ChatCompletion(**response["body"]))
+            else:
+                error = (result or {}).get("error") or response.get("body")
+                future.set_exception(
+                    RuntimeError(f"Batch request {custom_id} failed: {error}")
+                )
+
+
+_BATCH_COLLECTORS: dict[tuple, BatchCollector] = {}
+
+
+def get_batch_collector(client: "AsyncOpenAI") -> BatchCollector:
+    """
+    Get the BatchCollector of an endpoint, shared by the AsyncLLMs calling it.
+
+    Args:
+        client (AsyncOpenAI): The client of the endpoint.
+
+    Returns:
+        BatchCollector: The collector, running batches as configured by `PPTAGENT_BATCH_MODE`.
+    """
+    key = (str(client.base_url), client.api_key, BATCH_MODE)
+    if key not in _BATCH_COLLECTORS:
+        runner = run_local_batch if BATCH_MODE == "local" else run_provider_batch
+        _BATCH_COLLECTORS[key] = BatchCollector(partial(runner, client))
+    return _BATCH_COLLECTORS[key]
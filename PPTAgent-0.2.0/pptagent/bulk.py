@@ -0,0 +1,357 @@
+"""
+Generate presentations in bulk from a manifest of jobs, one JSON object per line:
+
+    {"template": "template.pptx", "document": "paper.pdf", "pages": 12}
+
+Jobs run concurrently and share one model pool, every stage is checkpointed to the
+output directory, so rerunning a manifest skips finished jobs and resumes failed ones
+from the stage that failed.
+
+Usage:
+    pptagent-bulk manifest.jsonl --output-dir runs/bulk [--max-jobs N]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import time
+import traceback
+from dataclasses import asdict, dataclass
+from os.path import basename, dirname, exists, join, splitext
+
+import jsonlines
+
+from pptagent.document import Document
+from pptagent.induct import SlideInducter
+from pptagent.model_utils import (
+    ModelManager,
+    close_http_session,
+    parse_pdf,
+    warmup_language_id,
+)
+from pptagent.multimodal import ImageLabler
+from pptagent.pptgen import PPTAgent
+from pptagent.presentation import Presentation
+from pptagent.template_cache import TemplateCache, get_template_cache
+from pptagent.utils import atomic_write, file_digest, get_logger, ppt_to_images_async
+
+logger = get_logger(__name__)
+
+BULK_MAX_JOBS = int(os.environ.get("PPTAGENT_BULK_MAX_JOBS", 4))
+BULK_MAX_SLIDES = int(os.environ.get("PPTAGENT_BULK_MAX_SLIDES", 8))
+
+
+@dataclass
+class BulkJob:
+    """
+    A presentation to generate from a document with a template.
+    """
+
+    template: str
+    document: str
+    pages: int | None = None
+    job_id: str | None = None
+
+    def __post_init__(self):
+        if self.job_id is None:
+            key = f"{file_digest(self.template)}:{file_digest(self.document)}:{self.pages}"
+            name = splitext(basename(self.document))[0]
+            self.job_id = f"{name}-{hashlib.sha256(key.encode()).hexdigest()[:12]}"
+
+
+def load_manifest(manifest_file: str) -> list[BulkJob]:
+    """
+    Load the jobs of a manifest, relative paths are resolved against the manifest directory.
+
+    Args:
+        manifest_file (str): The JSONL manifest.
+
+    Returns:
+        list[BulkJob]: The jobs.
+    """
+    base_dir = dirname(os.path.abspath(manifest_file))
+    jobs = []
+    with jsonlines.open(manifest_file) as reader:
+        for item in reader:
+            item["template"] = join(base_dir, item["template"])
+            item["document"] = join(base_dir, item["document"])
+            jobs.append(BulkJob(**item))
+    return jobs
+
+
+async def prepare_template(
+    template_cache: TemplateCache, models: ModelManager
+) -> tuple[Presentation, dict]:
+    """
+    Parse a template into the presentation and slide induction used for generation,
+    each artifact is stored in the template cache and reused when it exists.
+
+    Args:
+        template_cache (TemplateCache): The cache of the template.
+        models (ModelManager): The models.
+
+    Returns:
+        tuple[Presentation, dict]: The presentation and the slide induction.
+    """
+    config = template_cache.config
+    presentation = template_cache.load_presentation()
+    slide_image_dir = template_cache.slide_image_dir
+    if not exists(slide_image_dir) or len(os.listdir(slide_image_dir)) != len(
+        presentation
+    ):
+        await ppt_to_images_async(template_cache.source_file, slide_image_dir)
+        assert len(os.listdir(slide_image_dir)) == len(presentation) + len(
+            presentation.error_history
+        ), "Number of parsed slides and images do not match"
+
+        for err_idx, _ in presentation.error_history:
+            os.remove(join(slide_image_dir, f"slide_{err_idx:04d}.jpg"))
+        for i, slide in enumerate(presentation.slides, 1):
+            slide.slide_idx = i
+            os.rename(
+                join(slide_image_dir, f"slide_{slide.real_idx:04d}.jpg"),
+                join(slide_image_dir, f"slide_{slide.slide_idx:04d}.jpg"),
+            )
+
+    labler = ImageLabler(presentation, config)
+    image_stats = template_cache.load_json("image_stats.json")
+    if image_stats is not None:
+        labler.apply_stats(image_stats)
+    else:
+        await labler.caption_images_async(models.vision_model)
+        template_cache.dump_json("image_stats.json", labler.image_stats)
+
+    slide_induction = template_cache.load_json("slide_induction.json")
+    if slide_induction is None:
+        template_images = join(config.RUN_DIR, "template_images")
+        template_cache.load_presentation().save(
+            join(config.RUN_DIR, "template.pptx"), layout_only=True
+        )
+        await ppt_to_images_async(
+            join(config.RUN_DIR, "template.pptx"), template_images
+        )
+        slide_inducter = SlideInducter(
+            presentation,
+            slide_image_dir,
+            template_images,
+            config,
+            models.image_model,
+            models.language_model,
+            models.vision_model,
+        )
+        layout_induction = await slide_inducter.layout_induct()
+        slide_induction = await slide_inducter.content_induct(layout_induction)
+        template_cache.dump_json("slide_induction.json", slide_induction)
+    return presentation, slide_induction
+
+
+async def prepare_document(
+    document_file: str, document_dir: str, models: ModelManager
+) -> Document:
+    """
+    Parse a pdf or markdown document into a Document, the parsed markdown and the
+    refined document are stored in the document directory and reused when they exist.
+
+    Args:
+        document_file (str): The pdf or markdown file.
+        document_dir (str): The directory of the parsed document.
+        models (ModelManager): The models.
+
+    Returns:
+        Document: The refined document.
+    """
+    refined_file = join(document_dir, "refined_doc.json")
+    if exists(refined_file):
+        with open(refined_file, encoding="utf-8") as f:
+            return Document.model_validate(json.load(f))
+
+    os.makedirs(document_dir, exist_ok=True)
+    markdown_file = join(document_dir, "source.md")
+    if document_file.lower().endswith(".pdf"):
+        image_dir = document_dir
+        if not exists(markdown_file):
+            markdown = await parse_pdf(document_file, document_dir)
+            atomic_write(markdown_file, markdown)
+    else:
+        # images of a markdown document are relative to it
+        image_dir = dirname(os.path.abspath(document_file))
+        markdown_file = document_file
+    with open(markdown_file, encoding="utf-8") as f:
+        markdown = f.read()
+
+    document = await Document.from_markdown(
+        markdown, models.language_model, models.vision_model, image_dir
+    )
+    atomic_write(
+        refined_file,
+        json.dumps(document.model_dump(), ensure_ascii=False, indent=4),
+    )
+    return document
+
+
+class BulkRunner:
+    """
+    Run bulk generation jobs with bounded concurrency and a shared model pool.
+
+    The output directory holds `templates/<digest>` and `documents/<digest>`, shared by the jobs
+    using them, and `jobs/<job_id>` with the status, the outline and slide checkpoints,
+    and the generated `final.pptx` of each job.
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        models: ModelManager | None = None,
+        max_jobs: int = BULK_MAX_JOBS,
+        max_slides: int = BULK_MAX_SLIDES,
+    ):
+        """
+        Initialize the BulkRunner.
+
+        Args:
+            output_dir (str): The directory of the artifacts and the generated presentations.
+            models (ModelManager | None): The models shared by the jobs, created from the environment if None.
+            max_jobs (int): The maximum number of jobs running at once.
+            max_slides (int): The maximum number of slides generated at once by a job.
+        """
+        self.output_dir = output_dir
+        self.models = models or ModelManager()
+        self.max_jobs = max_jobs
+        self.max_slides = max_slides
+        # jobs sharing a template or document wait for the first one to parse it
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    def job_dir(self, job: BulkJob) -> str:
+        return join(self.output_dir, "jobs", job.job_id)
+
+    def _lock(self, key: str) -> asyncio.Lock:
+        return self._locks.setdefault(key, asyncio.Lock())
+
+    async def run(self, jobs: list[BulkJob]) -> dict:
+        """
+        Run the jobs, finished jobs are skipped.
+
+        Args:
+            jobs (list[BulkJob]): The jobs.
+
+        Returns:
+            dict: The summary, with the number of succeeded, failed and skipped jobs and the throughput.
+        """
+        semaphore = asyncio.Semaphore(self.max_jobs)
+        summary = {"succeeded": 0, "failed": 0, "skipped": 0}
+
+        async def run_job(job: BulkJob):
+            if exists(join(self.job_dir(job), "final.pptx")):
+                summary["skipped"] += 1
+                return
+            async with semaphore:
+                status = await self.run_job(job)
+            summary[status] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[run_job(job) for job in jobs])
+        elapsed = time.perf_counter() - start
+        summary["elapsed"] = elapsed
+        summary["decks_per_hour"] = summary["succeeded"] / elapsed * 3600
+        return summary
+
+    async def run_job(self, job: BulkJob) -> str:
+        """
+        Run a job, resuming from its checkpoints.
+
+        Args:
+            job (BulkJob): The job.
+
+        Returns:
+            str: "succeeded" or "failed".
+        """
+        job_dir = self.job_dir(job)
+        os.makedirs(job_dir, exist_ok=True)
+        status = {"job": asdict(job), "stage": None, "error": None}
+        start = time.perf_counter()
+
+        def update(stage: str):
+            status["stage"] = stage
+            status["elapsed"] = time.perf_counter() - start
+            atomic_write(
+                join(job_dir, "status.json"), json.dumps(status, ensure_ascii=False)
+            )
+
+        try:
+            update("template")
+            template_hash = file_digest(job.template)
+            template_dir = join(self.output_dir, "templates", template_hash)
+            async with self._lock(template_hash):
+                if not exists(join(template_dir, "source.pptx")):
+                    os.makedirs(template_dir, exist_ok=True)
+                    shutil.copyfile(job.template, join(template_dir, "source.pptx"))
+                presentation, slide_induction = await prepare_template(
+                    get_template_cache(template_dir), self.models
+                )
+
+            update("document")
+            document_hash = file_digest(job.document)
+            async with self._lock(document_hash):
+                document = await prepare_document(
+                    job.document,
+                    join(self.output_dir, "documents", document_hash),
+                    self.models,
+                )
+
+            update("generation")
+            ppt_agent = PPTAgent(
+                self.models.language_model,
+                self.models.vision_model,
+                error_exit=False,
+                retry_times=5,
+            )
+            ppt_agent.set_reference(
+                slide_induction=slide_induction, presentation=presentation
+            )
+            prs, _ = await ppt_agent.generate_pres(
+                source_doc=document,
+                num_slides=job.pages,
+                max_at_once=self.max_slides,
+                checkpoint_dir=join(job_dir, "slides"),
+            )
+            prs.save(join(job_dir, "final.pptx"))
+            update("done")
+            logger.info("Bulk job %s finished", job.job_id)
+            return "succeeded"
+        except Exception as e:
+            status["error"] = str(e)
+            update(status["stage"])
+            logger.error("Bulk job %s failed at %s: %s", job.job_id, status["stage"], e)
+            traceback.print_exc()
+            return "failed"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate presentations in bulk from a JSONL manifest."
+    )
+    parser.add_argument("manifest")
+    parser.add_argument("--output-dir", default="bulk_runs")
+    parser.add_argument("--max-jobs", type=int, default=BULK_MAX_JOBS)
+    parser.add_argument("--max-slides", type=int, default=BULK_MAX_SLIDES)
+    args = parser.parse_args()
+
+    async def run():
+        runner = BulkRunner(
+            args.output_dir, max_jobs=args.max_jobs, max_slides=args.max_slides
+        )
+        try:
+            return await runner.run(load_manifest(args.manifest))
+        finally:
+            await close_http_session()
+
+    warmup_language_id()
+    summary = asyncio.run(run())
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
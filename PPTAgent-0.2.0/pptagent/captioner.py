@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections.abc import Awaitable, Callable
+
+from pptagent.utils import TEMPLATE_CACHE_DIR, file_digest, get_logger
+
+logger = get_logger(__name__)
+
+CAPTION_CACHE = os.environ.get(
+    "PPTAGENT_CAPTION_CACHE", os.path.join(TEMPLATE_CACHE_DIR, "caption_cache.jsonl")
+)
+CAPTION_CONCURRENCY = int(os.environ.get("PPTAGENT_CAPTION_CONCURRENCY", 8))
+
+
+class _GenerationCancelled(Exception):
+    """
+    Set on the shared future of a caption whose generating request was cancelled.
+    """
+
+
+class CaptionService:
+    """
+    Caption medias exactly once: captions are keyed by the kind of caption, the model and the
+    content hash of the media, stored persistently, and concurrent requests for the same media
+    share a single model call. Model calls are bounded by a semaphore.
+
+    The store is an append-only JSONL log, each new caption is appended as one line off the event
+    loop. Processes sharing the store read the lines appended by the others before captioning.
+    """
+
+    def __init__(
+        self,
+        store_path: str | None = CAPTION_CACHE,
+        max_concurrency: int = CAPTION_CONCURRENCY,
+    ):
+        """
+        Initialize the CaptionService.
+
+        Args:
+            store_path (str | None): The JSONL file captions are persisted to, None to keep them in memory.
+            max_concurrency (int): The maximum number of concurrent model calls.
+        """
+        self.store_path = store_path
+        self.max_concurrency = max_concurrency
+        self._captions: dict[str, str] = {}
+        self._read_offset = 0
+        self._store_lock = threading.Lock()
+        self._load()
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._semaphore: asyncio.Semaphore | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    @staticmethod
+    def image_key(kind: str, model: str, image_path: str) -> str:
+        return f"{kind}:{model}:{file_digest(image_path)}"
+
+    @staticmethod
+    def text_key(kind: str, model: str, text: str) -> str:
+        return f"{kind}:{model}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def get(self, key: str) -> str | None:
+        return self._captions.get(key)
+
+    async def caption(self, key: str, generate: Callable[[], Awaitable[str]]) -> str:
+        """
+        Get the caption of a media, generating it only if it is neither stored nor being generated.
+
+        Args:
+            key (str): The key of the media, see `image_key` and `text_key`.
+            generate (Callable[[], Awaitable[str]]): Generates the caption with a model.
+
+        Returns:
+            str: The caption.
+        """
+        if key in self._captions:
+            return self._captions[key]
+        while key in self._inflight:
+            try:
+                return await asyncio.shield(self._inflight[key])
+            except _GenerationCancelled:
+                # the request generating it was cancelled, one of the waiting requests takes over
+                continue
+        # another process sharing the store may have captioned it meanwhile
+        self._load()
+        if key in self._captions:
+            return self._captions[key]
+
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        future = loop.create_future()
+        self._inflight[key] = future
+        try:
+            async with self._semaphore:
+                caption = await generate()
+        except asyncio.CancelledError:
+            future.set_exception(_GenerationCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # mark the exception as retrieved when no other request is waiting
+            future.exception()
+            raise
+        else:
+            self._captions[key] = caption
+            future.set_result(caption)
+        finally:
+            self._inflight.pop(key)
+        await asyncio.to_thread(self._append, key, caption)
+        return caption
+
+    def _load(self) -> None:
+        """
+        Read the captions appended to the store since the last read, by any process.
+        """
+        if self.store_path is None:
+            return
+        with self._store_lock:
+            try:
+                if os.path.getsize(self.store_path) <= self._read_offset:
+                    return
+                with open(self.store_path, "rb") as f:
+                    f.seek(self._read_offset)
+                    data = f.read()
+            except FileNotFoundError:
+                return
+            except Exception as e:
+                logger.warning(
+                    "Failed to load caption store %s: %s", self.store_path, e
+                )
+                return
+            # a line being appended by another process is read once it is complete
+            end = data.rfind(b"\n") + 1
+            self._read_offset += end
+            for line in data[:end].splitlines():
+                try:
+                    record = json.loads(line)
+                    self._captions[record["key"]] = record["caption"]
+                except Exception:
+                    logger.warning("Skipped a corrupt line of %s", self.store_path)
+
+    def _append(self, key: str, caption: str) -> None:
+        if self.store_path is None:
+            return
+        line = json.dumps({"key": key, "caption": caption}, ensure_ascii=False) + "\n"
+        try:
+            os.makedirs(os.path.dirname(self.store_path) or ".", exist_ok=True)
+            # a single write in append mode, so lines of concurrent processes do not interleave
+            with open(self.store_path, "ab") as f:
+                f.write(line.encode("utf-8"))
+        except Exception as e:
+            logger.warning("Failed to save caption store %s: %s", self.store_path, e)
+
+
+_CAPTION_SERVICE: CaptionService | None = None
+
+
+def get_caption_service() -> CaptionService:
+    """
+    Get the process-wide CaptionService.
+    """
+    global _CAPTION_SERVICE
+    if _CAPTION_SERVICE is None:
+        _CAPTION_SERVICE = CaptionService()
+    return _CAPTION_SERVICE
@@ -1,29 +1,23 @@
 import os
 import re
+from bisect import bisect_left, bisect_right
 from contextvars import ContextVar
+from itertools import accumulate
 
 from bs4 import BeautifulSoup
-from jinja2 import Environment, StrictUndefined
 from pydantic import BaseModel
 
 from pptagent.llms import AsyncLLM
-from pptagent.utils import edit_distance, package_join
-
-env = Environment(undefined=StrictUndefined)
-
+from pptagent.utils import edit_distance, get_prompt_template
 
+MARKDOWN_HEADING_REGEX = re.compile(r"^(#{1,6})\s+(.+)")
 MARKDOWN_IMAGE_REGEX = re.compile(r"!\[.*\]\(.*\)")
 MARKDOWN_TABLE_REGEX = re.compile(
     r"(\|.*\|)|((<html><body>)?<table>.*</table>(</body></html>)?)"
 )
-HEADING_EXTRACT_PROMPT = env.from_string(
-    open(
-        package_join("prompts", "document", "heading_extract.txt"), encoding="utf-8"
-    ).read()
-)
 
-MIN_CHUNK_SIZE: int = os.getenv("MIN_CHUNK_SIZE", 512)
-MAX_CHUNK_SIZE: int = os.getenv("MAX_CHUNK_SIZE", 32768)
+MIN_CHUNK_SIZE: int = int(os.getenv("MIN_CHUNK_SIZE", 512))
+MAX_CHUNK_SIZE: int = int(os.getenv("MAX_CHUNK_SIZE", 32768))
 
 
 def count_markdown_chunks(markdown_text):
@@ -44,7 +38,7 @@ def count_markdown_chunks(markdown_text):
 
     for line in lines:
         # Check if the line is a heading
-        heading_match = re.match(r"^(#{1,6})\s+(.+)", line)
+        heading_match = MARKDOWN_HEADING_REGEX.match(line)
 
         if heading_match:
             # Save the previous chunk if exists
@@ -95,21 +89,17 @@ def calculate_hierarchical_counts(chunks):
         list: Chunk list with hierarchical statistics
     """
 
-    def get_children_count(parent_index, parent_level):
-        """Recursively calculate total character count of child headings"""
-        total = 0
-        for i in range(parent_index + 1, len(chunks)):
-            current_level = chunks[i]["level"]
-
-            # Stop if encountering same or higher level heading
-            if current_level <= parent_level:
-                break
-
-            # Count all child direct character counts
-            if current_level > parent_level:
-                total += chunks[i]["char_count"]
-
-        return total
+    # Each chunk owns the following chunks until a heading of the same or higher level,
+    # found with a monotonic stack, and their counts are summed by prefix sums
+    prefix_counts = [0]
+    for chunk in chunks:
+        prefix_counts.append(prefix_counts[-1] + chunk["char_count"])
+    section_ends = [len(chunks)] * len(chunks)
+    stack = []
+    for i, chunk in enumerate(chunks):
+        while stack and chunks[stack[-1]]["level"] >= chunk["level"]:
+            section_ends[stack.pop()] = i
+        stack.append(i)
 
     # Add hierarchical statistics to each chunk
     for i, chunk in enumerate(chunks):
@@ -117,7 +107,7 @@ def calculate_hierarchical_counts(chunks):
         chunk["direct_char_count"] = chunk["char_count"]
 
         # Children content character count
-        children_count = get_children_count(i, chunk["level"])
+        children_count = prefix_counts[section_ends[i]] - prefix_counts[i + 1]
         chunk["children_char_count"] = children_count
 
         # Total character count (self + all children)
@@ -176,7 +166,7 @@ def get_tree_structure(markdown: str, add_tag: bool = True):
     chunks = count_markdown_chunks(markdown.strip())
     chunks_with_hierarchy = calculate_hierarchical_counts(chunks)
 
-    tree = ""
+    tree = []
     for chunk in chunks_with_hierarchy:
         indent = "  " * (chunk["level"] - 1)
         tree_symbol = "├─" if chunk["level"] > 1 else "■"
@@ -185,12 +175,12 @@ def get_tree_structure(markdown: str, add_tag: bool = True):
         else:
             heading = chunk["heading"]
 
-        tree += (
+        tree.append(
             f"{indent}{tree_symbol} {heading} "
             f"[Direct:{chunk['direct_char_count']} | Total Characters:{chunk['total_char_count']}]\n"
         )
 
-    return tree
+    return "".join(tree)
 
 
 def find_middle_heading_position(text: str) -> int:
@@ -211,7 +201,7 @@ def find_middle_heading_position(text: str) -> int:
     char_pos = 0
 
     for i, line in enumerate(lines):
-        if re.match(r"^#{1,6}\s+.+", line):
+        if MARKDOWN_HEADING_REGEX.match(line):
             heading_positions.append((i, char_pos))
         char_pos += len(line)
 
@@ -242,23 +232,53 @@ def split_large_chunks(sections: list[str]) -> list[str]:
             result.append(section)
             continue
 
-        # Try to split the section at a heading near the middle
+        # the lines, their offsets and the headings are found once for all the splits of a section
         lines = section.splitlines()
-        middle_heading_idx = find_middle_heading_position(section)
+        offsets = list(accumulate(map(len, lines), initial=0))
+        headings = [
+            i for i, line in enumerate(lines) if MARKDOWN_HEADING_REGEX.match(line)
+        ]
 
-        # If no headings found or can't split further, just keep as is
-        if middle_heading_idx == -1:
+        # If no headings found, just keep as is
+        if len(headings) < 2:
             result.append(section)
             continue
+        result.extend(_split_line_range(lines, offsets, headings, 0, len(lines)))
 
-        # Split the section at the middle heading
-        first_part = "\n".join(lines[:middle_heading_idx]).strip()
-        second_part = "\n".join(lines[middle_heading_idx:]).strip()
+    return result
 
-        # Recursively split if still too large
-        result.extend(split_large_chunks([first_part, second_part]))
 
-    return result
+def _split_line_range(
+    lines: list[str], offsets: list[int], headings: list[int], start: int, stop: int
+) -> list[str]:
+    """
+    Recursively split the lines `start:stop` of a section at the heading nearest to their middle.
+
+    Args:
+        lines (list[str]): The lines of the section.
+        offsets (list[int]): The character offset of each line, not counting the newlines.
+        headings (list[int]): The indices of the heading lines.
+        start (int): The first line of the range.
+        stop (int): The end of the range, exclusive.
+
+    Returns:
+        list[str]: The chunks of the range.
+    """
+    text = "\n".join(lines[start:stop]).strip()
+    first, last = bisect_left(headings, start), bisect_left(headings, stop)
+    if len(text) <= MAX_CHUNK_SIZE or last - first < 2:
+        return [text]
+
+    # a heading on the first line would leave an empty first part
+    first += headings[first] == start
+    middle = offsets[start] + len(text) // 2
+    pos = bisect_left(headings, middle, first, last, key=offsets.__getitem__)
+    split = min(
+        headings[max(pos - 1, first) : min(pos + 1, last)],
+        key=lambda i: abs(offsets[i] - middle),
+    )
+    first_part = _split_line_range(lines, offsets, headings, start, split)
+    return first_part + _split_line_range(lines, offsets, headings, split, stop)
 
 
 # global context variable for allowed headings, used to validate headings in async context
@@ -302,7 +322,7 @@ async def split_markdown_by_headings(
         logic_headings = headings
     else:
         logic_headings = await language_model(
-            HEADING_EXTRACT_PROMPT.render(tree=document_tree),
+            get_prompt_template("document/heading_extract.txt").render(tree=document_tree),
             return_json=True,
             response_format=LogicHeadings.response_model(headings),
         )
@@ -311,8 +331,9 @@ async def split_markdown_by_headings(
     sections = []
     current_section = []
 
+    heading_prefixes = tuple(logic_headings)
     for line in markdown_content.splitlines():
-        if any(line.startswith(h) for h in logic_headings):
+        if line.startswith(heading_prefixes):
             if len(current_section) != 0:
                 sections.append("\n".join(current_section).strip())
             current_section = [line]
@@ -323,9 +344,18 @@ async def split_markdown_by_headings(
         sections.append("\n".join(current_section).strip())
 
     # if a chunk is too small, merge it with the previous chunk
-    for i in reversed(range(1, len(sections))):
-        if len(sections[i]) < MIN_CHUNK_SIZE:
-            sections[i - 1] += "\n\n" + sections.pop(i)
+    merged_sections = []
+    small_section = None
+    for i in reversed(range(len(sections))):
+        section = sections[i]
+        if small_section is not None:
+            section += "\n\n" + small_section
+        if i > 0 and len(section) < MIN_CHUNK_SIZE:
+            small_section = section
+        else:
+            merged_sections.append(section)
+            small_section = None
+    sections = merged_sections[::-1]
 
     if len(sections) > 1 and len(sections[0]) < MIN_CHUNK_SIZE:
         sections[0] += "\n\n" + sections.pop(1)
@@ -372,24 +402,24 @@ def process_markdown_content(
         else:
             paragraphs.append(paragraph)
 
-    # Add context to each media element
-    for media in medias_chunks:
-        pre_chunk = ""
-        after_chunk = ""
-
-        # Get preceding context
-        for chunk in paragraphs[: media["index"]]:
-            pre_chunk += chunk["markdown_content"] + "\n\n"
-            if len(pre_chunk) > max_chunk_size:
-                break
+    # Add context to each media element, by windows over the prefix sums of paragraph lengths
+    contents = [p["markdown_content"] + "\n\n" for p in paragraphs]
+    prefix_lengths = [0]
+    for content in contents:
+        prefix_lengths.append(prefix_lengths[-1] + len(content))
 
-        # Get following context
-        for chunk in paragraphs[media["index"] + 1 :]:
-            after_chunk += chunk["markdown_content"] + "\n\n"
-            if len(after_chunk) > max_chunk_size:
-                break
+    def context_window(start: int, stop: int) -> str:
+        # paragraphs from start until the context exceeds max_chunk_size
+        if start >= len(contents):
+            return ""
+        end = bisect_right(prefix_lengths, prefix_lengths[start] + max_chunk_size)
+        return "".join(contents[start : min(end, stop)])
 
-        media["near_chunks"] = (pre_chunk, after_chunk)
+    for media in medias_chunks:
+        media["near_chunks"] = (
+            context_window(0, media["index"]),
+            context_window(media["index"] + 1, len(contents)),
+        )
 
     cleaned_markdown = "\n\n".join([p["markdown_content"] for p in paragraphs])
     return cleaned_markdown, medias_chunks
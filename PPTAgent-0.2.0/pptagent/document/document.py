@@ -4,7 +4,6 @@ import re
 from contextlib import AsyncExitStack
 from os.path import basename, exists, join
 
-from jinja2 import Environment, StrictUndefined
 from pydantic import BaseModel, Field, create_model
 
 from pptagent.agent import Agent
@@ -13,7 +12,7 @@ from pptagent.model_utils import language_id
 from pptagent.utils import (
     Language,
     get_logger,
-    package_join,
+    get_prompt_template,
 )
 
 from .doc_utils import (
@@ -25,13 +24,6 @@ from .element import Media, Metadata, Section, SubSection, Table, link_medias
 
 logger = get_logger(__name__)
 
-env = Environment(undefined=StrictUndefined)
-
-MERGE_METADATA_PROMPT = env.from_string(
-    open(
-        package_join("prompts", "document", "merge_metadata.txt"), encoding="utf-8"
-    ).read()
-)
 LITERAL_CONSTRAINT = os.getenv("LITERAL_CONSTRAINT", "false").lower() == "true"
 
 
@@ -190,7 +182,7 @@ class Document(BaseModel):
             sections.append(section)
 
         merged_metadata = await language_model(
-            MERGE_METADATA_PROMPT.render(metadata=metadata),
+            get_prompt_template("document/merge_metadata.txt").render(metadata=metadata),
             return_json=True,
             response_format=create_model(
                 "MetadataList",
@@ -2,35 +2,22 @@ import hashlib
 import re
 from os.path import exists, join
 
-from jinja2 import Environment, StrictUndefined
+import Levenshtein
+import numpy as np
 from PIL import Image
 from pydantic import BaseModel, Field, create_model
 
+from pptagent.captioner import CaptionService, get_caption_service
 from pptagent.llms import AsyncLLM
 from pptagent.utils import (
-    edit_distance,
     get_html_table_image,
     get_logger,
-    package_join,
+    get_prompt_template,
 )
 
 from .doc_utils import parse_table_with_merges
 
-env = Environment(undefined=StrictUndefined)
-
 IMAGE_PARSING_REGEX = re.compile(r"\((.*?)\)")
-TABLE_CAPTION_PROMPT = env.from_string(
-    open(
-        package_join("prompts", "document", "markdown_table_caption.txt"),
-        encoding="utf-8",
-    ).read()
-)
-IMAGE_CAPTION_PROMPT = env.from_string(
-    open(
-        package_join("prompts", "document", "markdown_image_caption.txt"),
-        encoding="utf-8",
-    ).read()
-)
 
 logger = get_logger(__name__)
 
@@ -60,14 +47,22 @@ class Media(BaseModel):
         assert exists(image_path), f"image file not found: {image_path}"
         self.path = image_path
 
-    async def get_caption(self, vision_model: AsyncLLM):
+    async def get_caption(
+        self, vision_model: AsyncLLM, caption_service: CaptionService | None = None
+    ):
         assert self.path is not None, "Path is required to get caption"
         if self.caption is None:
-            self.caption = await vision_model(
-                IMAGE_CAPTION_PROMPT.render(
-                    markdown_caption=self.near_chunks,
+            caption_service = caption_service or get_caption_service()
+            self.caption = await caption_service.caption(
+                CaptionService.image_key(
+                    "document_image", vision_model.model, self.path
+                ),
+                lambda: vision_model(
+                    get_prompt_template("document/markdown_image_caption.txt").render(
+                        markdown_caption=self.near_chunks,
+                    ),
+                    self.path,
                 ),
-                self.path,
             )
             logger.debug(f"Caption: {self.caption}")
 
@@ -90,13 +85,21 @@ class Table(Media):
             )
         get_html_table_image(self.markdown_content, self.path)
 
-    async def get_caption(self, language_model: AsyncLLM):
+    async def get_caption(
+        self, language_model: AsyncLLM, caption_service: CaptionService | None = None
+    ):
         if self.caption is None:
-            self.caption = await language_model(
-                TABLE_CAPTION_PROMPT.render(
-                    markdown_content=self.markdown_content,
-                    markdown_caption=self.near_chunks,
-                )
+            caption_service = caption_service or get_caption_service()
+            self.caption = await caption_service.caption(
+                CaptionService.text_key(
+                    "document_table", language_model.model, self.markdown_content
+                ),
+                lambda: language_model(
+                    get_prompt_template("document/markdown_table_caption.txt").render(
+                        markdown_content=self.markdown_content,
+                        markdown_caption=self.near_chunks,
+                    )
+                ),
             )
             logger.debug(f"Caption: {self.caption}")
 
@@ -169,21 +172,107 @@ def link_medias(
         else:
             media_instances.append(Media(**media_dict))
 
+    index = SubSectionIndex(
+        [block for block in section.content if isinstance(block, SubSection)]
+    )
+
     # Find the best insertion position for each media
     for media in media_instances:
         if len(media.near_chunks[0]) < max_chunk_size:
             # If context is small, insert at the beginning
             section.content.insert(0, media)
+            continue
+
+        # Find the most similar SubSection based on content
+        best_match = index.most_similar(media.near_chunks[0])
+        if best_match is None:
+            section.content.insert(1, media)
         else:
-            # Find the most similar SubSection based on content
-            best_match_idx = 0
-            best_similarity = 0
+            best_match_idx = next(
+                i for i, block in enumerate(section.content) if block is best_match
+            )
+            section.content.insert(best_match_idx + 1, media)
 
-            for i, block in enumerate(section.content):
-                if isinstance(block, SubSection):
-                    similarity = edit_distance(media.near_chunks[0], block.content)
-                    if similarity > best_similarity:
-                        best_similarity = similarity
-                        best_match_idx = i
 
-            section.content.insert(best_match_idx + 1, media)
+class SubSectionIndex:
+    """
+    Find the subsection most similar to a text by `edit_distance` without computing it for every subsection.
+
+    The character histograms of the subsections are computed once, the histogram difference with
+    a text gives a lower bound of their edit distance, as each edit removes and adds at most one
+    character. Subsections are visited in decreasing order of the resulting similarity bound and
+    pruned once the bound cannot beat the best match, the remaining edit distances are computed
+    with a cutoff.
+    """
+
+    NUM_BUCKETS = 256
+
+    def __init__(self, subsections: list[SubSection]):
+        """
+        Initialize the SubSectionIndex.
+
+        Args:
+            subsections (list[SubSection]): The subsections in the order of the section.
+        """
+        self.subsections = subsections
+        self.lengths = np.array([len(block.content) for block in subsections])
+        self.histograms = np.zeros((len(subsections), self.NUM_BUCKETS), dtype=np.int64)
+        for i, block in enumerate(subsections):
+            self.histograms[i] = self._histogram(block.content)
+
+    @classmethod
+    def _histogram(cls, text: str) -> np.ndarray:
+        # Folding characters into buckets keeps the bound valid
+        codepoints = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        return np.bincount(codepoints % cls.NUM_BUCKETS, minlength=cls.NUM_BUCKETS)
+
+    def most_similar(self, text: str) -> SubSection | None:
+        """
+        Find the subsection with the highest `edit_distance` similarity to the text, the first one on ties.
+
+        Args:
+            text (str): The text to match.
+
+        Returns:
+            SubSection | None: The most similar subsection, None if no subsection is similar at all.
+        """
+        if not self.subsections:
+            return None
+        diff = self._histogram(text) - self.histograms
+        lower_bounds = np.maximum(
+            np.clip(diff, 0, None).sum(axis=1), np.clip(-diff, 0, None).sum(axis=1)
+        )
+        max_lens = np.maximum(self.lengths, len(text))
+
+        candidates = []
+        for order, (lower_bound, max_len) in enumerate(
+            zip(lower_bounds.tolist(), max_lens.tolist())
+        ):
+            upper_bound = 1 - lower_bound / max_len if max_len else 1.0
+            candidates.append((upper_bound, order))
+        candidates.sort(key=lambda x: (-x[0], x[1]))
+
+        best_order, best_similarity = None, 0
+        for upper_bound, order in candidates:
+            if upper_bound < best_similarity or (
+                upper_bound == best_similarity
+                and (best_order is None or order > best_order)
+            ):
+                break
+            content = self.subsections[order].content
+            max_len = max(len(text), len(content))
+            if max_len == 0:
+                similarity = 1.0
+            else:
+                cutoff = int((1 - best_similarity) * max_len) + 1
+                distance = Levenshtein.distance(text, content, score_cutoff=cutoff)
+                if distance > cutoff:
+                    continue
+                similarity = 1 - distance / max_len
+            if similarity > best_similarity or (
+                similarity == best_similarity
+                and best_order is not None
+                and order < best_order
+            ):
+                best_order, best_similarity = order, similarity
+        return None if best_order is None else self.subsections[best_order]
@@ -5,7 +5,6 @@ from functools import partial
 from os.path import join
 
 from aiometer import run_all
-from jinja2 import Template
 
 from pptagent.agent import Agent
 from pptagent.llms import AsyncLLM
@@ -20,18 +19,13 @@ from pptagent.response import SlideSchema
 from pptagent.utils import (
     Config,
     get_logger,
+    get_prompt_template,
     is_image_path,
-    package_join,
+    load_prompt,
 )
 
 logger = get_logger(__name__)
 
-CATEGORY_SPLIT_TEMPLATE = Template(
-    open(package_join("prompts", "category_split.txt"), encoding="utf-8").read()
-)
-ASK_CATEGORY_PROMPT = open(
-    package_join("prompts", "ask_category.txt"), encoding="utf-8"
-).read()
 
 
 class SlideInducter:
@@ -97,7 +91,7 @@ class SlideInducter:
         Async version: Split slides into categories based on their functional purpose.
         """
         functional_cluster = await self.language_model(
-            CATEGORY_SPLIT_TEMPLATE.render(slides=self.prs.to_text()),
+            get_prompt_template("category_split.txt").render(slides=self.prs.to_text()),
             return_json=True,
         )
         assert isinstance(functional_cluster, dict) and all(
@@ -139,7 +133,7 @@ class SlideInducter:
 
                     tg.create_task(
                         self.vision_model(
-                            ASK_CATEGORY_PROMPT,
+                            load_prompt("ask_category.txt"),
                             join(self.ppt_image_folder, f"slide_{template_id:04d}.jpg"),
                         )
                     ).add_done_callback(
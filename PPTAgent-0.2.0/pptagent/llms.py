@@ -1,16 +1,21 @@
 import base64
 import re
-import threading
 from dataclasses import dataclass
 from enum import Enum
+from functools import partial
+from typing import TYPE_CHECKING
 
-from oaib import Auto
-from openai import AsyncOpenAI, OpenAI
-from openai.types.chat import ChatCompletion
 from pydantic import BaseModel
 
+from pptagent.batch import get_batch_collector
+from pptagent.replay import get_llm_recorder
+from pptagent.telemetry import trace_llm_call
 from pptagent.utils import get_json_from_response, get_logger, tenacity_decorator
 
+# openai takes about a second to import, it is imported when the first client is created
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletion
+
 logger = get_logger(__name__)
 MAX_CONTEXT_SIZE = 32768
 
@@ -40,6 +45,8 @@ class LLM:
     timeout: int = 360
 
     def __post_init__(self):
+        from openai import OpenAI
+
         self.client = OpenAI(
             base_url=self.base_url, api_key=self.api_key, timeout=self.timeout
         )
@@ -80,19 +87,21 @@ class LLM:
             content, think_mode, images, system_message
         )
         try:
-            if response_format is not None:
-                completion: ChatCompletion = self.client.chat.completions.parse(
-                    model=self.model,
-                    messages=system + history + message,
-                    response_format=response_format,
-                    **client_kwargs,
-                )
-            else:
-                completion: ChatCompletion = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=system + history + message,
-                    **client_kwargs,
-                )
+            with trace_llm_call(self.model) as call:
+                if response_format is not None:
+                    call.completion = self.client.chat.completions.parse(
+                        model=self.model,
+                        messages=system + history + message,
+                        response_format=response_format,
+                        **client_kwargs,
+                    )
+                else:
+                    call.completion = self.client.chat.completions.create(
+                        model=self.model,
+                        messages=system + history + message,
+                        **client_kwargs,
+                    )
+            completion: ChatCompletion = call.completion
 
         except Exception as e:
             logger.warning("Error in LLM (%s) service: %s", self.model, e)
@@ -237,7 +246,8 @@ class LLM:
 class AsyncLLM(LLM):
     use_batch: bool = False
     """
-    Asynchronous wrapper class for language model interaction.
+    Asynchronous wrapper class for language model interaction,
+    calls are collected into batches if `use_batch` is set, see `pptagent.batch`.
     """
 
     def __post_init__(self):
@@ -249,18 +259,13 @@ class AsyncLLM(LLM):
             base_url (str): The base URL for the API.
             api_key (str): API key for authentication. Defaults to environment variable.
         """
+        from openai import AsyncOpenAI
+
         self.client = AsyncOpenAI(
             base_url=self.base_url,
             api_key=self.api_key,
             timeout=self.timeout,
         )
-        if self.use_batch:
-            self.batch = Auto(
-                base_url=self.base_url,
-                api_key=self.api_key,
-                timeout=self.timeout,
-                loglevel=0,
-            )
 
     @tenacity_decorator
     async def __call__(
@@ -292,51 +297,34 @@ class AsyncLLM(LLM):
         """
         if "qwen3" in self.model.lower():
             client_kwargs.update(think_mode.client_kwargs)
-        if self.use_batch and threading.current_thread() is threading.main_thread():
-            self.batch = Auto(
-                base_url=self.base_url,
-                api_key=self.api_key,
-                timeout=self.timeout,
-                loglevel=0,
-            )
-        elif self.use_batch:
-            logger.warning(
-                "Warning: AsyncLLM is not running in the main thread, may cause race condition."
-            )
         if history is None:
             history = []
         system, message = self.format_message(
             content, think_mode, images, system_message
         )
+        messages = system + history + message
         try:
-            if self.use_batch:
-                await self.batch.add(
-                    "chat.completions.create",
-                    model=self.model,
-                    messages=system + history + message,
-                    response_format=response_format,
-                    **client_kwargs,
-                )
-                completion = await self.batch.run()
-                if "result" not in completion or len(completion["result"]) != 1:
-                    raise ValueError(
-                        f"The length of completion result should be 1, but got {completion}.\nRace condition may have occurred if multiple values are returned.\nOr, there was an error in the LLM call, use the synchronous version to check."
-                    )
-                completion = ChatCompletion(**completion["result"][0])
-            else:
-                if response_format is None:
-                    completion = await self.client.chat.completions.create(
-                        model=self.model,
-                        messages=system + history + message,
-                        **client_kwargs,
+            with trace_llm_call(self.model) as call:
+                recorder = get_llm_recorder()
+                if recorder is None:
+                    call.completion = await self._complete(
+                        messages, response_format, client_kwargs
                     )
                 else:
-                    completion = await self.client.chat.completions.parse(
-                        model=self.model,
-                        messages=system + history + message,
-                        response_format=response_format,
+                    request = {
+                        "model": self.model,
+                        "messages": messages,
                         **client_kwargs,
+                    }
+                    if response_format is not None:
+                        request["response_format"] = response_format.model_json_schema()
+                    call.completion = await recorder.complete(
+                        request,
+                        partial(
+                            self._complete, messages, response_format, client_kwargs
+                        ),
                     )
+            completion = call.completion
 
         except Exception as e:
             logger.error("Error in AsyncLLM call: %s", e)
@@ -345,25 +333,49 @@ class AsyncLLM(LLM):
         message.append({"role": "assistant", "content": response})
         return self.__post_process__(response, message, return_json, return_message)
 
+    async def _complete(
+        self,
+        messages: list,
+        response_format: BaseModel | None,
+        client_kwargs: dict,
+    ) -> "ChatCompletion":
+        if self.use_batch:
+            body = {"model": self.model, "messages": messages, **client_kwargs}
+            if response_format is not None:
+                body["response_format"] = {
+                    "type": "json_schema",
+                    "json_schema": {
+                        "name": response_format.__name__,
+                        "schema": response_format.model_json_schema(),
+                    },
+                }
+            return await get_batch_collector(self.client).submit(body)
+        elif response_format is None:
+            return await self.client.chat.completions.create(
+                model=self.model, messages=messages, **client_kwargs
+            )
+        else:
+            return await self.client.chat.completions.parse(
+                model=self.model,
+                messages=messages,
+                response_format=response_format,
+                **client_kwargs,
+            )
+
     def __getstate__(self):
         state = self.__dict__.copy()
         state["client"] = None
-        state["batch"] = None
         return state
 
     def __setstate__(self, state: dict):
+        from openai import AsyncOpenAI
+
         self.__dict__.update(state)
         self.client = AsyncOpenAI(
             base_url=self.base_url,
             api_key=self.api_key,
             timeout=self.timeout,
         )
-        self.batch = Auto(
-            base_url=self.base_url,
-            api_key=self.api_key,
-            timeout=self.timeout,
-            loglevel=0,
-        )
 
     async def test_connection(self) -> bool:
         """
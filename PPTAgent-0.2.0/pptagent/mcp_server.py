@@ -1,26 +1,39 @@
-import json
+import asyncio
+import copy
 import os
+import time
+from dataclasses import dataclass, field
 from glob import glob
 from math import ceil
 from os.path import exists, join
 from pathlib import Path
 from random import shuffle
+from shutil import which
 
-from fastmcp import FastMCP
+from fastmcp import Context, FastMCP
 
 from pptagent.llms import AsyncLLM
 from pptagent.multimodal import ImageLabler
 from pptagent.pptgen import PPTAgent, get_length_factor
-from pptagent.presentation import Presentation
+from pptagent.presentation import Presentation, SlidePage
 from pptagent.presentation.layout import Layout
 from pptagent.response.pptgen import (
     EditorOutput,
     SlideElement,
 )
-from pptagent.utils import Config, Language, get_logger, package_join
+from pptagent.template_cache import TEMPLATE_CACHE_DIR, get_template_cache
+from pptagent.utils import Language, get_logger, package_join
 
 logger = get_logger(__name__)
 
+# Parse every template at startup instead of when it is first selected
+MCP_PRELOAD = os.getenv("PPTAGENT_MCP_PRELOAD", "false").lower() == "true"
+# Seconds after which an idle client session and its slides are dropped
+MCP_SESSION_TTL = int(os.getenv("PPTAGENT_MCP_SESSION_TTL", 3600))
+# Render a preview image of each generated slide, it requires LibreOffice
+MCP_PREVIEW = os.getenv("PPTAGENT_MCP_PREVIEW", "false").lower() == "true"
+MCP_PREVIEW_DIR = join(TEMPLATE_CACHE_DIR, "previews")
+
 
 def mcp_slide_validate(editor_output: EditorOutput, layout: Layout, prs_lang: Language):
     warnings = []
@@ -47,6 +60,43 @@ def mcp_slide_validate(editor_output: EditorOutput, layout: Layout, prs_lang: La
     return warnings, errors
 
 
+@dataclass
+class MCPSession:
+    """
+    The generation state of an MCP client session.
+    """
+
+    agent: PPTAgent | None = None
+    template_name: str | None = None
+    layout: Layout | None = None
+    editor_output: EditorOutput | None = None
+    slides: list[SlidePage] = field(default_factory=list)
+    empty_prs: Presentation | None = None
+    last_active: float = field(default_factory=time.monotonic)
+
+    def set_reference(self, template_name: str, reference: PPTAgent):
+        """
+        Generate with a template, sharing its parsed presentation and layouts
+        with other sessions and using agents of its own.
+        """
+        self.agent = copy.copy(reference)
+        self.agent.staffs = {
+            role: staff.clone() for role, staff in reference.staffs.items()
+        }
+        self.template_name = template_name
+        self.layout = None
+        self.editor_output = None
+        self.slides = []
+        self.empty_prs = None
+
+    def get_empty_prs(self) -> Presentation:
+        # slides are built into it, so each session needs its own
+        if self.empty_prs is None:
+            self.empty_prs = self.agent.presentation.empty_copy()
+            self.agent.empty_prs = self.empty_prs
+        return self.empty_prs
+
+
 class PPTAgentServer(PPTAgent):
     roles = [
         "coder",
@@ -55,9 +105,9 @@ class PPTAgentServer(PPTAgent):
     def __init__(self):
         self.source_doc = None
         self.mcp = FastMCP("PPTAgent")
-        self.slides = []
-        self.layout: Layout | None = None
-        self.editor_output: EditorOutput | None = None
+        self.sessions: dict[str, MCPSession] = {}
+        self._references: dict[str, PPTAgent] = {}
+        self._reference_locks: dict[str, asyncio.Lock] = {}
         model = AsyncLLM(
             os.getenv("PPTAGENT_MODEL"),
             os.getenv("PPTAGENT_API_BASE"),
@@ -81,6 +131,64 @@ class PPTAgentServer(PPTAgent):
             + ", ".join(self.template_description.keys())
         )
 
+    def load_reference(self, template_name: str) -> PPTAgent:
+        """
+        Parse a template into a generator referencing it, shared by the sessions selecting the template.
+
+        Args:
+            template_name (str): The name of the template.
+
+        Returns:
+            PPTAgent: The generator, which must not be modified.
+        """
+        # installed templates may be read-only, their presentations are cached per user
+        template_cache = get_template_cache(
+            package_join("templates", template_name),
+            cache_dir=join(TEMPLATE_CACHE_DIR, "templates", template_name),
+        )
+        prs = template_cache.load_presentation()
+        image_labler = ImageLabler(prs, template_cache.config)
+        image_labler.apply_stats(template_cache.load_json("image_stats.json"))
+        # a shallow copy shares the models and the MCP server
+        reference = copy.copy(self)
+        reference.set_reference(
+            slide_induction=template_cache.load_json("slide_induction.json"),
+            presentation=prs,
+        )
+        return reference
+
+    async def get_reference(self, template_name: str) -> PPTAgent:
+        """
+        Get the generator referencing a template, parsed once when first requested.
+        """
+        if template_name not in self._references:
+            lock = self._reference_locks.setdefault(template_name, asyncio.Lock())
+            async with lock:
+                if template_name not in self._references:
+                    self._references[template_name] = await asyncio.to_thread(
+                        self.load_reference, template_name
+                    )
+        return self._references[template_name]
+
+    def preload_templates(self):
+        """
+        Parse all templates, so selecting any of them is instant.
+        """
+        for template_name in self.template_description:
+            self._references[template_name] = self.load_reference(template_name)
+
+    def get_session(self, ctx: Context) -> MCPSession:
+        """
+        Get the state of the calling client session, dropping sessions idle for longer than MCP_SESSION_TTL.
+        """
+        now = time.monotonic()
+        for session_id, session in list(self.sessions.items()):
+            if now - session.last_active > MCP_SESSION_TTL:
+                del self.sessions[session_id]
+        session = self.sessions.setdefault(ctx.session_id, MCPSession())
+        session.last_active = now
+        return session
+
     def register_tools(self):
         @self.mcp.tool()
         def list_available_templates() -> list[dict]:
@@ -97,7 +205,7 @@ class PPTAgentServer(PPTAgent):
             }
 
         @self.mcp.tool()
-        def set_template(template_name: str = "default"):
+        async def set_template(ctx: Context, template_name: str = "default"):
             """Select a PowerPoint template by name.
 
             Args:
@@ -106,33 +214,22 @@ class PPTAgentServer(PPTAgent):
             Returns:
                 dict: Success message and list of available layouts
             """
-            template_folder = package_join("templates", template_name)
             assert template_name in self.template_description, (
                 f"Template {template_name} not available, please choose from {list(self.template_description.keys())}"
             )
-            prs_config = Config(template_folder)
-            prs = Presentation.from_file(
-                join(template_folder, "source.pptx"), prs_config
-            )
-            image_labler = ImageLabler(prs, prs_config)
-            image_labler.apply_stats(
-                json.load(open(join(template_folder, "image_stats.json")))
-            )
-            self.set_reference(
-                slide_induction=json.load(
-                    open(join(template_folder, "slide_induction.json"))
-                ),
-                presentation=prs,
+            session = self.get_session(ctx)
+            session.set_reference(
+                template_name, await self.get_reference(template_name)
             )
 
             return {
                 "message": "Template set successfully, please select layout from given layouts later",
                 "template_description": self.template_description[template_name],
-                "available_layouts": list(self.layouts.keys()),
+                "available_layouts": list(session.agent.layouts.keys()),
             }
 
         @self.mcp.tool()
-        async def create_slide(layout: str):
+        async def create_slide(ctx: Context, layout: str):
             """Create a slide with a given layout.
 
             Args:
@@ -141,26 +238,28 @@ class PPTAgentServer(PPTAgent):
             Returns:
                 dict: Success message, instructions, and content schema for the selected layout.
             """
-            assert self._initialized, (
+            session = self.get_session(ctx)
+            assert session.agent is not None, (
                 "PPTAgent not initialized, please call `set_template` first"
             )
-            assert layout in self.layouts, (
-                "Given layout was not in available layouts: " + ", ".join(self.layouts)
+            layouts = session.agent.layouts
+            assert layout in layouts, (
+                "Given layout was not in available layouts: " + ", ".join(layouts)
             )
-            if self.layout is not None:
-                message = "Layout update from " + self.layout.title + " to " + layout
+            if session.layout is not None:
+                message = "Layout update from " + session.layout.title + " to " + layout
                 message += "\nDid you forget to call `generate_slide` after setting slide content?"
             else:
                 message = "Layout " + layout + " selected successfully"
-            self.layout = self.layouts[layout]
+            session.layout = layouts[layout]
             return {
                 "message": message,
                 "instructions": "Generate slide content strictly following the schema below",
-                "schema": self.layout.content_schema,
+                "schema": session.layout.content_schema,
             }
 
         @self.mcp.tool()
-        async def write_slide(structured_slide_elements: list[dict]):
+        async def write_slide(ctx: Context, structured_slide_elements: list[dict]):
             """Write the slide elements for generating a PowerPoint slide.
             Note that this function will not generate a slide, you should call `generate_slide`.
 
@@ -178,20 +277,20 @@ class PPTAgentServer(PPTAgent):
             Returns:
                 dict: Success message, warnings, and errors
             """
-            self.structured_slide_elements = structured_slide_elements
-            assert self.layout is not None, (
+            session = self.get_session(ctx)
+            assert session.layout is not None, (
                 "Layout is not selected, please call `create_slide` before writing slide"
             )
             editor_output = EditorOutput(
                 elements=[SlideElement(**e) for e in structured_slide_elements]
             )
             warnings, errors = mcp_slide_validate(
-                editor_output, self.layout, self.reference_lang
+                editor_output, session.layout, session.agent.reference_lang
             )
             if errors:
                 raise ValueError("Errors:\n" + "\n".join(errors))
 
-            self.editor_output = editor_output
+            session.editor_output = editor_output
             if warnings:
                 return {
                     "message": "Slide elements set with warnings. Review warnings, consider resetting slide content, or proceed if acceptable.",
@@ -202,57 +301,70 @@ class PPTAgentServer(PPTAgent):
             }
 
         @self.mcp.tool()
-        async def generate_slide():
+        async def generate_slide(ctx: Context):
             """Generate a PowerPoint slide after layout and slide elements are set.
 
             Returns:
-                dict: Success message with slide number and next steps
+                dict: Success message with slide number and next steps, and the path of a preview image of the slide
             """
-            if self.editor_output is None:
+            session = self.get_session(ctx)
+            if session.editor_output is None:
                 raise ValueError(
                     "Slide elements are not set, please call `write_slide` before generating slide"
                 )
 
-            command_list, template_id = self._generate_commands(
-                self.editor_output, self.layout
+            session.get_empty_prs()
+            command_list, template_id = session.agent._generate_commands(
+                session.editor_output, session.layout
             )
-            slide, _ = await self._edit_slide(command_list, template_id)
+            slide, _ = await session.agent._edit_slide(command_list, template_id)
 
             # Reset state after successful generation
-            self.layout = None
-            self.editor_output = None
-            self.slides.append(slide)
+            session.layout = None
+            session.editor_output = None
+            session.slides.append(slide)
 
-            slide_number = len(self.slides)
-            available_layouts = list(self.layouts.keys())
+            slide_number = len(session.slides)
+            available_layouts = list(session.agent.layouts.keys())
             shuffle(available_layouts)
 
-            return {
+            result = {
                 "message": f"Slide {slide_number:02d} generated successfully",
                 "next_steps": "You can now save the slides or continue generating more slides",
                 "available_layouts": available_layouts,
             }
+            if MCP_PREVIEW and which("soffice") is not None:
+                try:
+                    result["preview"] = await session.agent.presentation.render_slide(
+                        slide, MCP_PREVIEW_DIR
+                    )
+                except Exception as e:
+                    logger.warning("Failed to render the preview of a slide: %s", e)
+            return result
 
         @self.mcp.tool()
-        async def save_generated_slides(pptx_path: str):
+        async def save_generated_slides(ctx: Context, pptx_path: str):
             """Save the generated slides to a PowerPoint file.
 
             Args:
                 pptx_path: The path to save the PowerPoint file
             """
-            assert len(self.slides), (
+            session = self.get_session(ctx)
+            assert len(session.slides), (
                 "No slides generated, please call `generate_slide` first"
             )
             os.makedirs(os.path.dirname(pptx_path), exist_ok=True)
-            self.empty_prs.slides = self.slides
-            self.empty_prs.save(pptx_path)
-            self.slides = []
-            self._initialized = False
-            return f"total {len(self.empty_prs.slides)} slides saved to {pptx_path}"
+            empty_prs = session.get_empty_prs()
+            empty_prs.slides = session.slides
+            await asyncio.to_thread(empty_prs.save, pptx_path)
+            del self.sessions[ctx.session_id]
+            return f"total {len(empty_prs.slides)} slides saved to {pptx_path}"
 
 
 def main():
     server = PPTAgentServer()
+    if MCP_PRELOAD:
+        server.preload_templates()
     server.register_tools()
     server.mcp.run(show_banner=False)
 
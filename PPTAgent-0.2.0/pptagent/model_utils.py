@@ -1,11 +1,19 @@
+import asyncio
+import hashlib
 import os
+import shutil
 import tempfile
+import threading
+import time
 import zipfile
+from collections import defaultdict
+from collections.abc import Callable
+from functools import partial
 from glob import glob
 from os.path import join
+from typing import TYPE_CHECKING, Any
 
 import aiofiles
-import aiohttp
 from PIL import Image
 
 from pptagent.llms import AsyncLLM
@@ -15,39 +23,57 @@ from pptagent.utils import (
     is_image_path,
 )
 
+if TYPE_CHECKING:
+    # imported when the first http session is created
+    import aiohttp
+
 logger = get_logger(__name__)
 
 # Lazy loading cache for the language ID model
 _LID_MODEL = None
+_LID_LOCK = threading.Lock()
+# Language detection reads this many windows of this many characters, evenly spaced over the text
+LID_WINDOWS = int(os.environ.get("PPTAGENT_LID_WINDOWS", 8))
+LID_WINDOW_SIZE = 256
+LID_CACHE_SIZE = 4096
+_LID_CACHE: dict[bytes, str] = {}
 
 
 def _get_lid_model():
-    from huggingface_hub.constants import HUGGINGFACE_HUB_CACHE
-
     """Get the language ID model, loading it lazily on first access."""
     global _LID_MODEL
-    if _LID_MODEL is None:
-        from fasttext import load_model
-        from huggingface_hub import hf_hub_download
-
-        lid_pattern = join(
-            HUGGINGFACE_HUB_CACHE,
-            "models--julien-c--fasttext-language-id",
-            "*/*/lid.176.bin",
-        )
-        lid_files = glob(lid_pattern)
-        if lid_files:
-            _LID_MODEL = load_model(lid_files[0])
-        else:
-            _LID_MODEL = load_model(
-                hf_hub_download(
-                    repo_id="julien-c/fasttext-language-id",
-                    filename="lid.176.bin",
-                )
+    with _LID_LOCK:
+        if _LID_MODEL is None:
+            from fasttext import load_model
+            from huggingface_hub import hf_hub_download
+
+            download = partial(
+                hf_hub_download,
+                repo_id="julien-c/fasttext-language-id",
+                filename="lid.176.bin",
             )
+            try:
+                # the cached model is used without asking the hub for updates
+                model_file = download(local_files_only=True)
+            except Exception:
+                model_file = download()
+            _LID_MODEL = load_model(model_file)
     return _LID_MODEL
 
 
+def warmup_language_id() -> None:
+    """
+    Load the language ID model ahead of the first detection, called when services start.
+    """
+    start = time.perf_counter()
+    try:
+        _get_lid_model().predict("warmup")
+    except Exception as e:
+        logger.warning("Failed to load the language ID model: %s", e)
+        return
+    logger.info("Language ID model loaded in %.2fs", time.perf_counter() - start)
+
+
 MINERU_API = os.environ.get("MINERU_API", None)
 if MINERU_API is None:
     logger.warning("MINERU_API is not set, PDF parsing is not available")
@@ -100,11 +126,41 @@ class ModelManager:
         return True
 
 
+def _sample_windows(text: str) -> list[str]:
+    if len(text) <= LID_WINDOWS * LID_WINDOW_SIZE:
+        windows = [text]
+    else:
+        step = (len(text) - LID_WINDOW_SIZE) // max(LID_WINDOWS - 1, 1)
+        windows = [
+            text[i * step : i * step + LID_WINDOW_SIZE] for i in range(LID_WINDOWS)
+        ]
+    # fasttext predicts on single lines
+    return [" ".join(window.split()) for window in windows]
+
+
 def language_id(text: str) -> Language:
-    model = _get_lid_model()
-    return Language(
-        lid=model.predict(text[:1024].replace("\n", ""))[0][0].replace("__label__", "")
-    )
+    """
+    Detect the language of a text from a bounded sample of it, so it takes the same time for any text length.
+    Results are memoized by the digest of the text.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        Language: The language with the highest total probability over the sampled windows.
+    """
+    key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    lid = _LID_CACHE.get(key)
+    if lid is None:
+        labels, probs = _get_lid_model().predict(_sample_windows(text))
+        scores = defaultdict(float)
+        for label, prob in zip(labels, probs):
+            scores[label[0]] += prob[0]
+        lid = max(scores, key=scores.get).replace("__label__", "")
+        if len(_LID_CACHE) >= LID_CACHE_SIZE:
+            _LID_CACHE.pop(next(iter(_LID_CACHE)))
+        _LID_CACHE[key] = lid
+    return Language(lid=lid)
 
 
 def get_image_model(device: str = None):
@@ -136,63 +192,117 @@ def get_image_model(device: str = None):
     )
 
 
-async def parse_pdf(pdf_path: str, output_folder: str):
+_HTTP_SESSION: tuple["aiohttp.ClientSession", asyncio.AbstractEventLoop] | None = None
+# Chunk size of streamed http responses
+CHUNK_SIZE = 1 << 16
+
+
+def _get_http_session() -> "aiohttp.ClientSession":
+    """Get the pooled http session of the running event loop."""
+    import aiohttp
+
+    global _HTTP_SESSION
+    loop = asyncio.get_running_loop()
+    if _HTTP_SESSION is None or _HTTP_SESSION[0].closed or _HTTP_SESSION[1] is not loop:
+        _HTTP_SESSION = (
+            aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)),
+            loop,
+        )
+    return _HTTP_SESSION[0]
+
+
+async def close_http_session() -> None:
+    """Close the pooled http session, e.g. on server shutdown."""
+    global _HTTP_SESSION
+    if _HTTP_SESSION is not None:
+        await _HTTP_SESSION[0].close()
+        _HTTP_SESSION = None
+
+
+def _extract_zip(zip_path: str, output_folder: str) -> int:
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        top_level = {
+            name.split("/", 1)[0] for name in zip_ref.namelist() if name.strip()
+        }
+        if len(top_level) != 1:
+            raise RuntimeError("Expected exactly one top-level folder in zip")
+        prefix = list(top_level)[0] + "/"
+
+        output_root = os.path.realpath(output_folder)
+        num_files = 0
+        for member in zip_ref.infolist():
+            if member.is_dir():
+                continue
+            dest_path = os.path.realpath(
+                join(output_folder, member.filename.removeprefix(prefix))
+            )
+            if not dest_path.startswith(output_root + os.sep):
+                raise RuntimeError(f"Unsafe path in zip: {member.filename}")
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            with zip_ref.open(member) as src, open(dest_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+            num_files += 1
+    return num_files
+
+
+async def parse_pdf(
+    pdf_path: str,
+    output_folder: str,
+    progress_callback: Callable[[str, int, int | None], Any] | None = None,
+) -> str:
     """
     Parse a PDF file and extract text and images.
 
+    The PDF is uploaded and the zipped result is downloaded as streams, and the zip is
+    extracted in a worker thread, so large papers neither spike memory nor block the event loop.
+
     Args:
         pdf_path (str): The path to the PDF file.
-        output_path (str): The root directory to save the extracted content.
+        output_folder (str): The root directory to save the extracted content.
+        progress_callback (Callable[[str, int, int | None], Any] | None): Called with the stage
+            ("download" or "extract"), the finished and the total amount (bytes or files, None if unknown).
 
     Returns:
-        str: The path to the extracted folder
+        str: The markdown content of the PDF.
     """
     assert MINERU_API is not None, "MINERU_API is not set"
     os.makedirs(output_folder, exist_ok=True)
 
-    async with aiofiles.open(pdf_path, "rb") as f:
-        pdf_content = await f.read()
+    import aiohttp
 
-    data = aiohttp.FormData()
-    data.add_field(
-        "files",
-        pdf_content,
-        filename=os.path.basename(pdf_path),
-        content_type="application/pdf",
-    )
-    data.add_field("return_images", "True")
-    data.add_field("response_format_zip", "True")
+    with tempfile.TemporaryDirectory() as temp_dir, open(pdf_path, "rb") as pdf_file:
+        data = aiohttp.FormData()
+        data.add_field(
+            "files",
+            pdf_file,
+            filename=os.path.basename(pdf_path),
+            content_type="application/pdf",
+        )
+        data.add_field("return_images", "True")
+        data.add_field("response_format_zip", "True")
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(MINERU_API, data=data) as response:
+        zip_path = join(temp_dir, "result.zip")
+        async with _get_http_session().post(MINERU_API, data=data) as response:
             response.raise_for_status()
-            
-            # 使用manerU进行pdf的解析，返回的content是md
-            content = await response.read()
-            logger.info(f"解析pdf......完成{content}")
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".zip") as tmp:
-                tmp.write(content)
-                zip_path = tmp.name
-
-            with zipfile.ZipFile(zip_path, "r") as zip_ref:
-                top_level = {
-                    name.split("/", 1)[0] for name in zip_ref.namelist() if name.strip()
-                }
-                if len(top_level) != 1:
-                    raise RuntimeError("Expected exactly one top-level folder in zip")
-                prefix = list(top_level)[0] + "/"
-
-                for member in zip_ref.infolist():
-                    filename = member.filename
-                    dest_path = os.path.join(
-                        output_folder, filename.removeprefix(prefix)
-                    )
-
-                    if not member.is_dir():
-                        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-                        with zip_ref.open(member) as src, open(dest_path, "wb") as dst:
-                            dst.write(src.read())
-    return content
+            received = 0
+            async with aiofiles.open(zip_path, "wb") as f:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    await f.write(chunk)
+                    received += len(chunk)
+                    if progress_callback is not None:
+                        progress_callback("download", received, response.content_length)
+        logger.debug("Downloaded parsed result of %s: %d bytes", pdf_path, received)
+
+        num_files = await asyncio.to_thread(_extract_zip, zip_path, output_folder)
+        if progress_callback is not None:
+            progress_callback("extract", num_files, num_files)
+
+    markdown_files = sorted(glob(join(output_folder, "*.md")))
+    if len(markdown_files) == 0:
+        raise RuntimeError(f"No markdown file was extracted from {pdf_path}")
+    async with aiofiles.open(markdown_files[0], encoding="utf-8") as f:
+        return await f.read()
+
 
 def get_image_embedding(
     image_dir: str, extractor, model, batchsize: int = 16
@@ -3,9 +3,10 @@ from os.path import basename, join
 
 import PIL.Image
 
+from pptagent.captioner import CaptionService, get_caption_service
 from pptagent.llms import LLM, AsyncLLM
 from pptagent.presentation import Picture, Presentation
-from pptagent.utils import Config, get_logger, package_join
+from pptagent.utils import Config, get_logger, load_prompt
 
 logger = get_logger(__name__)
 
@@ -42,12 +43,15 @@ class ImageLabler:
                     caption = image_stats[basename(shape.img_path)]["caption"]
                     shape.caption = max(caption.split("\n"), key=len)
 
-    async def caption_images_async(self, vision_model: AsyncLLM):
+    async def caption_images_async(
+        self, vision_model: AsyncLLM, caption_service: CaptionService | None = None
+    ):
         """
         Generate captions for images in the presentation asynchronously.
 
         Args:
             vision_model (AsyncLLM): The async vision model to use for captioning.
+            caption_service (CaptionService | None): The service deduplicating captions, defaults to the process-wide one.
 
         Returns:
             dict: Dictionary containing image stats with captions.
@@ -55,25 +59,23 @@ class ImageLabler:
         assert isinstance(vision_model, AsyncLLM), (
             "vision_model must be an AsyncLLM instance"
         )
-        caption_prompt = open(
-            package_join("prompts", "caption.txt"), encoding="utf-8"
-        ).read()
+        caption_prompt = load_prompt("caption.txt")
+
+        caption_service = caption_service or get_caption_service()
+
+        async def caption_image(image: str):
+            image_path = join(self.config.IMAGE_DIR, image)
+            caption = await caption_service.caption(
+                CaptionService.image_key("image", vision_model.model, image_path),
+                lambda: vision_model(caption_prompt, image_path),
+            )
+            self.image_stats[image]["caption"] = caption
+            logger.debug("captioned %s: %s", image, caption)
 
         async with asyncio.TaskGroup() as tg:
             for image, stats in self.image_stats.items():
                 if "caption" not in stats:
-                    task = tg.create_task(
-                        vision_model(
-                            caption_prompt,
-                            join(self.config.IMAGE_DIR, image),
-                        )
-                    )
-                    task.add_done_callback(
-                        lambda t, image=image: (
-                            self.image_stats[image].update({"caption": t.result()}),
-                            logger.debug("captioned %s: %s", image, t.result()),
-                        )
-                    )
+                    tg.create_task(caption_image(image))
 
         self.apply_stats()
         return self.image_stats
@@ -89,9 +91,7 @@ class ImageLabler:
             dict: Dictionary containing image stats with captions.
         """
         assert isinstance(vision_model, LLM), "vision_model must be an LLM instance"
-        caption_prompt = open(
-            package_join("prompts", "caption.txt"), encoding="utf-8"
-        ).read()
+        caption_prompt = load_prompt("caption.txt")
         for image, stats in self.image_stats.items():
             if "caption" not in stats:
                 stats["caption"] = vision_model(
@@ -1,124 +1,314 @@
+import asyncio
 import json
 import os
+import time
 from collections import defaultdict
 from glob import glob
 from os.path import dirname, exists, join
 
-from jinja2 import Template
 from tqdm.asyncio import tqdm
 
+from .llms import AsyncLLM
 from .model_utils import ModelManager
 from .presentation import Presentation
-from .utils import Config, package_join
+from .utils import Config, atomic_write, get_prompt_template, load_prompt
 
 manager = ModelManager()
 language_model = manager.language_model
 vision_model = manager.vision_model
 
-text_scorer = Template(
-    open(
-        package_join("prompts", "ppteval", "ppteval_content.txt"), encoding="utf-8"
-    ).read()
-)
-vision_scorer = Template(
-    open(
-        package_join("prompts", "ppteval", "ppteval_style.txt"), encoding="utf-8"
-    ).read()
-)
-style_descriptor = open(
-    package_join("prompts", "ppteval", "ppteval_describe_style.txt"), encoding="utf-8"
-).read()
-content_descriptor = open(
-    package_join("prompts", "ppteval", "ppteval_describe_content.txt"), encoding="utf-8"
-).read()
-ppt_extractor = Template(
-    open(
-        package_join("prompts", "ppteval", "ppteval_extract.txt"), encoding="utf-8"
-    ).read()
-)
-logic_scorer = Template(
-    open(
-        package_join("prompts", "ppteval", "ppteval_coherence.txt"), encoding="utf-8"
-    ).read()
-)
+PPTEVAL_CONCURRENCY = int(os.environ.get("PPTEVAL_CONCURRENCY", 16))
 
 
 def get_eval(prs_source: str):
+    """
+    Load the evaluation results of a presentation, merging `evals.json` with
+    the results appended to `evals.jsonl` since it was written.
+    """
     evals = defaultdict(dict)
     eval_file = join(dirname(prs_source), "evals.json")
     if exists(eval_file):
         with open(eval_file, encoding="utf-8") as f:
             evals |= json.load(f)
+    record_file = join(dirname(prs_source), "evals.jsonl")
+    if exists(record_file):
+        with open(record_file, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # a line cut by an interrupted run
+                    continue
+                if record["dimension"] == "logic":
+                    evals["logic"] = record["result"]
+                else:
+                    evals[record["dimension"]][record["key"]] = record["result"]
     return evals, eval_file
 
 
-async def slide_score(prs_source: str, slide_folder: str):
-    evals, eval_file = get_eval(prs_source)
-    for slide_image in glob(join(slide_folder, "slide_*.jpg")) + glob(
-        join(slide_folder, "slide_images", "slide_*.jpg")
+def raise_first_error(results: list):
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+
+class EvalRecords:
+    """
+    The evaluation results of a presentation, each result is appended to `evals.jsonl` as soon as
+    it is produced, so an interrupted evaluation resumes from it.
+    """
+
+    def __init__(self, prs_source: str):
+        self.evals, self.eval_file = get_eval(prs_source)
+        self.record_file = join(dirname(prs_source), "evals.jsonl")
+
+    def has(self, dimension: str, key: str | None = None) -> bool:
+        if key is None:
+            return dimension in self.evals
+        return key in self.evals[dimension]
+
+    def add(self, dimension: str, key: str | None, result: dict):
+        if key is None:
+            self.evals[dimension] = result
+        else:
+            self.evals[dimension][key] = result
+        record = {"dimension": dimension, "key": key, "result": result}
+        with open(self.record_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def save(self):
+        """
+        Consolidate the results into `evals.json`.
+        """
+        atomic_write(self.eval_file, json.dumps(self.evals, indent=2))
+        if exists(self.record_file):
+            os.remove(self.record_file)
+
+
+class EvalRunner:
+    """
+    Evaluate presentations with every model call of all slides and presentations fanned out
+    under a global limiter.
+    """
+
+    def __init__(
+        self,
+        language_model: AsyncLLM | None = None,
+        vision_model: AsyncLLM | None = None,
+        max_concurrency: int = PPTEVAL_CONCURRENCY,
     ):
+        """
+        Initialize the EvalRunner.
+
+        Args:
+            language_model (AsyncLLM | None): The model scoring the descriptions, defaults to the module model.
+            vision_model (AsyncLLM | None): The model describing the slide images, defaults to the module model.
+            max_concurrency (int): The maximum number of concurrent model calls.
+        """
+        self.language_model = language_model or manager.language_model
+        self.vision_model = vision_model or manager.vision_model
+        self.limiter = asyncio.Semaphore(max_concurrency)
+
+    async def _call(self, model: AsyncLLM, *args, **kwargs):
+        async with self.limiter:
+            return await model(*args, **kwargs)
+
+    async def score_slide(self, records: EvalRecords, slide_image: str):
+        """
+        Score the style and the content of a slide image, the descriptions of the slide are
+        cached next to the image and each score is recorded as soon as it is produced.
+        """
         slide_descr = slide_image.replace(".jpg", ".json")
-        if not os.path.exists(slide_descr):
-            style_descr = await vision_model(style_descriptor, slide_image)
-            content_descr = await vision_model(content_descriptor, slide_image)
-            with open(slide_descr, "w", encoding="utf-8") as f:
-                json.dump(
-                    {"content": content_descr, "style": style_descr},
-                    f,
-                    indent=2,
+        descr = {}
+        if exists(slide_descr):
+            with open(slide_descr, encoding="utf-8") as f:
+                descr = json.load(f)
+        described = False
+
+        async def score(dimension: str, descriptor: str, scorer: str):
+            nonlocal described
+            key = "style" if dimension == "vision" else "content"
+            if records.has(dimension, slide_image):
+                return
+            if key not in descr:
+                descr[key] = await self._call(
+                    self.vision_model, load_prompt(descriptor), slide_image
                 )
+                described = True
+            records.add(
+                dimension,
+                slide_image,
+                await self._call(
+                    self.language_model,
+                    get_prompt_template(scorer).render(descr=descr[key]),
+                    return_json=True,
+                ),
+            )
+
+        results = await asyncio.gather(
+            score(
+                "vision",
+                "ppteval/ppteval_describe_style.txt",
+                "ppteval/ppteval_style.txt",
+            ),
+            score(
+                "content",
+                "ppteval/ppteval_describe_content.txt",
+                "ppteval/ppteval_content.txt",
+            ),
+            return_exceptions=True,
+        )
+        if described:
+            atomic_write(slide_descr, json.dumps(descr, indent=2))
+        raise_first_error(results)
+
+    async def score_presentation(self, records: EvalRecords, prs_source: str):
+        """
+        Score the logic of a presentation from its extracted outline.
+        """
+        if records.has("logic"):
+            return
+        slide_descr = join(prs_source.replace(".pptx", ""), "extracted.json")
+        if not exists(slide_descr):
+            presentation = await asyncio.to_thread(
+                Presentation.from_file, prs_source, Config(dirname(prs_source))
+            )
+            extracted = await self._call(
+                self.language_model,
+                get_prompt_template("ppteval/ppteval_extract.txt").render(
+                    presentation=presentation.to_text()
+                ),
+                return_json=True,
+            )
+            os.makedirs(dirname(slide_descr), exist_ok=True)
+            atomic_write(slide_descr, json.dumps(extracted, indent=2))
         else:
-            descr = json.load(open(slide_descr, encoding="utf-8"))
-            style_descr = descr["style"]
-            content_descr = descr["content"]
-        if slide_image not in evals["vision"]:
-            evals["vision"][slide_image] = await language_model(
-                vision_scorer.render(descr=style_descr), return_json=True
+            with open(slide_descr, encoding="utf-8") as f:
+                extracted = json.load(f)
+        records.add(
+            "logic",
+            None,
+            await self._call(
+                self.language_model,
+                get_prompt_template("ppteval/ppteval_coherence.txt").render(
+                    presentation=extracted
+                ),
+                return_json=True,
+            ),
+        )
+
+    async def render_slides(self, prs_source: str, cache_dir: str) -> list[str]:
+        """
+        Render the slides of a presentation one by one, images are named by the content of their
+        slide, so unchanged slides are neither rendered nor described again.
+
+        Args:
+            prs_source (str): The presentation file.
+            cache_dir (str): The directory of the slide images.
+
+        Returns:
+            list[str]: The image of each slide.
+        """
+        presentation = await asyncio.to_thread(Presentation.from_file, prs_source)
+        return await asyncio.gather(
+            *[
+                presentation.render_slide(slide, cache_dir)
+                for slide in presentation.slides
+            ]
+        )
+
+    async def evaluate(
+        self,
+        prs_source: str,
+        slide_folder: str | None = None,
+        score_slides: bool = True,
+        score_presentation: bool = True,
+    ) -> int:
+        """
+        Evaluate a presentation, results already recorded are skipped.
+
+        Args:
+            prs_source (str): The presentation file.
+            slide_folder (str | None): The folder of the slide images, None to render the slides
+                into `slide_renders` next to the presentation.
+            score_slides (bool): Whether to score the slide images.
+            score_presentation (bool): Whether to score the presentation logic.
+
+        Returns:
+            int: The number of slide images.
+        """
+        records = EvalRecords(prs_source)
+        slide_images = []
+        if score_slides and slide_folder is None:
+            slide_images = await self.render_slides(
+                prs_source, join(dirname(prs_source), "slide_renders")
             )
-        if slide_image not in evals["content"]:
-            evals["content"][slide_image] = await language_model(
-                text_scorer.render(descr=content_descr), return_json=True
+        elif score_slides:
+            slide_images = glob(join(slide_folder, "slide_*.jpg")) + glob(
+                join(slide_folder, "slide_images", "slide_*.jpg")
             )
-    with open(eval_file, "w", encoding="utf-8") as f:
-        json.dump(evals, f, indent=2)
+        tasks = [self.score_slide(records, image) for image in slide_images]
+        if score_presentation:
+            tasks.append(self.score_presentation(records, prs_source))
+        # let every call in flight finish and be recorded before reporting a failure
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        records.save()
+        raise_first_error(results)
+        return len(slide_images)
 
+    async def run(self, prs_files: list[str], slide_folders: list[str]) -> dict:
+        """
+        Evaluate presentations and aggregate their scores.
 
-async def pres_score(prs_source: str):
-    tmp_config = Config(dirname(prs_source))
-    evals, eval_file = get_eval(prs_source)
-    if "logic" in evals:
-        return
-    slide_descr = join(prs_source.replace(".pptx", ""), "extracted.json")
-    if not exists(slide_descr):
-        presentation = Presentation.from_file(prs_source, tmp_config).to_text()
-        extracted = language_model(
-            ppt_extractor.render(presentation=presentation),
-            return_json=True,
+        Args:
+            prs_files (list[str]): The presentation files.
+            slide_folders (list[str]): The folder of the slide images of each presentation.
+
+        Returns:
+            dict: The average score of each dimension.
+        """
+        start = time.perf_counter()
+        num_slides = await tqdm.gather(
+            *[
+                self.evaluate(prs_file, slide_folder)
+                for prs_file, slide_folder in zip(prs_files, slide_folders)
+            ]
         )
-        with open(slide_descr, "w", encoding="utf-8") as f:
-            json.dump(extracted, f, indent=2)
-    else:
-        extracted = json.load(open(slide_descr, encoding="utf-8"))
-    evals["logic"] = await language_model(
-        logic_scorer.render(
-            presentation=extracted,
-        ),
-        return_json=True,
-    )
-    with open(eval_file, "w", encoding="utf-8") as f:
-        json.dump(evals, f, indent=2)
+        elapsed = time.perf_counter() - start
+        avg_scores = aggregate_scores(prs_files)
+        print(
+            f"Evaluated {len(prs_files)} presentations ({sum(num_slides)} slides) "
+            f"in {elapsed:.1f}s: {sum(num_slides) / elapsed * 60:.1f} slides/min"
+        )
+        return avg_scores
+
+
+_EVAL_RUNNER: EvalRunner | None = None
+
+
+def get_eval_runner() -> EvalRunner:
+    global _EVAL_RUNNER
+    if _EVAL_RUNNER is None:
+        _EVAL_RUNNER = EvalRunner()
+    return _EVAL_RUNNER
+
+
+async def slide_score(prs_source: str, slide_folder: str | None = None):
+    await get_eval_runner().evaluate(prs_source, slide_folder, score_presentation=False)
+
+
+async def pres_score(prs_source: str):
+    await get_eval_runner().evaluate(prs_source, score_slides=False)
 
 
 async def eval_ppt(prs_files: list[str], slide_folders: list[str]):
-    await tqdm.gather(*[pres_score(prs_file) for prs_file in prs_files])
-    await tqdm.gather(
-        *[
-            slide_score(prs_file, slide_folder)
-            for prs_file, slide_folder in zip(prs_files, slide_folders)
-        ]
-    )
-
-    # Calculate average scores directly in this function
+    return await get_eval_runner().run(prs_files, slide_folders)
+
+
+def aggregate_scores(prs_files: list[str]) -> dict[str, float]:
+    """
+    Average the scores of each dimension over the presentations.
+    """
     all_scores = {"vision": [], "content": [], "logic": []}
 
     for prs_file in prs_files:
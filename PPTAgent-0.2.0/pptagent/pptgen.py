@@ -1,13 +1,14 @@
 import asyncio
 import json
 import os
+import pickle
 import traceback
 from abc import ABC, abstractmethod
 from contextlib import AsyncExitStack
-from copy import deepcopy
 from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
+from os.path import exists, join
 from random import shuffle
 
 from pptagent.agent import Agent
@@ -16,6 +17,7 @@ from pptagent.document import Document
 from pptagent.llms import AsyncLLM
 from pptagent.presentation import (
     GroupShape,
+    ImageIndex,
     Layout,
     Picture,
     Presentation,
@@ -23,8 +25,11 @@ from pptagent.presentation import (
     StyleArg,
 )
 from pptagent.response import EditorOutput, LayoutChoice, Outline, OutlineItem
+from pptagent.telemetry import trace_scope
+from pptagent.template_cache import dumps
 from pptagent.utils import (
     Language,
+    atomic_write,
     edit_distance,
     get_logger,
     tenacity_decorator,
@@ -112,7 +117,7 @@ class PPTGen(ABC):
         self.layouts: dict[str, Layout] = {
             k: Layout(title=k, **v) for k, v in slide_induction.items()
         }
-        self.empty_prs = deepcopy(self.presentation)
+        self.empty_prs = self.presentation.empty_copy()
         assert hide_small_pic_ratio is None or hide_small_pic_ratio > 0, (
             "hide_small_pic_ratio must be positive or None"
         )
@@ -147,6 +152,7 @@ class PPTGen(ABC):
         length_factor: float | None = None,
         auto_length_factor: bool = True,
         max_at_once: int | None = None,
+        checkpoint_dir: str | None = None,
     ):
         """
         Generate a PowerPoint presentation.
@@ -160,6 +166,8 @@ class PPTGen(ABC):
             length_factor (float | None): The length factor.
             auto_length_factor (bool): Whether to automatically calculate the length factor.
             max_at_once (int | None): The maximum number of slides to generate at once.
+            checkpoint_dir (str | None): The directory the outline and each generated slide are saved to,
+                a rerun with the same directory resumes from them instead of generating them again.
 
         Returns:
             tuple[Presentation, dict]: A tuple containing the generated presentation and the history of the agents.
@@ -169,6 +177,7 @@ class PPTGen(ABC):
         source_doc.metadata["presentation-date"] = datetime.now().strftime("%Y-%m-%d")
         assert self._initialized, "PPTAgent not initialized, call `set_reference` first"
         self.source_doc = source_doc
+        self.image_index = ImageIndex([m.path for m in source_doc.iter_medias()])
         
         # 显示，不同语言同样的字符，字符框显示的不一样
         length_factor = length_factor or os.getenv("PPTAGENT_LENGTH_FACTOR", None)
@@ -182,10 +191,27 @@ class PPTGen(ABC):
         succ_flag = True
         
         # outline本意就是提纲，如果不存在，我们需要通过需要生成的页数，和pdf的文档进行生成
+        outline_file = (
+            None if checkpoint_dir is None else join(checkpoint_dir, "outline.json")
+        )
+        if outline is None and outline_file is not None and exists(outline_file):
+            with open(outline_file, encoding="utf-8") as f:
+                outline = [OutlineItem(**item) for item in json.load(f)]
         if outline is None:
             self.outline = await self.generate_outline(num_slides, source_doc)
         else:
             self.outline = outline
+            self._build_toc(outline)
+        if outline_file is not None:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+            atomic_write(
+                outline_file,
+                json.dumps(
+                    [item.model_dump() for item in self.outline],
+                    ensure_ascii=False,
+                    indent=4,
+                ),
+            )
         
         pre_section = None
         section_idx = 0
@@ -213,7 +239,9 @@ class PPTGen(ABC):
             if self.force_pages and slide_idx == num_slides:
                 break
             slide_tasks.append(
-                self.generate_slide(slide_idx, outline_item, semaphore=semaphore)
+                self._generate_slide_checkpointed(
+                    slide_idx, outline_item, semaphore, checkpoint_dir
+                )
             )
 
         
@@ -231,7 +259,8 @@ class PPTGen(ABC):
                 # slide是生成的ppt
                 slide, code_executor = result
                 generated_slides.append(slide)
-                code_executors.append(code_executor)
+                if code_executor is not None:
+                    code_executors.append(code_executor)
 
         history = self._collect_history(
             sum(code_executors, start=CodeExecutor(self.retry_times))
@@ -243,7 +272,7 @@ class PPTGen(ABC):
         else:
             prs = None
 
-        self.empty_prs = deepcopy(self.presentation)
+        self.empty_prs = self.presentation.empty_copy()
         return prs, history
 
     async def generate_outline(
@@ -265,6 +294,28 @@ class PPTGen(ABC):
         outline = [OutlineItem(**o) for o in outline["outline"]]
         return self._add_functional_layouts(outline)
 
+    async def _generate_slide_checkpointed(
+        self,
+        slide_idx: int,
+        outline_item: OutlineItem,
+        semaphore: AsyncExitStack,
+        checkpoint_dir: str | None,
+    ) -> tuple[SlidePage, CodeExecutor | None]:
+        """
+        Generate a slide, or load it from the checkpoint directory if it was generated before.
+        """
+        if checkpoint_dir is None:
+            return await self.generate_slide(slide_idx, outline_item, semaphore)
+        slide_file = join(checkpoint_dir, f"slide_{slide_idx + 1:04d}.pkl")
+        if exists(slide_file):
+            with open(slide_file, "rb") as f:
+                return pickle.load(f), None
+        slide, code_executor = await self.generate_slide(
+            slide_idx, outline_item, semaphore
+        )
+        atomic_write(slide_file, dumps(slide))
+        return slide, code_executor
+
     @abstractmethod
     def generate_slide(
         self, slide_idx: int, outline_item: OutlineItem, semaphore: AsyncExitStack
@@ -278,11 +329,7 @@ class PPTGen(ABC):
         """
         Add functional layouts to the outline.
         """
-        toc = []
-        for item in outline:
-            if item.topic not in toc and item.topic != "Functional":
-                toc.append(item.topic)
-        self.toc = "\n".join(toc)
+        self._build_toc(outline)
 
         fixed_functional_slides = [
             (FunctionalLayouts.TOC.value, 0),  # toc should be inserted before opening
@@ -327,6 +374,16 @@ class PPTGen(ABC):
             pre_section = item.topic
         return full_outline
 
+    def _build_toc(self, outline: list[OutlineItem]):
+        """
+        Build the table of contents from the topics of the outline.
+        """
+        toc = []
+        for item in outline:
+            if item.topic not in toc and item.topic != "Functional":
+                toc.append(item.topic)
+        self.toc = "\n".join(toc)
+
     def _hide_small_pics(self, area_ratio: float, keep_in_background: bool):
         for layout in list(self.layouts.values()):
             template_slide = self.presentation.slides[layout.template_id - 1]
@@ -406,44 +463,46 @@ class PPTAgent(PPTGen):
         Asynchronously generate a slide from the outline item.
         """
         async with semaphore:
-            
-            # 生成功能页
-            if outline_item.topic == "Functional":
-                layout = self.layouts[outline_item.purpose]
-                slide_desc = FunctionalContent[outline_item.purpose]
-                if outline_item.purpose == FunctionalLayouts.SECTION_OUTLINE.value:
-                    section, sec_idx = outline_item.indexes
-                    slide_desc = slide_desc.format(section, sec_idx + 1)
-                    outline_item.purpose = f"Section Outline of {section}"
-                    outline_item.indexes = []
-                    slide_content = (
-                        "Document Structure:\n"
-                        + self.source_doc.get_overview(
-                            include_summary=True, include_image=False
+            with trace_scope(slide=slide_idx + 1):
+                # 生成功能页
+                if outline_item.topic == "Functional":
+                    layout = self.layouts[outline_item.purpose]
+                    slide_desc = FunctionalContent[outline_item.purpose]
+                    if outline_item.purpose == FunctionalLayouts.SECTION_OUTLINE.value:
+                        section, sec_idx = outline_item.indexes
+                        slide_desc = slide_desc.format(section, sec_idx + 1)
+                        outline_item.purpose = f"Section Outline of {section}"
+                        outline_item.indexes = []
+                        slide_content = (
+                            "Document Structure:\n"
+                            + self.source_doc.get_overview(
+                                include_summary=True, include_image=False
+                            )
                         )
-                    )
-                elif outline_item.purpose == FunctionalLayouts.TOC.value:
-                    slide_content = "Table of Contents:\n" + self.toc
+                    elif outline_item.purpose == FunctionalLayouts.TOC.value:
+                        slide_content = "Table of Contents:\n" + self.toc
+                    else:
+                        slide_content = "This slide is a functional layout, please follow the slide description and content schema to generate the slide content."
+                    header, _, _ = outline_item.retrieve(slide_idx, self.source_doc)
+                    header += slide_desc
                 else:
-                    slide_content = "This slide is a functional layout, please follow the slide description and content schema to generate the slide content."
-                header, _, _ = outline_item.retrieve(slide_idx, self.source_doc)
-                header += slide_desc
-            else:
-                # 提取处布局，标题和里面的内容
-                layout, header, slide_content = await self._select_layout(
-                    slide_idx, outline_item
-                )
-                
-            try:
-                command_list, template_id = await self._generate_content(
-                    layout, slide_content, header
-                )
-                slide, code_executor = await self._edit_slide(command_list, template_id)
-            except Exception as e:
-                logger.error(f"Failed to generate slide {slide_idx}, error: {e}")
-                traceback.print_exc()
-                raise e
-            return slide, code_executor
+                    # 提取处布局，标题和里面的内容
+                    layout, header, slide_content = await self._select_layout(
+                        slide_idx, outline_item
+                    )
+
+                try:
+                    command_list, template_id = await self._generate_content(
+                        layout, slide_content, header
+                    )
+                    slide, code_executor = await self._edit_slide(
+                        command_list, template_id
+                    )
+                except Exception as e:
+                    logger.error(f"Failed to generate slide {slide_idx}, error: {e}")
+                    traceback.print_exc()
+                    raise e
+                return slide, code_executor
 
     @tenacity_decorator
     async def _select_layout(
@@ -519,7 +578,7 @@ class PPTAgent(PPTGen):
         )
 
         for error_idx in range(self.retry_times):
-            edit_slide: SlidePage = deepcopy(self.presentation.slides[template_id - 1])
+            edit_slide: SlidePage = self.presentation.slides[template_id - 1].fork()
             feedback = code_executor.execute_actions(
                 edit_actions, edit_slide, self.source_doc
             )
@@ -561,8 +620,7 @@ class PPTAgent(PPTGen):
             Exception: If command generation fails.
         """
         try:
-            allowed_images = [m.path for m in self.source_doc.iter_medias()]
-            layout.validate(editor_output, allowed_images)
+            layout.validate(editor_output, self.image_index)
             if self.length_factor is not None:
                 await layout.length_rewrite(
                     editor_output, self.length_factor, self.language_model
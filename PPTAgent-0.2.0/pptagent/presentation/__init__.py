@@ -1,4 +1,4 @@
-from .layout import Element, Layout
+from .layout import Element, ImageIndex, Layout
 from .presentation import Presentation, SlidePage
 from .shapes import (
     SHAPECAST,
@@ -33,6 +33,7 @@ __all__ = [
     "Font",
     "FreeShape",
     "GroupShape",
+    "ImageIndex",
     "Layout",
     "Line",
     "Paragraph",
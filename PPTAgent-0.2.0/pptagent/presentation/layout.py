@@ -1,21 +1,83 @@
 import asyncio
 from math import ceil
-from os.path import exists
-from typing import Literal
+from os.path import basename, exists
+from typing import TYPE_CHECKING, Literal
 
-from jinja2 import StrictUndefined, Template
 from pydantic import BaseModel, field_validator
+from rapidfuzz import process
+from rapidfuzz.distance import Levenshtein
 
-from pptagent.llms import AsyncLLM
-from pptagent.response import EditorOutput
-from pptagent.utils import edit_distance, get_logger, package_join
+from pptagent.utils import get_logger, get_prompt_template
+
+if TYPE_CHECKING:
+    # only annotations, the LLM client and the response models take most of the import time
+    from pptagent.llms import AsyncLLM
+    from pptagent.response import EditorOutput
 
 logger = get_logger(__name__)
 
-LENGTHY_REWRITE_PROMPT = Template(
-    open(package_join("prompts", "lengthy_rewrite.txt"), encoding="utf-8").read(),
-    undefined=StrictUndefined,
-)
+
+class ImageIndex:
+    """
+    Resolve image paths given by the editor to the images of a document, built once per document.
+
+    A path is resolved to the allowed path equal to it, then to the only allowed path with the same
+    basename, then to the allowed path most similar by `edit_distance`, the first one on ties.
+    Resolutions are memoized, as editors retry with the same paths.
+    """
+
+    # The minimum `edit_distance` similarity of a fuzzy match
+    MIN_SIMILARITY = 0.5
+
+    def __init__(self, allowed_images: list[str]):
+        """
+        Initialize the ImageIndex.
+
+        Args:
+            allowed_images (list[str]): The paths of the images that can be used.
+        """
+        self.allowed_images = list(allowed_images)
+        self._paths = set(self.allowed_images)
+        self._basenames: dict[str, str | None] = {}
+        for path in self.allowed_images:
+            name = basename(path)
+            # ambiguous basenames are left to the fuzzy match
+            self._basenames[name] = path if name not in self._basenames else None
+        self._resolved: dict[str, str | None] = {}
+
+    def __len__(self) -> int:
+        return len(self.allowed_images)
+
+    def resolve(self, image_path: str) -> str | None:
+        """
+        Resolve an image path to an existing allowed image.
+
+        Args:
+            image_path (str): The image path given by the editor.
+
+        Returns:
+            str | None: The allowed image, None if no existing image is similar enough.
+        """
+        if image_path not in self._resolved:
+            self._resolved[image_path] = self._match(image_path)
+        return self._resolved[image_path]
+
+    def _match(self, image_path: str) -> str | None:
+        if image_path in self._paths:
+            match = image_path
+        elif self._basenames.get(basename(image_path)) is not None:
+            match = self._basenames[basename(image_path)]
+        else:
+            result = process.extractOne(
+                image_path,
+                self.allowed_images,
+                scorer=Levenshtein.normalized_similarity,
+                score_cutoff=self.MIN_SIMILARITY,
+            )
+            match = result[0] if result is not None else None
+        if match is None or not exists(match):
+            return None
+        return match
 
 
 class Element(BaseModel):
@@ -55,7 +117,7 @@ class Layout(BaseModel):
             raise ValueError("Only one variable element allowed in a layout")
         return v
 
-    def index_template_slide(self, data: EditorOutput):
+    def index_template_slide(self, data: "EditorOutput"):
         old_data = {}
         template_id = self.template_id
 
@@ -74,7 +136,11 @@ class Layout(BaseModel):
 
         return template_id, old_data
 
-    def validate(self, editor_output: EditorOutput, allowed_images: list[str]):
+    def validate(
+        self, editor_output: "EditorOutput", allowed_images: list[str] | ImageIndex
+    ):
+        if not isinstance(allowed_images, ImageIndex):
+            allowed_images = ImageIndex(allowed_images)
         for el in self.elements:
             if el.name not in editor_output:
                 raise ValueError(f"Element {el.name} not found in editor output")
@@ -84,13 +150,8 @@ class Layout(BaseModel):
                 "No images provided for slide generation, please leave a blank list for this element"
             )
             for i in range(len(editor_output[el.name].data)):
-                sim_image = max(
-                    allowed_images,
-                    key=lambda x: edit_distance(x, editor_output[el.name].data[i]),
-                )
-                if edit_distance(
-                    sim_image, editor_output[el.name].data[i]
-                ) < 0.5 or not exists(sim_image):
+                sim_image = allowed_images.resolve(editor_output[el.name].data[i])
+                if sim_image is None:
                     raise ValueError(
                         f"Image {editor_output[el.name].data[i]} not found\n"
                         "Please check the image path and use only existing images\n"
@@ -100,9 +161,9 @@ class Layout(BaseModel):
 
     async def length_rewrite(
         self,
-        editor_output: EditorOutput,
+        editor_output: "EditorOutput",
         length_factor: float,
-        language_model: AsyncLLM,
+        language_model: "AsyncLLM",
     ):
         async with asyncio.TaskGroup() as tg:
             tasks = []
@@ -116,7 +177,7 @@ class Layout(BaseModel):
                 if charater_counts - expected_length > 5:
                     task = tg.create_task(
                         language_model(
-                            LENGTHY_REWRITE_PROMPT.render(
+                            get_prompt_template("lengthy_rewrite.txt").render(
                                 el_name=el.name,
                                 content=el.data,
                                 suggested_characters=f"{self[el.name].suggested_characters} characters",
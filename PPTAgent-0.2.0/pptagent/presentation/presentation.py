@@ -1,17 +1,35 @@
+import asyncio
+import hashlib
+import io
+import os
+import pickle
 import tempfile
+import threading
 import traceback
-from collections.abc import Generator
-from dataclasses import dataclass
+from bisect import bisect
+from collections.abc import Generator, Iterable
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+from dataclasses import astuple, dataclass, replace
 from functools import partial
+from os.path import exists, join
 from typing import Literal
 
 from pptx import Presentation as load_prs
 from pptx.enum.shapes import MSO_SHAPE_TYPE
+from pptx.presentation import Presentation as PPTXPresentation
 from pptx.shapes.base import BaseShape
 from pptx.shapes.group import GroupShape as PPTXGroupShape
 from pptx.slide import Slide as PPTXSlide
 
-from pptagent.utils import Config, get_logger, package_join
+from pptagent.utils import (
+    Config,
+    ImageConversionBatch,
+    deferred_image_conversion,
+    get_logger,
+    package_join,
+    ppt_to_images_async,
+)
 
 from .shapes import (
     Background,
@@ -28,6 +46,11 @@ from .shapes import (
 
 logger = get_logger(__name__)
 
+PARSE_WORKERS = int(os.environ.get("PRESENTATION_PARSE_WORKERS", 1))
+# Slides parsed by a worker process at least, smaller presentations are parsed in process
+SLIDES_PER_WORKER = 16
+_PARSE_EXECUTOR: ProcessPoolExecutor | None = None
+
 
 @dataclass
 class SlidePage:
@@ -142,6 +165,38 @@ class SlidePage:
                     raise ValueError(f"Failed to apply closures to slides: {e}")
         return slide
 
+    def fork(self) -> "SlidePage":
+        """
+        Create an editable copy of the slide page.
+
+        Edits are recorded as closures, paragraph and style states on the copy, while the xml,
+        fills, lines and fonts of shapes are never modified after parsing. So the copy shares
+        them with the original instead of deep-copying, the xml is materialized only when the
+        copy is built.
+
+        Returns:
+            SlidePage: The copied slide page.
+        """
+        memo = {}
+        for background in self.backgrounds:
+            if not isinstance(background, ShapeElement):
+                memo[id(background)] = background
+        for shape in _walk_shapes(self.shapes + self.backgrounds):
+            shared = [shape.sp, shape.config, shape.fill, shape.line]
+            shared.append(shape.text_frame.font)
+            shared.extend(para.font for para in shape.text_frame.paragraphs)
+            for obj in shared:
+                memo[id(obj)] = obj
+        return deepcopy(self, memo)
+
+    def set_index(self, slide_idx: int) -> None:
+        """
+        Set the index of the slide page and its shapes.
+        """
+        self.slide_idx = slide_idx
+        for shape in _walk_shapes(self.shapes + self.backgrounds):
+            shape.slide_idx = slide_idx
+
     def iter_paragraphs(self) -> Generator[Paragraph, None, None]:
         for shape in self:  # this considered the group shapes
             if not shape.text_frame.is_textframe:
@@ -202,9 +257,13 @@ class SlidePage:
         """
         if style_args is None:
             style_args = StyleArg(**kwargs)
+        key = ("html", astuple(style_args))
+        html = self._cached_render(key)
+        if html is not None:
+            return html
         shapes_html = [shape.to_html(style_args) for shape in self.shapes]
         shapes_html = [html for html in shapes_html if html]
-        return "".join(
+        html = "".join(
             [
                 "<!DOCTYPE html>\n<html>\n",
                 (f"<title>{self.slide_title}</title>\n" if self.slide_title else ""),
@@ -213,6 +272,7 @@ class SlidePage:
                 "</body>\n</html>\n",
             ]
         )
+        return self._cache_render(key, html)
 
     def to_text(self, show_image: bool = False) -> str:
         """
@@ -227,6 +287,10 @@ class SlidePage:
         Raises:
             ValueError: If an image caption is not found.
         """
+        key = ("text", show_image)
+        text_content = self._cached_render(key)
+        if text_content is not None:
+            return text_content
         text_content = ""
         for para in self.iter_paragraphs():
             if not para.text:
@@ -237,7 +301,37 @@ class SlidePage:
         if show_image:
             for image in self.shape_filter(Picture):
                 text_content += "\n" + "Image: " + image.caption
-        return text_content
+        return self._cache_render(key, text_content)
+
+    @property
+    def render_version(self) -> tuple:
+        """
+        Get the version of the slide page as rendered, changed by any edit to its shapes.
+
+        Returns:
+            tuple: The render version.
+        """
+        return (self.slide_title, tuple(shape.render_version for shape in self.shapes))
+
+    def _cached_render(self, key: tuple) -> str | None:
+        # renderings are kept with the version they were made at, edits make them stale
+        cached = self.__dict__.get("_render_cache", {}).get(key)
+        if cached is not None and cached[0] == self.render_version:
+            return cached[1]
+        return None
+
+    def _cache_render(self, key: tuple, rendering: str) -> str:
+        self.__dict__.setdefault("_render_cache", {})[key] = (
+            self.render_version,
+            rendering,
+        )
+        return rendering
+
+    def __getstate__(self) -> object:
+        # copies and pickles are rendered afresh, their shapes are new objects
+        state = self.__dict__.copy()
+        state.pop("_render_cache", None)
+        return state
 
     def __iter__(self):
         """
@@ -262,6 +356,91 @@ class SlidePage:
         return len(self.shapes)
 
 
+def _walk_shapes(
+    shapes: Iterable[ShapeElement | Background],
+) -> Generator[ShapeElement, None, None]:
+    for shape in shapes:
+        if not isinstance(shape, ShapeElement):
+            continue
+        yield shape
+        if isinstance(shape, GroupShape):
+            yield from _walk_shapes(shape.data)
+
+
+def _parse_slides(
+    prs: PPTXPresentation,
+    file_path: str,
+    visible_slides: list[int],
+    config: Config,
+    shape_cast: dict[MSO_SHAPE_TYPE, type[ShapeElement] | None],
+    indices: Iterable[int] | None = None,
+) -> tuple[list[SlidePage], list[tuple[int, str]], ImageConversionBatch]:
+    """
+    Parse slides of a presentation, indexed by their real index, their images are left to write.
+
+    Args:
+        prs (PPTXPresentation): The presentation.
+        file_path (str): The path to the presentation file.
+        visible_slides (list[int]): The positions of the visible slides in the presentation.
+        config (Config): The configuration object.
+        shape_cast (dict[MSO_SHAPE_TYPE, type[ShapeElement] | None]): See `Presentation.from_file`.
+        indices (Iterable[int] | None): The indices of the visible slides to parse, all if None.
+
+    Returns:
+        tuple[list[SlidePage], list[tuple[int, str]], ImageConversionBatch]: The slides, the errors and the images to write.
+    """
+    layouts = [layout.name for layout in prs.slide_layouts]
+    pptx_slides = list(prs.slides)
+    slides = []
+    error_history = []
+    with deferred_image_conversion() as image_batch:
+        for i in indices if indices is not None else range(len(visible_slides)):
+            slide = pptx_slides[visible_slides[i]]
+            slide_idx = i + 1
+            image_batch.current_slide = slide_idx
+            try:
+                if slide.slide_layout.name not in layouts:
+                    raise ValueError(
+                        f"Slide layout {slide.slide_layout.name} not found"
+                    )
+                slides.append(
+                    SlidePage.from_slide(
+                        slide,
+                        slide_idx,
+                        slide_idx,
+                        prs.slide_width.pt,
+                        prs.slide_height.pt,
+                        config,
+                        shape_cast,
+                    )
+                )
+            except Exception as e:
+                error_history.append((slide_idx, str(e)))
+                logger.error(
+                    "Fail to parse slide %d of %s: %s",
+                    slide_idx,
+                    file_path,
+                    e,
+                )
+                logger.error(traceback.format_exc())
+    return slides, error_history, image_batch
+
+
+def _parse_slides_in_worker(
+    file_path: str,
+    visible_slides: list[int],
+    indices: Iterable[int],
+    config: Config,
+    shape_cast: dict[MSO_SHAPE_TYPE, type[ShapeElement] | None],
+) -> bytes:
+    from pptagent.template_cache import dumps
+
+    result = _parse_slides(
+        load_prs(file_path), file_path, visible_slides, config, shape_cast, indices
+    )
+    return dumps(result)
+
+
 @dataclass
 class Presentation:
     """
@@ -277,9 +456,17 @@ class Presentation:
     num_pages: int
 
     def __post_init__(self):
+        self._load_package()
+
+    def _load_package(self):
+        """
+        Load the package of the source file, which is not pickled with the presentation.
+        """
         self.prs = load_prs(self.source_file)
         self.layout_mapping = {layout.name: layout for layout in self.prs.slide_layouts}
         self.prs.core_properties.last_modified_by = "PPTAgent"
+        self._render_prs: Presentation | None = None
+        self._render_lock = threading.Lock()
 
     @classmethod
     def from_file(
@@ -287,6 +474,7 @@ class Presentation:
         file_path: str,
         config: Config | None = None,
         shape_cast: dict[MSO_SHAPE_TYPE, type[ShapeElement]] | None = None,
+        max_workers: int = PARSE_WORKERS,
     ) -> "Presentation":
         """
         Parse a Presentation from a file.
@@ -296,59 +484,84 @@ class Presentation:
             config (Config): The configuration object.
             shape_cast (dict[MSO_SHAPE_TYPE, type[ShapeElement]] | None): Optional mapping of shape types to their corresponding ShapeElement classes.
             Set the value to None for any MSO_SHAPE_TYPE to exclude that shape type from processing.
+            max_workers (int): The maximum number of processes parsing slides, each parses SLIDES_PER_WORKER slides at least.
         Returns:
             Presentation: The parsed Presentation.
         """
+        global _PARSE_EXECUTOR
         if config is None:
             config = Config(tempfile.mkdtemp())
         prs = load_prs(file_path)
         slide_width = prs.slide_width
         slide_height = prs.slide_height
-        slides = []
-        error_history = []
-        slide_idx = 0
-        layouts = [layout.name for layout in prs.slide_layouts]
         num_pages = len(prs.slides)
 
         if shape_cast is None:
             shape_cast = {}
 
-        for slide in prs.slides:
-            # Skip slides that won't be printed to PDF, as they are invisible
-            if slide._element.get("show", 1) == "0":
-                continue
-
-            slide_idx += 1
-            try:
-                if slide.slide_layout.name not in layouts:
-                    raise ValueError(
-                        f"Slide layout {slide.slide_layout.name} not found"
-                    )
-                slides.append(
-                    SlidePage.from_slide(
-                        slide,
-                        slide_idx - len(error_history),
-                        slide_idx,
-                        slide_width.pt,
-                        slide_height.pt,
-                        config,
-                        shape_cast,
-                    )
-                )
-            except Exception as e:
-                error_history.append((slide_idx, str(e)))
-                logger.error(
-                    "Fail to parse slide %d of %s: %s",
-                    slide_idx,
+        # Skip slides that won't be printed to PDF, as they are invisible
+        visible_slides = [
+            i
+            for i, slide in enumerate(prs.slides)
+            if slide._element.get("show", 1) != "0"
+        ]
+        num_workers = min(max_workers, -(-len(visible_slides) // SLIDES_PER_WORKER))
+        if num_workers <= 1:
+            slides, error_history, image_batch = _parse_slides(
+                prs, file_path, visible_slides, config, shape_cast
+            )
+        else:
+            # slides are independent, so they are parsed by worker processes loading the file
+            if _PARSE_EXECUTOR is None:
+                _PARSE_EXECUTOR = ProcessPoolExecutor(max(PARSE_WORKERS, num_workers))
+            futures = [
+                _PARSE_EXECUTOR.submit(
+                    _parse_slides_in_worker,
                     file_path,
-                    e,
+                    visible_slides,
+                    range(i, len(visible_slides), num_workers),
+                    config,
+                    shape_cast,
                 )
-                logger.error(traceback.format_exc())
+                for i in range(num_workers)
+            ]
+            slides, error_history, image_batch = [], [], ImageConversionBatch()
+            for future in futures:
+                worker_slides, worker_errors, worker_batch = pickle.loads(
+                    future.result()
+                )
+                slides.extend(worker_slides)
+                error_history.extend(worker_errors)
+                image_batch.merge(worker_batch)
+            slides.sort(key=lambda slide: slide.real_idx)
+
+        # write the images of all slides at once, slides with an image failed to write fail to parse
+        for image_path, error in image_batch.run().items():
+            for real_idx in image_batch.owners[image_path]:
+                error_history.append(
+                    (real_idx, f"Failed to write {image_path}: {error}")
+                )
+        error_history = sorted(dict(error_history).items())
+        failed_slides = [idx for idx, _ in error_history]
+        slides = [slide for slide in slides if slide.real_idx not in failed_slides]
+        for slide in slides:
+            slide_idx = slide.real_idx - bisect(failed_slides, slide.real_idx)
+            if slide.slide_idx != slide_idx:
+                slide.set_index(slide_idx)
 
         return cls(
             slides, error_history, slide_width, slide_height, file_path, num_pages
         )
 
+    def empty_copy(self) -> "Presentation":
+        """
+        Create a presentation with the same source file and no slides, much cheaper than a deepcopy.
+
+        Returns:
+            Presentation: The empty presentation.
+        """
+        return replace(self, slides=[], error_history=list(self.error_history))
+
     def save(self, file_path: str, layout_only: bool = False) -> None:
         """
         Save the presentation to a file.
@@ -366,6 +579,62 @@ class Presentation:
                 self.clear_text(pptx_slide.shapes)
         self.prs.save(file_path)
 
+    async def render_slide(self, slide: SlidePage, cache_dir: str) -> str:
+        """
+        Render a single slide, built into a package holding only the template's masters, layouts
+        and this slide. Images are cached by the hash of the package parts, so an unchanged slide
+        is never rendered twice.
+
+        The package is loaded once per presentation and emptied after each build. Slides are
+        built into it in a thread, one at a time, so renders do not block the event loop.
+
+        Args:
+            slide (SlidePage): The slide to render.
+            cache_dir (str): The directory of the rendered images.
+
+        Returns:
+            str: The path of the rendered image.
+        """
+        image_path, pptx_blob = await asyncio.to_thread(
+            self._build_render_package, slide, cache_dir
+        )
+        if pptx_blob is None:
+            return image_path
+
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with open(join(temp_dir, "slide.pptx"), "wb") as f:
+                f.write(pptx_blob)
+            await ppt_to_images_async(join(temp_dir, "slide.pptx"), temp_dir)
+            os.replace(join(temp_dir, "slide_0001.jpg"), image_path)
+        return image_path
+
+    def _build_render_package(
+        self, slide: SlidePage, cache_dir: str
+    ) -> tuple[str, bytes | None]:
+        # returns the image path, and the package to render unless the image is cached
+        with self._render_lock:
+            if self._render_prs is None:
+                self._render_prs = self.empty_copy()
+                self._render_prs.clear_slides()
+            render_prs = self._render_prs
+            try:
+                render_prs.build_slide(slide)
+                digest = hashlib.sha1()
+                for part in sorted(
+                    render_prs.prs.part.package.iter_parts(), key=lambda p: p.partname
+                ):
+                    digest.update(part.partname.encode())
+                    digest.update(part.blob)
+                image_path = join(cache_dir, f"{digest.hexdigest()}.jpg")
+                if exists(image_path):
+                    return image_path, None
+                pptx_file = io.BytesIO()
+                render_prs.prs.save(pptx_file)
+                return image_path, pptx_file.getvalue()
+            finally:
+                render_prs.clear_slides()
+
     def build_slide(self, slide: SlidePage) -> PPTXSlide:
         """
         Build a slide in the presentation.
@@ -386,7 +655,8 @@ class Presentation:
                 continue
             for para in shape.text_frame.paragraphs:
                 if not para.edited and para.idx != -1:
-                    shape._closures[ClosureType.POST_PROCESS].append(
+                    shape.add_closure(
+                        ClosureType.POST_PROCESS,
                         Closure(
                             partial(del_para, para.real_idx),
                             para.real_idx,
@@ -448,9 +718,10 @@ class Presentation:
         state = self.__dict__.copy()
         state["prs"] = None
         state["layout_mapping"] = None
+        state["_render_prs"] = None
+        state["_render_lock"] = None
         return state
 
     def __setstate__(self, state: object):
         self.__dict__.update(state)
-        self.prs = load_prs(self.source_file)
-        self.layout_mapping = {layout.name: layout for layout in self.prs.slide_layouts}
+        self._load_package()
@@ -3,6 +3,7 @@ from collections.abc import Callable
 from copy import deepcopy
 from dataclasses import dataclass, field
 from enum import Enum, auto
+from itertools import count
 from os.path import join
 from types import MappingProxyType
 from typing import Any, ClassVar
@@ -34,6 +35,8 @@ from pptagent.utils import (
 )
 
 INDENT = "\t"
+# identifies shape objects in render versions, unlike id() never reused for a new object
+_RENDER_TOKENS = count()
 
 
 def shape_normalize(shape: BaseShape):
@@ -607,6 +610,8 @@ class ShapeElement:
     def __getstate__(self) -> object:
         state = self.__dict__.copy()
         state["shape"] = None
+        # copies and unpickled shapes are new objects, they get a token of their own
+        state.pop("_render_token", None)
         return state
 
     def __repr__(self) -> str:
@@ -641,6 +646,55 @@ class ShapeElement:
         closures.extend(self._closures[ClosureType.MERGE])
         return closures
 
+    def add_closure(self, closure_type: ClosureType, closure: Closure) -> None:
+        """
+        Add a closure to the shape element, marking it as edited.
+
+        Args:
+            closure_type (ClosureType): The type of the closure.
+            closure (Closure): The closure to add.
+        """
+        self._closures[closure_type].append(closure)
+        self.mark_edited()
+
+    def mark_edited(self) -> None:
+        """
+        Increase the edit version of the shape element, invalidating its cached renderings.
+        """
+        self._version = self.version + 1
+
+    @property
+    def version(self) -> int:
+        """
+        Get the edit version of the shape element, increased by every closure and setter.
+
+        Returns:
+            int: The edit version.
+        """
+        return getattr(self, "_version", 0)
+
+    @property
+    def render_version(self) -> tuple:
+        """
+        Get the version of the shape element as rendered, changed by any edit to it.
+
+        Returns:
+            tuple: The render version.
+        """
+        return (self.render_token, self.version)
+
+    @property
+    def render_token(self) -> int:
+        """
+        Get the token identifying this shape object, assigned on first use.
+
+        Returns:
+            int: The render token.
+        """
+        if "_render_token" not in self.__dict__:
+            self._render_token = next(_RENDER_TOKENS)
+        return self._render_token
+
     @property
     def indent(self) -> str:
         """
@@ -670,6 +724,7 @@ class ShapeElement:
             value (float): The left position in points.
         """
         self.style["shape_bounds"]["left"] = value
+        self.mark_edited()
 
     @property
     def top(self) -> float:
@@ -690,6 +745,7 @@ class ShapeElement:
             value (float): The top position in points.
         """
         self.style["shape_bounds"]["top"] = value
+        self.mark_edited()
 
     @property
     def width(self) -> float:
@@ -710,6 +766,7 @@ class ShapeElement:
             value (float): The width in points.
         """
         self.style["shape_bounds"]["width"] = value
+        self.mark_edited()
 
     @property
     def height(self) -> float:
@@ -730,6 +787,7 @@ class ShapeElement:
             value (float): The height in points.
         """
         self.style["shape_bounds"]["height"] = value
+        self.mark_edited()
 
     @property
     def area(self) -> float:
@@ -760,6 +818,7 @@ class ShapeElement:
             value (str): The semantic name.
         """
         self.style["semantic_name"] = value
+        self.mark_edited()
 
     def get_inline_style(self, style_args: StyleArg) -> str:
         """
@@ -910,6 +969,7 @@ class Picture(ShapeElement):
     @is_table.setter
     def is_table(self, value: bool) -> None:
         self.style["is_table"] = value
+        self.mark_edited()
 
     @property
     def grid(self) -> tuple[int, int]:
@@ -920,6 +980,7 @@ class Picture(ShapeElement):
     def grid(self, value: tuple[int, int]) -> None:
         assert self.is_table, "The shape is not a table."
         self.row, self.col = value
+        self.mark_edited()
 
     @property
     def img_path(self) -> str:
@@ -940,6 +1001,7 @@ class Picture(ShapeElement):
             img_path (str): The image path.
         """
         self.data[0] = img_path
+        self.mark_edited()
 
     @property
     def caption(self) -> str | None:
@@ -960,6 +1022,7 @@ class Picture(ShapeElement):
             caption (str): The caption.
         """
         self.data[2] = caption
+        self.mark_edited()
 
     def to_html(self, style_args: StyleArg) -> str:
         """
@@ -1065,6 +1128,14 @@ class GroupShape(ShapeElement):
     def shapes(self):
         return self.data
 
+    @property
+    def render_version(self) -> tuple:
+        return (
+            self.render_token,
+            self.version,
+            tuple(s.render_version for s in self.data),
+        )
+
     def __eq__(self, __value: object) -> bool:
         """
         Check if two group shapes are equal.
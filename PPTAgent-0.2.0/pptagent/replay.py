@@ -0,0 +1,223 @@
+"""
+Record the LLM calls of a run to a trace file and replay them offline, e.g. to profile the
+non-LLM parts of the pipeline or to run end-to-end benchmarks without network access.
+
+Set `PPTAGENT_LLM_RECORD` to a JSONL file to record every call made by `AsyncLLM`, with its
+completion and latency. Set `PPTAGENT_LLM_REPLAY` to a recorded file to answer the calls from it
+instead, at full speed or with the recorded latencies scaled by `PPTAGENT_LLM_REPLAY_LATENCY`.
+Clients are still created when replaying, so an API key (any value) must be configured.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from pptagent.utils import get_logger
+
+logger = get_logger(__name__)
+
+LLM_RECORD_FILE = os.environ.get("PPTAGENT_LLM_RECORD", None)
+LLM_REPLAY_FILE = os.environ.get("PPTAGENT_LLM_REPLAY", None)
+# 0 replays at full speed, 1 with the recorded latencies
+LLM_REPLAY_LATENCY = float(os.environ.get("PPTAGENT_LLM_REPLAY_LATENCY", 0))
+
+
+def request_key(request: dict[str, Any]) -> str:
+    """
+    Get the key of a chat completion request, the digest of its model, messages and arguments.
+    """
+    content = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _prompt_text(messages: list[dict]) -> str:
+    texts = []
+    for message in messages:
+        if isinstance(message["content"], str):
+            texts.append(message["content"])
+            continue
+        for part in message["content"]:
+            if part.get("type") == "text":
+                texts.append(part["text"])
+    return "\n".join(texts)
+
+
+class LLMRecorder:
+    """
+    Append every LLM call to a JSONL trace file, with its key, prompt, completion or error, and timing.
+    """
+
+    def __init__(self, record_file: str):
+        """
+        Initialize the LLMRecorder.
+
+        Args:
+            record_file (str): The JSONL file calls are appended to.
+        """
+        self.record_file = record_file
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    async def complete(
+        self, request: dict[str, Any], call: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """
+        Make a call and record it.
+
+        Args:
+            request (dict[str, Any]): The request, with `model` and `messages`.
+            call (Callable[[], Awaitable[Any]]): Makes the call and returns the chat completion.
+
+        Returns:
+            Any: The chat completion.
+        """
+        start = time.perf_counter()
+        record = {
+            "key": request_key(request),
+            "model": request["model"],
+            "prompt": _prompt_text(request["messages"]),
+            "start": start - self._start,
+        }
+        try:
+            completion = await call()
+        except Exception as e:
+            record |= {"latency": time.perf_counter() - start, "error": str(e)}
+            self._write(record)
+            raise
+        record["latency"] = time.perf_counter() - start
+        record["completion"] = completion.model_dump(mode="json")
+        self._write(record)
+        return completion
+
+    def _write(self, record: dict) -> None:
+        with self._lock:
+            with open(self.record_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class LLMReplayer:
+    """
+    Answer LLM calls with the completions recorded by an `LLMRecorder`, without calling the model.
+
+    A call is answered by the first unused record with the same request key, identical requests are
+    answered in the recorded order. When the request changed, e.g. as prompts embed the date or
+    temporary paths, the unused record of the same model with the most similar prompt is used,
+    unless `strict` is set. Recorded errors are raised again, so retries replay as they happened.
+    """
+
+    def __init__(
+        self,
+        replay_file: str,
+        latency_scale: float = LLM_REPLAY_LATENCY,
+        strict: bool = False,
+    ):
+        """
+        Initialize the LLMReplayer.
+
+        Args:
+            replay_file (str): The JSONL file recorded by an `LLMRecorder`.
+            latency_scale (float): The factor of the recorded latencies to wait before answering.
+            strict (bool): Whether to fail on requests that were not recorded instead of matching prompts.
+        """
+        self.latency_scale = latency_scale
+        self.strict = strict
+        with open(replay_file, encoding="utf-8") as f:
+            self.records = [json.loads(line) for line in f if line.strip()]
+        self._by_key: dict[str, deque[int]] = defaultdict(deque)
+        for idx, record in enumerate(self.records):
+            self._by_key[record["key"]].append(idx)
+        self._unused = set(range(len(self.records)))
+
+    async def complete(
+        self,
+        request: dict[str, Any],
+        call: Callable[[], Awaitable[Any]] | None = None,
+    ) -> Any:
+        """
+        Answer a call from the recorded calls.
+
+        Args:
+            request (dict[str, Any]): The request, with `model` and `messages`.
+            call (Callable[[], Awaitable[Any]] | None): Unused, the model is never called.
+
+        Returns:
+            Any: The recorded chat completion.
+
+        Raises:
+            RuntimeError: If no recorded call matches the request, or the recorded call failed.
+        """
+        from openai.types.chat import ChatCompletion
+
+        record = self._take(request)
+        if self.latency_scale:
+            await asyncio.sleep(record["latency"] * self.latency_scale)
+        if "error" in record:
+            raise RuntimeError(f"Replayed error: {record['error']}")
+        return ChatCompletion.model_validate(record["completion"])
+
+    def _take(self, request: dict[str, Any]) -> dict:
+        # called without awaiting in between, so concurrent calls never take the same record
+        candidates = self._by_key.get(request_key(request), deque())
+        while candidates and candidates[0] not in self._unused:
+            candidates.popleft()
+        if candidates:
+            idx = candidates.popleft()
+        elif self.strict:
+            raise RuntimeError(
+                f"No recorded call matches the request to {request['model']}"
+            )
+        else:
+            # only imported when replaying changed requests, pptagent.llms imports this module
+            from rapidfuzz import process
+            from rapidfuzz.distance import Levenshtein
+
+            unused = {
+                idx: self.records[idx]["prompt"]
+                for idx in self._unused
+                if self.records[idx]["model"] == request["model"]
+            }
+            match = process.extractOne(
+                _prompt_text(request["messages"]),
+                unused,
+                scorer=Levenshtein.normalized_similarity,
+            )
+            if match is None:
+                raise RuntimeError(
+                    f"No recorded call of {request['model']} is left to replay"
+                )
+            idx = match[2]
+            logger.debug(
+                "Replaying a call of %s by prompt similarity", request["model"]
+            )
+        self._unused.discard(idx)
+        return self.records[idx]
+
+
+_llm_recorder: LLMRecorder | LLMReplayer | None = None
+_llm_recorder_configured = False
+
+
+def get_llm_recorder() -> LLMRecorder | LLMReplayer | None:
+    """
+    Get the recorder or replayer of LLM calls, configured from the environment on first use.
+    """
+    global _llm_recorder, _llm_recorder_configured
+    if not _llm_recorder_configured:
+        if LLM_REPLAY_FILE is not None:
+            _llm_recorder = LLMReplayer(LLM_REPLAY_FILE)
+        elif LLM_RECORD_FILE is not None:
+            _llm_recorder = LLMRecorder(LLM_RECORD_FILE)
+        _llm_recorder_configured = True
+    return _llm_recorder
+
+
+def set_llm_recorder(recorder: LLMRecorder | LLMReplayer | None) -> None:
+    global _llm_recorder, _llm_recorder_configured
+    _llm_recorder = recorder
+    _llm_recorder_configured = True
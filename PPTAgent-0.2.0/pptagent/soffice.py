@@ -0,0 +1,438 @@
+import asyncio
+import atexit
+import os
+import queue
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import threading
+import xmlrpc.client
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from os.path import abspath, basename, exists, join, splitext
+from pathlib import Path
+from shutil import which
+from time import monotonic, sleep
+
+from pdf2image import convert_from_path
+
+from pptagent.utils import get_logger
+
+logger = get_logger(__name__)
+
+SOFFICE_WORKERS = int(os.environ.get("SOFFICE_WORKERS", 2))
+# 0 lets each listener take free ports, so that any number of processes can run a pool,
+# otherwise listeners take consecutive ports from it and only one process may run a pool
+SOFFICE_BASE_PORT = int(os.environ.get("SOFFICE_BASE_PORT", 0))
+SOFFICE_TIMEOUT = float(os.environ.get("SOFFICE_TIMEOUT", 120))
+RASTERIZE_WORKERS = int(os.environ.get("RASTERIZE_WORKERS", min(os.cpu_count() or 1, 8)))
+# Pages rendered by a worker process at least, smaller decks are rendered in process
+PAGES_PER_WORKER = 8
+
+
+class _TimeoutTransport(xmlrpc.client.Transport):
+    def __init__(self, timeout: float):
+        super().__init__()
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        connection = super().make_connection(host)
+        connection.timeout = self.timeout
+        return connection
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _listening_pid_owns(pid: int, port: int) -> bool:
+    """
+    Check that the socket listening on a local port belongs to a process, by the socket inodes
+    in /proc. Without /proc the check is skipped.
+    """
+    try:
+        with open("/proc/net/tcp") as f:
+            lines = f.readlines()[1:]
+        fds = os.listdir(f"/proc/{pid}/fd")
+    except OSError:
+        return True
+    inodes = {
+        fields[9]
+        for fields in (line.split() for line in lines)
+        # the local address is hex ip:port, 0A is the LISTEN state
+        if int(fields[1].split(":")[1], 16) == port and fields[3] == "0A"
+    }
+    for fd in fds:
+        try:
+            link = os.readlink(f"/proc/{pid}/fd/{fd}")
+        except OSError:
+            continue
+        if link.startswith("socket:[") and link[8:-1] in inodes:
+            return True
+    return False
+
+
+class SofficeWorker:
+    """
+    A long-lived LibreOffice listener served by `unoserver`, which converts documents over XML-RPC.
+    """
+
+    def __init__(self, port: int = 0, uno_port: int = 0):
+        """
+        Initialize the SofficeWorker, the listener is started on first use.
+
+        Args:
+            port (int): The XML-RPC port of unoserver, 0 for a free port picked at each start.
+            uno_port (int): The UNO port of the LibreOffice listener, 0 for a free port picked at each start.
+        """
+        self.fixed_ports = (port, uno_port)
+        self.port = port
+        self.uno_port = uno_port
+        self.profile_dir = tempfile.mkdtemp(prefix="pptagent-soffice-")
+        self.process: subprocess.Popen | None = None
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def _proxy(self, timeout: float) -> xmlrpc.client.ServerProxy:
+        return xmlrpc.client.ServerProxy(
+            f"http://127.0.0.1:{self.port}",
+            transport=_TimeoutTransport(timeout),
+            allow_none=True,
+        )
+
+    def start(self, timeout: float = 60) -> None:
+        """
+        Start the listener and wait until it accepts requests.
+
+        Args:
+            timeout (float): Seconds to wait for the listener to be ready.
+
+        Raises:
+            RuntimeError: If the listener exits, is not ready in time, or its port is taken by another process.
+        """
+        port, uno_port = self.fixed_ports
+        self.port = port or _free_port()
+        self.uno_port = uno_port or _free_port()
+        self.process = subprocess.Popen(
+            [
+                "unoserver",
+                "--interface",
+                "127.0.0.1",
+                "--port",
+                str(self.port),
+                "--uno-port",
+                str(self.uno_port),
+                "--user-installation",
+                Path(self.profile_dir).as_uri(),
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            if not self.alive:
+                raise RuntimeError(
+                    f"unoserver on port {self.port} exited with code {self.process.returncode}"
+                )
+            try:
+                self._proxy(5).info()
+            except (OSError, xmlrpc.client.Error):
+                sleep(0.5)
+                continue
+            # another process's listener may answer on the port while ours failed to bind it
+            if not _listening_pid_owns(self.process.pid, self.port):
+                self.stop()
+                raise RuntimeError(
+                    f"port {self.port} of unoserver is taken by another process"
+                )
+            logger.debug("unoserver started on port %d", self.port)
+            return
+        self.stop()
+        raise RuntimeError(f"unoserver on port {self.port} is not ready in {timeout}s")
+
+    def stop(self) -> None:
+        """
+        Stop the listener together with its LibreOffice process.
+        """
+        if self.process is None:
+            return
+        if self.alive:
+            try:
+                os.killpg(self.process.pid, signal.SIGTERM)
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                os.killpg(self.process.pid, signal.SIGKILL)
+                self.process.wait()
+            except ProcessLookupError:
+                pass
+        self.process = None
+
+    def convert(self, file: str, output_file: str, timeout: float) -> None:
+        """
+        Convert a document, the listener is restarted if it crashed or timed out.
+
+        Args:
+            file (str): The absolute path of the document.
+            output_file (str): The absolute path of the converted file, its extension decides the format.
+            timeout (float): Seconds allowed for the conversion.
+        """
+        if not self.alive:
+            self.start()
+        convert_to = splitext(output_file)[1].removeprefix(".")
+        try:
+            self._proxy(timeout).convert(file, None, output_file, convert_to)
+        except Exception:
+            # A hung or crashed listener is replaced on the next conversion
+            self.stop()
+            raise
+
+    def close(self) -> None:
+        self.stop()
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+
+class SofficePool:
+    """
+    A pool of SofficeWorker, conversions are queued until a worker is idle.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = SOFFICE_WORKERS,
+        base_port: int = SOFFICE_BASE_PORT,
+        timeout: float = SOFFICE_TIMEOUT,
+    ):
+        """
+        Initialize the SofficePool.
+
+        Args:
+            num_workers (int): The number of LibreOffice listeners.
+            base_port (int): The first port used by the listeners, each listener takes two ports,
+                0 for free ports.
+            timeout (float): Seconds allowed for a conversion.
+        """
+        self.timeout = timeout
+        self.workers = [
+            (
+                SofficeWorker(base_port + 2 * i, base_port + 2 * i + 1)
+                if base_port
+                else SofficeWorker()
+            )
+            for i in range(num_workers)
+        ]
+        self._idle: queue.Queue[SofficeWorker] = queue.Queue()
+        for worker in self.workers:
+            self._idle.put(worker)
+        atexit.register(self.close)
+
+    def convert_to_pdf(self, file: str, output_dir: str) -> str:
+        """
+        Convert a presentation to pdf.
+
+        Args:
+            file (str): The path of the presentation.
+            output_dir (str): The directory of the pdf.
+
+        Returns:
+            str: The path of the pdf.
+        """
+        pdf_file = abspath(join(output_dir, splitext(basename(file))[0] + ".pdf"))
+        self.convert(file, pdf_file)
+        if not exists(pdf_file):
+            raise RuntimeError(f"No PDF file was created for {file}")
+        return pdf_file
+
+    def convert(self, file: str, output_file: str) -> None:
+        """
+        Convert a document on the next idle worker.
+
+        Args:
+            file (str): The path of the document.
+            output_file (str): The path of the converted file, its extension decides the format.
+        """
+        worker = self._idle.get()
+        try:
+            worker.convert(abspath(file), abspath(output_file), self.timeout)
+        finally:
+            self._idle.put(worker)
+
+    def close(self) -> None:
+        for worker in self.workers:
+            worker.close()
+
+
+_SOFFICE_POOL: SofficePool | None = None
+_SOFFICE_POOL_LOCK = threading.Lock()
+
+
+def get_soffice_pool() -> SofficePool | None:
+    """
+    Get the process-wide SofficePool.
+
+    Returns:
+        SofficePool | None: The pool, or None if unoserver is not installed.
+    """
+    global _SOFFICE_POOL
+    with _SOFFICE_POOL_LOCK:
+        if _SOFFICE_POOL is None and which("unoserver") is not None:
+            _SOFFICE_POOL = SofficePool()
+    return _SOFFICE_POOL
+
+
+def _cold_convert_to_pdf(file: str, output_dir: str) -> str:
+    process = subprocess.run(
+        ["soffice", "--headless", "--convert-to", "pdf", file, "--outdir", output_dir],
+        capture_output=True,
+        timeout=SOFFICE_TIMEOUT,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"soffice failed with error: {process.stderr.decode()}")
+    pdf_file = join(output_dir, splitext(basename(file))[0] + ".pdf")
+    if not exists(pdf_file):
+        raise RuntimeError(
+            f"No PDF file was created in the temporary directory: {file}\n"
+            f"Output: {process.stdout.decode()}\n"
+            f"Error: {process.stderr.decode()}"
+        )
+    return pdf_file
+
+
+def convert_to_pdf(file: str, output_dir: str) -> str:
+    """
+    Convert a presentation to pdf, using the soffice pool if unoserver is installed,
+    otherwise launching a soffice process.
+
+    Args:
+        file (str): The path of the presentation.
+        output_dir (str): The directory of the pdf.
+
+    Returns:
+        str: The path of the pdf.
+    """
+    pool = get_soffice_pool()
+    if pool is not None:
+        return pool.convert_to_pdf(file, output_dir)
+    return _cold_convert_to_pdf(file, output_dir)
+
+
+async def convert_to_pdf_async(file: str, output_dir: str) -> str:
+    """
+    Asynchronously convert a presentation to pdf, see `convert_to_pdf`.
+    """
+    return await asyncio.to_thread(convert_to_pdf, file, output_dir)
+
+
+def convert_to_png(files: list[str], output_dir: str) -> None:
+    """
+    Convert images LibreOffice can read (e.g. wmf, emf) to png, in parallel by the soffice pool
+    if unoserver is installed, otherwise by a single soffice process. Failures are logged, not raised,
+    callers check which outputs exist.
+
+    Args:
+        files (list[str]): The paths of the images.
+        output_dir (str): The directory of the png files, named after the images.
+    """
+    pool = get_soffice_pool()
+    if pool is not None:
+
+        def convert(file: str):
+            try:
+                pool.convert(
+                    file, join(output_dir, splitext(basename(file))[0] + ".png")
+                )
+            except Exception as e:
+                logger.warning("Failed to convert %s to png: %s", file, e)
+
+        with ThreadPoolExecutor(len(pool.workers)) as executor:
+            list(executor.map(convert, files))
+        return
+
+    try:
+        process = subprocess.run(
+            ["soffice", "--headless", "--convert-to", "png", *files]
+            + ["--outdir", output_dir],
+            capture_output=True,
+            timeout=SOFFICE_TIMEOUT,
+        )
+        if process.returncode != 0:
+            logger.warning("soffice failed with error: %s", process.stderr.decode())
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning("Failed to convert %d images to png: %s", len(files), e)
+
+
+_RASTERIZE_EXECUTOR: ProcessPoolExecutor | None = None
+_RASTERIZE_EXECUTOR_LOCK = threading.Lock()
+# pdfium is not thread-safe, every use of it in this process holds this lock
+_PDFIUM_LOCK = threading.Lock()
+
+
+def _render_pages(
+    pdf_file: str, page_indices: list[int], output_dir: str, scale: float
+) -> None:
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(pdf_file)
+    try:
+        for idx in page_indices:
+            image = pdf[idx].render(scale=scale).to_pil()
+            image.convert("RGB").save(join(output_dir, f"slide_{idx + 1:04d}.jpg"))
+    finally:
+        pdf.close()
+
+
+def rasterize_pdf(pdf_file: str, output_dir: str, dpi: int = 72) -> int:
+    """
+    Rasterize each page of a pdf to `slide_{page:04d}.jpg`, pages are rendered in parallel
+    by pypdfium2 if it is installed, otherwise by pdf2image. Safe to call from several threads,
+    small decks rendered in process are rendered one at a time.
+
+    Args:
+        pdf_file (str): The path of the pdf.
+        output_dir (str): The directory of the images.
+        dpi (int): The resolution of the images.
+
+    Returns:
+        int: The number of pages.
+    """
+    global _RASTERIZE_EXECUTOR
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        images = convert_from_path(pdf_file, dpi=dpi, thread_count=RASTERIZE_WORKERS)
+        for i, img in enumerate(images):
+            img.save(join(output_dir, f"slide_{i + 1:04d}.jpg"))
+        return len(images)
+
+    with _PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(pdf_file)
+        num_pages = len(pdf)
+        pdf.close()
+    num_workers = min(RASTERIZE_WORKERS, -(-num_pages // PAGES_PER_WORKER))
+    if num_workers <= 1:
+        with _PDFIUM_LOCK:
+            _render_pages(pdf_file, list(range(num_pages)), output_dir, dpi / 72)
+        return num_pages
+
+    # larger decks are rendered in parallel by worker processes, each with its own pdfium
+    with _RASTERIZE_EXECUTOR_LOCK:
+        if _RASTERIZE_EXECUTOR is None:
+            _RASTERIZE_EXECUTOR = ProcessPoolExecutor(RASTERIZE_WORKERS)
+    futures = [
+        _RASTERIZE_EXECUTOR.submit(
+            _render_pages,
+            pdf_file,
+            list(range(i, num_pages, num_workers)),
+            output_dir,
+            dpi / 72,
+        )
+        for i in range(num_workers)
+    ]
+    for future in futures:
+        future.result()
+    return num_pages
@@ -0,0 +1,208 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Generator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Any
+
+
+@dataclass
+class LLMUsage:
+    """
+    Token usage and latency of one or more LLM calls.
+    """
+
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    latency: float = 0.0
+    calls: int = 0
+
+    @classmethod
+    def from_completion(cls, completion: Any, latency: float) -> "LLMUsage":
+        """
+        Extract the usage reported by the provider from a chat completion.
+
+        Args:
+            completion (Any): The chat completion.
+            latency (float): Seconds taken by the call.
+
+        Returns:
+            LLMUsage: The usage, token counts are zero if the provider reports none.
+        """
+        usage = getattr(completion, "usage", None)
+        if usage is None:
+            return cls(latency=latency, calls=1)
+        details = getattr(usage, "prompt_tokens_details", None)
+        return cls(
+            prompt_tokens=usage.prompt_tokens or 0,
+            completion_tokens=usage.completion_tokens or 0,
+            cached_tokens=getattr(details, "cached_tokens", None) or 0,
+            latency=latency,
+            calls=1,
+        )
+
+    def __add__(self, other: "LLMUsage") -> "LLMUsage":
+        return LLMUsage(
+            self.prompt_tokens + other.prompt_tokens,
+            self.completion_tokens + other.completion_tokens,
+            self.cached_tokens + other.cached_tokens,
+            self.latency + other.latency,
+            self.calls + other.calls,
+        )
+
+
+@dataclass
+class TraceScope:
+    """
+    Attributes attached to the LLM calls made inside a `trace_scope`, with their accumulated usage.
+    """
+
+    attributes: dict[str, Any]
+    usage: LLMUsage = field(default_factory=LLMUsage)
+
+
+_active_scopes: ContextVar[tuple[TraceScope, ...]] = ContextVar(
+    "pptagent_trace_scopes", default=()
+)
+
+
+@contextmanager
+def trace_scope(**attributes: Any) -> Generator[TraceScope, None, None]:
+    """
+    Attach attributes (e.g. `role`, `slide`) to the LLM calls made inside the scope.
+    Scopes nest and follow asyncio tasks, as they are stored in a context variable.
+
+    Args:
+        **attributes: The attributes of the scope.
+
+    Yields:
+        TraceScope: The scope, its usage is accumulated from the calls made inside it.
+    """
+    scope = TraceScope(attributes)
+    token = _active_scopes.set(_active_scopes.get() + (scope,))
+    try:
+        yield scope
+    finally:
+        _active_scopes.reset(token)
+
+
+class Tracer:
+    """
+    Collect a span for each LLM call, aggregated in memory and optionally written to a JSONL file.
+    """
+
+    def __init__(self, trace_file: str | None = None):
+        """
+        Initialize the Tracer.
+
+        Args:
+            trace_file (str | None): The JSONL file spans are appended to.
+        """
+        self.trace_file = trace_file
+        self._lock = threading.Lock()
+        self._usages: dict[tuple[str, Any], LLMUsage] = defaultdict(LLMUsage)
+
+    def record_llm_call(
+        self,
+        model: str,
+        start_time: float,
+        usage: LLMUsage,
+        error: Exception | None = None,
+    ) -> None:
+        """
+        Record an LLM call made in the current trace scopes.
+
+        Args:
+            model (str): The model name.
+            start_time (float): The unix time the call started.
+            usage (LLMUsage): The usage of the call.
+            error (Exception | None): The error raised by the call.
+        """
+        scopes = _active_scopes.get()
+        attributes = {"model": model}
+        for scope in scopes:
+            scope.usage += usage
+            attributes |= scope.attributes
+        span = {
+            "name": "llm.call",
+            "start_time": start_time,
+            "duration": usage.latency,
+            "status": "ok" if error is None else "error",
+            "attributes": attributes,
+            "usage": asdict(usage),
+        }
+        if error is not None:
+            span["error"] = str(error)
+
+        with self._lock:
+            self._usages[("model", model)] += usage
+            for key in ("role", "slide"):
+                if key in attributes:
+                    self._usages[(key, attributes[key])] += usage
+            if self.trace_file is not None:
+                with open(self.trace_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(span, ensure_ascii=False, default=str) + "\n")
+
+    def summary(self) -> dict[str, dict[str, dict]]:
+        """
+        Summarize the usage by model, role and slide.
+
+        Returns:
+            dict[str, dict[str, dict]]: Mapping of the aggregation key to the usage of each value.
+        """
+        summary = defaultdict(dict)
+        with self._lock:
+            for (key, value), usage in self._usages.items():
+                summary[key][str(value)] = asdict(usage)
+        return dict(summary)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._usages.clear()
+
+
+_tracer = Tracer(os.environ.get("PPTAGENT_TRACE_FILE", None))
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def set_tracer(tracer: Tracer) -> None:
+    global _tracer
+    _tracer = tracer
+
+
+@dataclass
+class LLMCall:
+    model: str
+    completion: Any = None
+
+
+@contextmanager
+def trace_llm_call(model: str) -> Generator[LLMCall, None, None]:
+    """
+    Time an LLM call and record it to the tracer, the completion should be assigned to the yielded `LLMCall`.
+
+    Args:
+        model (str): The model name.
+
+    Yields:
+        LLMCall: The call being traced.
+    """
+    call = LLMCall(model)
+    start_time = time.time()
+    start = time.perf_counter()
+    try:
+        yield call
+    except Exception as e:
+        usage = LLMUsage(latency=time.perf_counter() - start, calls=1)
+        get_tracer().record_llm_call(model, start_time, usage, e)
+        raise
+    usage = LLMUsage.from_completion(call.completion, time.perf_counter() - start)
+    get_tracer().record_llm_call(model, start_time, usage)
@@ -0,0 +1,182 @@
+import io
+import json
+import os
+import pickle
+from copy import deepcopy
+from functools import cached_property
+from os.path import exists, join, realpath
+from typing import Any
+
+from lxml import etree
+from pptx.oxml import parse_xml
+
+from pptagent.presentation import Presentation
+from pptagent.utils import (
+    TEMPLATE_CACHE_DIR,
+    Config,
+    atomic_write,
+    file_digest,
+    get_logger,
+)
+
+logger = get_logger(__name__)
+
+# Bump this when the structure of cached objects changes, stale caches are then reparsed
+CACHE_VERSION = 1
+PRESENTATION_CACHE = "presentation.pkl"
+
+
+class XMLPickler(pickle.Pickler):
+    """
+    A pickler which serializes lxml elements (e.g. `ShapeElement.sp`) as XML bytes.
+    """
+
+    def reducer_override(self, obj: Any):
+        if isinstance(obj, etree._Element):
+            return parse_xml, (etree.tostring(obj),)
+        return NotImplemented
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Pickle an object that may contain lxml elements.
+
+    Args:
+        obj (Any): The object to serialize.
+
+    Returns:
+        bytes: The pickled object.
+    """
+    buffer = io.BytesIO()
+    XMLPickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump(obj)
+    return buffer.getvalue()
+
+
+class TemplateCache:
+    """
+    Artifacts derived from a template (parsed presentation, slide images, image captions and slide induction),
+    stored in the template's run directory and validated against the content hash of its source file.
+    Failing to write the parsed presentation is not an error, the template is then parsed once per process.
+    The parsed presentation is unpickled from the cache directory, which must therefore be trusted.
+    """
+
+    def __init__(
+        self,
+        template_dir: str,
+        source_name: str = "source.pptx",
+        cache_dir: str | None = None,
+    ):
+        """
+        Initialize the TemplateCache.
+
+        Args:
+            template_dir (str): The directory containing the template, its images and cached artifacts.
+            source_name (str): The file name of the template presentation.
+            cache_dir (str | None): The directory of the parsed presentation, defaults to `template_dir`.
+        """
+        self.config = Config(template_dir)
+        self.source_file = join(template_dir, source_name)
+        self.cache_dir = cache_dir or template_dir
+        self._pickled_prs: bytes | None = None
+        self._json_cache: dict[str, Any] = {}
+
+    @cached_property
+    def template_hash(self) -> str:
+        return file_digest(self.source_file)
+
+    @property
+    def slide_image_dir(self) -> str:
+        return join(self.config.RUN_DIR, "slide_images")
+
+    def load_presentation(self) -> Presentation:
+        """
+        Load the parsed presentation, parsing the template only if no valid cache exists.
+        Each call returns an independent copy, so callers are free to edit it.
+
+        Returns:
+            Presentation: The parsed presentation.
+        """
+        if self._pickled_prs is None:
+            self._pickled_prs = self._load_pickled_prs()
+        return pickle.loads(self._pickled_prs)
+
+    def _load_pickled_prs(self) -> bytes:
+        cache_file = join(self.cache_dir, PRESENTATION_CACHE)
+        if exists(cache_file):
+            try:
+                with open(cache_file, "rb") as f:
+                    version, digest, pickled_prs = pickle.load(f)
+                if version == CACHE_VERSION and digest == self.template_hash:
+                    return pickled_prs
+                logger.debug("Stale presentation cache found: %s", cache_file)
+            except Exception as e:
+                logger.warning(
+                    "Failed to load presentation cache %s: %s", cache_file, e
+                )
+
+        presentation = Presentation.from_file(self.source_file, self.config)
+        pickled_prs = dumps(presentation)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            atomic_write(
+                cache_file,
+                pickle.dumps((CACHE_VERSION, self.template_hash, pickled_prs)),
+            )
+        except OSError as e:
+            logger.warning("Failed to save presentation cache %s: %s", cache_file, e)
+        return pickled_prs
+
+    def has(self, name: str) -> bool:
+        return exists(join(self.config.RUN_DIR, name))
+
+    def load_json(self, name: str) -> Any | None:
+        """
+        Load a json artifact of the template, e.g. `image_stats.json` or `slide_induction.json`.
+
+        Args:
+            name (str): The file name of the artifact.
+
+        Returns:
+            Any | None: A copy of the artifact, or None if it does not exist.
+        """
+        if name not in self._json_cache:
+            if not self.has(name):
+                return None
+            with open(join(self.config.RUN_DIR, name), encoding="utf-8") as f:
+                self._json_cache[name] = json.load(f)
+        return deepcopy(self._json_cache[name])
+
+    def dump_json(self, name: str, obj: Any) -> None:
+        """
+        Save a json artifact of the template.
+
+        Args:
+            name (str): The file name of the artifact.
+            obj (Any): The artifact to save.
+        """
+        content = json.dumps(obj, ensure_ascii=False, indent=4)
+        atomic_write(join(self.config.RUN_DIR, name), content)
+        self._json_cache[name] = json.loads(content)
+
+
+_TEMPLATE_CACHES: dict[str, TemplateCache] = {}
+
+
+def get_template_cache(
+    template_dir: str, cache_dir: str | None = None
+) -> TemplateCache:
+    """
+    Get the process-wide TemplateCache of a template directory.
+
+    Args:
+        template_dir (str): The directory containing the template.
+        cache_dir (str | None): The directory of the parsed presentation, see `TemplateCache`,
+            only used when the cache of the template is created.
+
+    Returns:
+        TemplateCache: The cache of the template.
+    """
+    key = realpath(template_dir)
+    if key not in _TEMPLATE_CACHES:
+        _TEMPLATE_CACHES[key] = TemplateCache(template_dir, cache_dir=cache_dir)
+    return _TEMPLATE_CACHES[key]
@@ -1,22 +1,35 @@
 import asyncio
+import hashlib
 import io
 import json
 import logging
 import os
+import re
 import shutil
 import subprocess
 import tempfile
 import traceback
-from itertools import product
-from os.path import dirname, exists, join
+import uuid
+from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import cache
+from os.path import dirname, exists, expanduser, join
 from shutil import which
 from time import sleep, time
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
 import json_repair
-import Levenshtein
-from html2image import Html2Image
-from pdf2image import convert_from_path
+import numpy as np
+import yaml
+from jinja2 import (
+    Environment,
+    FileSystemBytecodeCache,
+    FunctionLoader,
+    StrictUndefined,
+    Template,
+)
 from PIL import Image as PILImage
 from pptx.dml.color import RGBColor
 from pptx.oxml import parse_xml
@@ -27,6 +40,9 @@ from pptx.util import Length, Pt
 from pydantic import BaseModel
 from tenacity import RetryCallState, retry, stop_after_attempt, wait_fixed
 
+if TYPE_CHECKING:
+    from html2image import Html2Image
+
 
 class Language(BaseModel):
     lid: str
@@ -197,6 +213,8 @@ def edit_distance(text1: str, text2: str) -> float:
     Returns:
         float: The normalized edit distance (0.0 to 1.0, where 1.0 means identical).
     """
+    import Levenshtein
+
     if not text1 and not text2:
         return 1.0
     return 1 - Levenshtein.distance(text1, text2) / max(len(text1), len(text2))
@@ -213,10 +231,61 @@ def tenacity_log(retry_state: RetryCallState) -> None:
     traceback.print_tb(retry_state.outcome.exception().__traceback__)
 
 
+JSON_TOKEN_REGEX = re.compile(r'[\[\]{}"\\]')
+CLOSING_BRACKETS = {"}": "{", "]": "["}
+
+
+def find_json_spans(text: str) -> tuple[list[tuple[int, int]], int | None]:
+    """
+    Find the balanced bracket spans of a text in one pass, ignoring brackets in JSON strings.
+
+    Args:
+        text (str): The text to scan.
+
+    Returns:
+        tuple[list[tuple[int, int]], int | None]: The (start, end) of each balanced span ordered by end,
+            and the start of the first bracket left unclosed, e.g. in a truncated response.
+    """
+    spans = []
+    stack = []
+    in_string = False
+    escaped_pos = -1
+    for match in JSON_TOKEN_REGEX.finditer(text):
+        pos, char = match.start(), match.group()
+        if pos == escaped_pos:
+            continue
+        if in_string:
+            if char == "\\":
+                escaped_pos = pos + 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            # a JSON string only follows one of `[{,:`, other quotes belong to the prose
+            prev = pos - 1
+            while prev >= 0 and text[prev].isspace():
+                prev -= 1
+            in_string = bool(stack) and prev >= 0 and text[prev] in "[{,:"
+        elif char in "[{":
+            stack.append((char, pos))
+        elif char in CLOSING_BRACKETS:
+            if not stack or stack[-1][0] != CLOSING_BRACKETS[char]:
+                # unbalanced brackets, restart from the next opening one
+                stack.clear()
+                continue
+            spans.append((stack.pop()[1], pos + 1))
+    return spans, stack[0][1] if stack else None
+
+
 def get_json_from_response(response: str) -> dict[str, Any]:
     """
     Extract JSON from a text response.
 
+    The balanced bracket spans of the response are found in one pass and parsed strictly from the
+    largest one, `json_repair` is only used when none of them is valid JSON. Spans nested in a
+    bracket that is never closed, e.g. of a truncated response, are repaired along with it instead.
+    When the response holds several JSON values, the largest valid one is returned, rather than
+    the list of all of them `json_repair` would make.
+
     Args:
         response (str): The response text.
 
@@ -240,22 +309,56 @@ def get_json_from_response(response: str) -> dict[str, Any]:
         if isinstance(json_obj, (dict, list)):
             return json_obj
 
-    # Try to find JSON by looking for matching braces
-    open_braces = []
-    close_braces = []
-
-    for i, char in enumerate(response):
-        if char == "{" or char == "[":
-            open_braces.append(i)
-        elif char == "}" or char == "]":
-            close_braces.append(i)
-
-    for i, j in product(open_braces, reversed(close_braces)):
-        if i > j:
+    # Try to find JSON by looking for balanced brackets, from the largest span. A nested span is
+    # only parsed on its own if it lies after the position its parents failed to parse at, and
+    # not inside an unclosed bracket that starts a truncated value.
+    spans, unclosed = find_json_spans(response)
+    # an unclosed bracket followed by JSON rather than prose starts a truncated value
+    truncated = unclosed is not None and bool(
+        re.match(r"\s*[\"{\[\d-]", response[unclosed + 1 :])
+    )
+    spans.sort(key=lambda span: (span[0], -span[1]))
+    parents, stack = {}, []
+    for span in spans:
+        while stack and stack[-1][1] <= span[0]:
+            stack.pop()
+        parents[span] = stack[-1] if stack else None
+        stack.append(span)
+
+    error_pos = {None: -1}
+    for span in sorted(spans, key=lambda span: span[0] - span[1]):
+        i, j = span
+        if truncated and i > unclosed:
+            error_pos[span] = j
+            continue
+        if i < error_pos[parents[span]]:
+            error_pos[span] = error_pos[parents[span]]
             continue
         try:
-            json_obj = json_repair.loads(response[i : j + 1])
-            if isinstance(json_obj, (dict, list)):
+            json_obj = json.loads(response[i:j])
+        except json.JSONDecodeError as e:
+            error_pos[span] = i + e.pos
+            continue
+        except Exception:
+            error_pos[span] = i
+            continue
+        if json_obj:
+            return json_obj
+        error_pos[span] = j
+
+    # Repair a truncated response first, then the largest spans
+    candidates = [response[i:j] for i, j in spans if parents[(i, j)] is None]
+    candidates.sort(key=len, reverse=True)
+    if unclosed is not None:
+        candidates.insert(0, response[unclosed:])
+    open_pos = [response.find(c) for c in "{[" if c in response]
+    close_pos = max(response.rfind("}"), response.rfind("]"))
+    if open_pos and min(open_pos) < close_pos:
+        candidates.append(response[min(open_pos) : close_pos + 1])
+    for candidate in candidates:
+        try:
+            json_obj = json_repair.loads(candidate)
+            if isinstance(json_obj, (dict, list)) and json_obj:
                 return json_obj
         except Exception:
             pass
@@ -294,39 +397,58 @@ th {
 """
 
 
-def manual_scan_crop(img_path: str):
-    """Manually detect and crop image boundaries by scanning pixels."""
-    img = PILImage.open(img_path).convert("RGB")
+def crop_whitespace(img: PILImage.Image, padding: int = 20) -> PILImage.Image:
+    """
+    Crop an image to its non-white content with padding around it.
+
+    Args:
+        img (PILImage.Image): The image.
+        padding (int): The padding kept around the content, in pixels.
+
+    Returns:
+        PILImage.Image: The cropped image, or the image itself if it is blank.
+    """
+    img = img.convert("RGB")
+    # Detect non-white pixels (using a relaxed threshold to account for anti-aliasing)
+    mask = (np.asarray(img) < 248).any(axis=2)
+    rows = np.flatnonzero(mask.any(axis=1))
+    if len(rows) == 0:
+        return img
+    cols = np.flatnonzero(mask.any(axis=0))
     width, height = img.size
-    pixels = img.load()
-    left, top, right, bottom = width, height, 0, 0
-    found_content = False
-
-    # Scan all pixels to find non-white areas
-    for y in range(height):
-        for x in range(width):
-            r, g, b = pixels[x, y]
-            # Detect non-white pixels (using a relaxed threshold to account for anti-aliasing)
-            if r < 248 or g < 248 or b < 248:
-                left = min(left, x)
-                right = max(right, x)
-                top = min(top, y)
-                bottom = max(bottom, y)
-                found_content = True
-
-    if found_content:
-        padding = 20
-        bbox = (
-            max(0, left - padding),
-            max(0, top - padding),
-            min(width, right + 1 + padding),
-            min(height, bottom + 1 + padding),
-        )
+    bbox = (
+        max(0, int(cols[0]) - padding),
+        max(0, int(rows[0]) - padding),
+        min(width, int(cols[-1]) + 1 + padding),
+        min(height, int(rows[-1]) + 1 + padding),
+    )
+    return img.crop(bbox)
 
-        cropped_img = img.crop(bbox)
+
+def manual_scan_crop(img_path: str):
+    """Detect and crop image boundaries to the non-white content."""
+    with PILImage.open(img_path) as img:
+        cropped_img = crop_whitespace(img)
+    if cropped_img.size != img.size:
         cropped_img.save(img_path)
 
 
+@cache
+def get_html_renderer() -> "Html2Image":
+    """
+    Get the process-wide Html2Image renderer, screenshots are written to its own temp directory.
+    """
+    from html2image import Html2Image
+
+    hti = Html2Image(
+        disable_logging=True,
+        output_path=tempfile.mkdtemp(prefix="pptagent-html-"),
+        custom_flags=["--no-sandbox", "--headless", "--disable-gpu"],
+    )
+    hti.browser.use_new_headless = None
+    return hti
+
+
 def get_html_table_image(html: str, output_path: str, css: str = None):
     """
     Convert a html table to the image
@@ -340,145 +462,227 @@ def get_html_table_image(html: str, output_path: str, css: str = None):
     """
     if css is None:
         css = TABLE_CSS
-    parent_dir, base_name = os.path.split(output_path)
+    parent_dir = os.path.dirname(output_path)
 
     if parent_dir and not os.path.exists(parent_dir):
         os.makedirs(parent_dir)
 
-    hti = Html2Image(
-        disable_logging=True,
-        output_path=parent_dir if parent_dir else ".",
-        custom_flags=["--no-sandbox", "--headless", "--disable-gpu"],
-    )
-    hti.browser.use_new_headless = None
-    hti.screenshot(
-        html_str=html,
-        css_str=css,
-        save_as=base_name,
-        size=(1000, 600),
-    )
-    manual_scan_crop(output_path)
+    hti = get_html_renderer()
+    # unique names, as tables may be rendered concurrently
+    screenshot_name = f"{uuid.uuid4().hex}.png"
+    screenshot = join(hti.output_path, screenshot_name)
+    try:
+        hti.screenshot(
+            html_str=html,
+            css_str=css,
+            save_as=screenshot_name,
+            size=(1000, 600),
+        )
+        with PILImage.open(screenshot) as img:
+            crop_whitespace(img).save(output_path)
+    finally:
+        if exists(screenshot):
+            os.remove(screenshot)
 
 
 @tenacity_decorator
 def ppt_to_images(file: str, output_dir: str):
+    from pptagent.soffice import convert_to_pdf, rasterize_pdf
+
     assert exists(file), f"File {file} does not exist"
     if exists(output_dir):
         logger.warning(f"ppt2images: {output_dir} already exists")
     os.makedirs(output_dir, exist_ok=True)
     with tempfile.TemporaryDirectory() as temp_dir:
-        command_list = [
-            "soffice",
-            "--headless",
-            "--convert-to",
-            "pdf",
-            file,
-            "--outdir",
-            temp_dir,
-        ]
-        process = subprocess.Popen(
-            command_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
-        out, err = process.communicate()
-        if process.returncode != 0:
-            raise RuntimeError(f"soffice failed with error: {err.decode()}")
-
-        for f in os.listdir(temp_dir):
-            if not f.endswith(".pdf"):
-                continue
-            temp_pdf = join(temp_dir, f)
-            images = convert_from_path(temp_pdf, dpi=72)
-            for i, img in enumerate(images):
-                img.save(join(output_dir, f"slide_{i + 1:04d}.jpg"))
-            return
-
-        raise RuntimeError(
-            f"No PDF file was created in the temporary directory: {file}\n"
-            f"Output: {out.decode()}\n"
-            f"Error: {err.decode()}"
-        )
+        pdf_file = convert_to_pdf(file, temp_dir)
+        rasterize_pdf(pdf_file, output_dir)
 
 
 @tenacity_decorator
 async def ppt_to_images_async(file: str, output_dir: str):
+    from pptagent.soffice import convert_to_pdf_async, rasterize_pdf
+
     assert exists(file), f"File {file} does not exist"
     if exists(output_dir):
         logger.debug(f"ppt2images: {output_dir} already exists")
     os.makedirs(output_dir, exist_ok=True)
 
     with tempfile.TemporaryDirectory() as temp_dir:
-        command_list = [
-            "soffice",
-            "--headless",
-            "--convert-to",
-            "pdf",
-            file,
-            "--outdir",
-            temp_dir,
-        ]
+        pdf_file = await convert_to_pdf_async(file, temp_dir)
+        await asyncio.to_thread(rasterize_pdf, pdf_file, output_dir)
 
-        process = await asyncio.create_subprocess_exec(
-            *command_list,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-        stdout, stderr = await process.communicate()
-        if process.returncode != 0:
-            raise RuntimeError(f"soffice failed with error: {stderr.decode()}")
-        for f in os.listdir(temp_dir):
-            if not f.endswith(".pdf"):
-                continue
-            temp_pdf = join(temp_dir, f)
-            images = convert_from_path(temp_pdf, dpi=72)
-            for i, img in enumerate(images):
-                img.save(join(output_dir, f"slide_{i + 1:04d}.jpg"))
-            return
-
-        raise RuntimeError(
-            f"No PDF file was created in the temporary directory: {file}\n"
-            f"Output: {stdout.decode()}\n"
-            f"Error: {stderr.decode()}"
-        )
+
+# Image formats converted to png while parsing, vector images by LibreOffice and the others by PIL
+VECTOR_IMAGE_EXTENSIONS: set[str] = {"wmf", "emf"}
+PIL_CONVERTED_EXTENSIONS: set[str] = {"webp", "tiff"}
+IMAGE_CONVERT_WORKERS = int(os.environ.get("IMAGE_CONVERT_WORKERS", 4))
+
+
+class ImageConversionBatch:
+    """
+    Image files collected while parsing a presentation and written at once: vector images are
+    converted in one LibreOffice call, the others are converted or written in a thread pool,
+    each target file once.
+    """
+
+    def __init__(self):
+        self.pending: dict[str, Image] = {}
+        # the slides (by real index) using each pending image
+        self.owners: dict[str, set[int]] = {}
+        self.current_slide: int | None = None
+
+    def add(self, image: Image, image_path: str) -> None:
+        """
+        Schedule writing an image, duplicates and existing files are skipped.
+
+        Args:
+            image (Image): The image of a shape.
+            image_path (str): The file to write, a png file for images to convert.
+        """
+        if image_path not in self.pending:
+            if exists(image_path):
+                return
+            self.pending[image_path] = image
+            self.owners[image_path] = set()
+        if self.current_slide is not None:
+            self.owners[image_path].add(self.current_slide)
+
+    def merge(self, other: "ImageConversionBatch") -> None:
+        """
+        Add the pending images of another batch, e.g. collected by a worker process.
+        """
+        for image_path, image in other.pending.items():
+            if image_path not in self.pending:
+                self.pending[image_path] = image
+                self.owners[image_path] = set()
+            self.owners[image_path] |= other.owners[image_path]
+
+    def run(self) -> dict[str, Exception]:
+        """
+        Write the pending images.
+
+        Returns:
+            dict[str, Exception]: The error of each image which failed to be written.
+        """
+        from pptagent.soffice import convert_to_png
+
+        pending, self.pending = self.pending, {}
+        failed = {}
+        vector_images = {
+            path: image
+            for path, image in pending.items()
+            if image.ext in VECTOR_IMAGE_EXTENSIONS
+        }
+        if vector_images:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                files = []
+                for path, image in vector_images.items():
+                    files.append(join(temp_dir, f"{_stem(path)}.{image.ext}"))
+                    with open(files[-1], "wb") as f:
+                        f.write(image.blob)
+                convert_to_png(files, temp_dir)
+                for path in vector_images:
+                    output = join(temp_dir, f"{_stem(path)}.png")
+                    if exists(output):
+                        shutil.move(output, path)
+
+        def convert(path: str):
+            image = pending[path]
+            try:
+                if image.ext in VECTOR_IMAGE_EXTENSIONS:
+                    if not exists(path):
+                        # retried one by one, as a batch may fail because of a single image
+                        wmf_to_images(image.blob, path, image.ext)
+                elif image.ext in PIL_CONVERTED_EXTENSIONS:
+                    PILImage.open(io.BytesIO(image.blob)).save(path, "PNG")
+                else:
+                    with open(path, "wb") as f:
+                        f.write(image.blob)
+            except Exception as e:
+                logger.warning("Failed to convert image %s: %s", path, e)
+                failed[path] = e
+
+        with ThreadPoolExecutor(IMAGE_CONVERT_WORKERS) as executor:
+            list(executor.map(convert, pending))
+        return failed
+
+
+def _stem(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+_image_batch: ContextVar[ImageConversionBatch | None] = ContextVar(
+    "pptagent_image_batch", default=None
+)
+
+
+@contextmanager
+def deferred_image_conversion() -> Generator[ImageConversionBatch, None, None]:
+    """
+    Defer the image writes and conversions of `parsing_image` to a batch, which the caller runs.
+
+    Yields:
+        ImageConversionBatch: The batch.
+    """
+    batch = ImageConversionBatch()
+    token = _image_batch.set(batch)
+    try:
+        yield batch
+    finally:
+        _image_batch.reset(token)
 
 
 def parsing_image(image: Image, image_path: str) -> str:
-    # Handle WMF images (PDFs)
-    if image.ext == "wmf":
-        image_path = image_path.replace(".wmf", ".png")
-        if not exists(image_path):
-            wmf_to_images(image.blob, image_path)
-    # Check for supported image types
-    elif image.ext in ["webp", "tiff"]:
-        image_path = image_path.replace(".webp", ".png").replace(".tiff", ".png")
-        pil_image = PILImage.open(io.BytesIO(image.blob))
-        if not exists(image_path):
-            pil_image.save(image_path, "PNG")
+    """
+    Save the image of a shape, images in formats unsupported by the models are converted to png.
+    Writing is deferred to the active `deferred_image_conversion` batch if any.
+
+    Args:
+        image (Image): The image of a shape.
+        image_path (str): The file to save the image to.
+
+    Returns:
+        str: The path of the saved image.
+    """
+    if image.ext in VECTOR_IMAGE_EXTENSIONS | PIL_CONVERTED_EXTENSIONS:
+        image_path = os.path.splitext(image_path)[0] + ".png"
+        batch = _image_batch.get()
+        if batch is not None:
+            batch.add(image, image_path)
+        elif not exists(image_path):
+            batch = ImageConversionBatch()
+            batch.add(image, image_path)
+            for error in batch.run().values():
+                raise error
         return image_path
     elif image.ext not in IMAGE_EXTENSIONS:
         raise ValueError(f"Unsupported image type {image.ext}")
 
     # Save image if it doesn't exist
-    if not exists(image_path):
+    batch = _image_batch.get()
+    if batch is not None:
+        batch.add(image, image_path)
+    elif not exists(image_path):
         with open(image_path, "wb") as f:
             f.write(image.blob)
     return image_path
 
 
 @tenacity_decorator
-def wmf_to_images(blob: bytes, filepath: str):
+def wmf_to_images(blob: bytes, filepath: str, ext: str = "wmf"):
     if not filepath.endswith(".png"):
         raise ValueError("filepath must end with .png")
     dirname = os.path.dirname(filepath)
     base_name = os.path.basename(filepath).removesuffix(".png")
     with tempfile.TemporaryDirectory() as temp_dir:
-        with open(join(temp_dir, f"{base_name}.wmf"), "wb") as f:
+        with open(join(temp_dir, f"{base_name}.{ext}"), "wb") as f:
             f.write(blob)
         command_list = [
             "soffice",
             "--headless",
             "--convert-to",
             "png",
-            join(temp_dir, f"{base_name}.wmf"),
+            join(temp_dir, f"{base_name}.{ext}"),
             "--outdir",
             dirname,
         ]
@@ -596,6 +800,121 @@ def package_join(*paths: str) -> str:
     return join(_dir, *paths)
 
 
+def atomic_write(file_path: str, data: bytes | str) -> None:
+    """
+    Write a file atomically, so concurrent readers never see a partial file.
+
+    Args:
+        file_path (str): The path of the file.
+        data (bytes | str): The content to write, strings are encoded as utf-8.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, file_path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def file_digest(file_path: str) -> str:
+    """
+    Get the sha256 digest of a file's content.
+
+    Args:
+        file_path (str): The path of the file.
+
+    Returns:
+        str: The hex digest.
+    """
+    with open(file_path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+# The directory of the compiled prompt templates shared across processes, defaults to the temp dir
+JINJA_CACHE_DIR = os.environ.get("PPTAGENT_JINJA_CACHE_DIR")
+# The per-user cache of read-only templates, e.g. those installed with the package, and of captions,
+# cached presentations are unpickled so it must only be writable by trusted users
+TEMPLATE_CACHE_DIR = os.environ.get(
+    "PPTAGENT_TEMPLATE_CACHE_DIR", join(expanduser("~"), ".cache", "pptagent")
+)
+
+
+@cache
+def load_prompt(path: str) -> str:
+    """
+    Load a prompt file of the package, read once per process.
+
+    Args:
+        path (str): The path relative to `pptagent/prompts`, e.g. `document/heading_extract.txt`.
+
+    Returns:
+        str: The prompt.
+    """
+    with open(package_join("prompts", path), encoding="utf-8") as f:
+        return f.read()
+
+
+@cache
+def load_role_config(name: str) -> dict[str, Any]:
+    """
+    Load the configuration of an agent role, read once per process and shared, do not modify it.
+
+    Args:
+        name (str): The name of the role, e.g. `planner`.
+
+    Returns:
+        dict[str, Any]: The configuration in `pptagent/roles/<name>.yaml`.
+    """
+    with open(package_join("roles", f"{name}.yaml"), encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    assert isinstance(config, dict), "Agent config must be a dict"
+    return config
+
+
+def _load_template_source(name: str) -> str:
+    if name.startswith("roles/"):
+        return load_role_config(name.removeprefix("roles/"))["template"]
+    return load_prompt(name)
+
+
+@cache
+def get_jinja_env() -> Environment:
+    """
+    Get the Jinja environment shared by the prompts and the agent roles, templates are
+    compiled once per process and their bytecode is cached on disk for other processes.
+
+    Templates are named by their prompt path, e.g. `ppteval/ppteval_style.txt`,
+    or `roles/<name>` for the template of a role.
+
+    Returns:
+        Environment: The environment.
+    """
+    return Environment(
+        loader=FunctionLoader(_load_template_source),
+        undefined=StrictUndefined,
+        bytecode_cache=FileSystemBytecodeCache(JINJA_CACHE_DIR),
+        auto_reload=False,
+        cache_size=-1,
+    )
+
+
+def get_prompt_template(name: str) -> Template:
+    """
+    Get a compiled template of the shared Jinja environment.
+
+    Args:
+        name (str): The template name, see `get_jinja_env`.
+
+    Returns:
+        Template: The template.
+    """
+    return get_jinja_env().get_template(name)
+
+
 class Config:
     """
     Configuration class for the application.
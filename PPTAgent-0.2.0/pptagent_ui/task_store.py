@@ -0,0 +1,220 @@
+import json
+import os
+import sqlite3
+import time
+from collections.abc import Generator
+from contextlib import contextmanager
+from typing import Any
+
+from pptagent.utils import package_join
+
+TASK_DB = os.environ.get("PPTAGENT_TASK_DB", package_join("runs", "tasks.db"))
+# Seconds without heartbeat after which a running task is considered abandoned by its worker
+TASK_LEASE = 120
+# Claims of a task after which it is failed instead of being claimed again, e.g. as it kills its workers
+TASK_MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, created_at);
+CREATE TABLE IF NOT EXISTS events (
+    event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_id TEXT NOT NULL,
+    progress INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_task ON events (task_id, event_id);
+"""
+
+
+class TaskStore:
+    """
+    Durable task queue and progress log shared by the web servers and the workers, backed by SQLite in WAL mode.
+
+    Tasks are `queued`, `running`, `done` or `failed`. Workers claim queued tasks, and running tasks whose
+    worker stopped sending heartbeats are claimed again, up to `max_attempts` claims in total. Progress
+    events are appended to a log that websocket handlers follow, so a client connecting late still
+    receives every event.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        lease: float = TASK_LEASE,
+        max_attempts: int = TASK_MAX_ATTEMPTS,
+    ):
+        """
+        Initialize the TaskStore.
+
+        Args:
+            db_path (str): The SQLite database file.
+            lease (float): Seconds without heartbeat after which a running task is claimed again.
+            max_attempts (int): Claims of a task after which an abandoned task is failed.
+        """
+        self.db_path = db_path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Generator[sqlite3.Connection, None, None]:
+        # a connection per operation, as connections cannot be shared across threads
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def create_task(self, task_id: str, payload: dict[str, Any]) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO tasks (task_id, payload, status, created_at) VALUES (?, ?, 'queued', ?)",
+                (task_id, json.dumps(payload, ensure_ascii=False), time.time()),
+            )
+
+    def get_task(self, task_id: str) -> dict[str, Any] | None:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        task = dict(row)
+        task["payload"] = json.loads(task["payload"])
+        return task
+
+    def claim_task(self, worker: str) -> tuple[str, dict[str, Any]] | None:
+        """
+        Claim the oldest queued task, or a running task abandoned by its worker. Abandoned tasks
+        claimed `max_attempts` times already are failed instead.
+
+        Args:
+            worker (str): The id of the worker.
+
+        Returns:
+            tuple[str, dict[str, Any]] | None: The task id and payload, None if there is no task.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            exhausted = conn.execute(
+                "SELECT task_id, attempts FROM tasks "
+                "WHERE status = 'running' AND heartbeat < ? AND attempts >= ?",
+                (now - self.lease, self.max_attempts),
+            ).fetchall()
+            for task in exhausted:
+                conn.execute(
+                    "UPDATE tasks SET status = 'failed', heartbeat = ? WHERE task_id = ?",
+                    (now, task["task_id"]),
+                )
+                conn.execute(
+                    "INSERT INTO events (task_id, progress, status, created_at) VALUES (?, ?, ?, ?)",
+                    (
+                        task["task_id"],
+                        100,
+                        f"Task abandoned by its worker {task['attempts']} times, giving up",
+                        now,
+                    ),
+                )
+            row = conn.execute(
+                "SELECT task_id, payload FROM tasks WHERE status = 'queued' "
+                "OR (status = 'running' AND heartbeat < ?) ORDER BY created_at LIMIT 1",
+                (now - self.lease,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE tasks SET status = 'running', worker = ?, heartbeat = ?, "
+                "attempts = attempts + 1 WHERE task_id = ?",
+                (worker, now, row["task_id"]),
+            )
+            conn.execute("COMMIT")
+        return row["task_id"], json.loads(row["payload"])
+
+    def heartbeat(self, task_id: str, worker: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE tasks SET heartbeat = ? WHERE task_id = ? AND worker = ?",
+                (time.time(), task_id, worker),
+            )
+
+    def finish_task(self, task_id: str, worker: str, status: str) -> bool:
+        """
+        Mark a task as `done` or `failed`, unless it was claimed by another worker since.
+
+        Args:
+            task_id (str): The task id.
+            worker (str): The id of the worker that ran the task.
+            status (str): `done` or `failed`.
+
+        Returns:
+            bool: Whether the task was still owned by the worker and is marked.
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET status = ?, heartbeat = ? "
+                "WHERE task_id = ? AND worker = ? AND status = 'running'",
+                (status, time.time(), task_id, worker),
+            )
+        return cursor.rowcount > 0
+
+    def requeue_task(self, task_id: str) -> None:
+        """
+        Queue a finished or failed task again, e.g. to rerun it, its progress events are cleared.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE tasks SET status = 'queued', worker = NULL, attempts = 0 WHERE task_id = ?",
+                (task_id,),
+            )
+            conn.execute("DELETE FROM events WHERE task_id = ?", (task_id,))
+            conn.execute("COMMIT")
+
+    def publish(self, task_id: str, progress: int, status: str) -> None:
+        """
+        Append a progress event of a task.
+
+        Args:
+            task_id (str): The task id.
+            progress (int): The progress in percent, 100 ends the task.
+            status (str): The status message.
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO events (task_id, progress, status, created_at) VALUES (?, ?, ?, ?)",
+                (task_id, progress, status, time.time()),
+            )
+
+    def events_since(self, task_id: str, event_id: int = 0) -> list[dict[str, Any]]:
+        """
+        Get the progress events of a task published after an event.
+
+        Args:
+            task_id (str): The task id.
+            event_id (int): The id of the last event received, 0 for all events.
+
+        Returns:
+            list[dict[str, Any]]: The events with `event_id`, `progress` and `status`, in order.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT event_id, progress, status FROM events "
+                "WHERE task_id = ? AND event_id > ? ORDER BY event_id",
+                (task_id, event_id),
+            ).fetchall()
+        return [dict(row) for row in rows]
@@ -0,0 +1,277 @@
+"""
+Generation worker of the PPTAgent UI, it claims queued tasks from the task store and
+publishes their progress to it. Run as many workers as needed, on any host sharing the runs directory:
+
+    python pptagent_ui/worker.py [--concurrency N]
+
+Like backend.py, it is run as a script, not as a module, so that its sibling `task_store` is
+importable from the script directory whatever the working directory is.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import traceback
+import uuid
+from os.path import join
+
+from task_store import TASK_DB, TaskStore
+
+from pptagent.document import Document
+from pptagent.induct import SlideInducter
+from pptagent.model_utils import (
+    ModelManager,
+    close_http_session,
+    parse_pdf,
+    warmup_language_id,
+)
+from pptagent.multimodal import ImageLabler
+from pptagent.pptgen import PPTAgent
+from pptagent.template_cache import get_template_cache
+from pptagent.utils import Config, get_logger, package_join, ppt_to_images_async
+
+RUNS_DIR = package_join("runs")
+STAGES = [
+    "PPT Parsing",
+    "PDF Parsing",
+    "PPT Analysis",
+    "PPT Generation",
+    "Success!",
+]
+WORKER_CONCURRENCY = int(os.environ.get("PPTAGENT_WORKER_CONCURRENCY", 2))
+POLL_INTERVAL = 1.0
+
+logger = get_logger(__name__)
+models = ModelManager()
+
+
+class ProgressManager:
+    def __init__(self, task_id: str, stages: list[str], store: TaskStore):
+        self.task_id = task_id
+        self.stages = stages
+        self.store = store
+        self.failed = False
+        self.current_stage = 0
+        self.total_stages = len(stages)
+
+    async def publish(self, status: str, progress: int):
+        await asyncio.to_thread(self.store.publish, self.task_id, progress, status)
+
+    async def report_progress(self):
+        self.current_stage += 1
+        progress = int((self.current_stage / self.total_stages) * 100)
+        await self.publish(f"Stage: {self.stages[self.current_stage - 1]}", progress)
+
+    async def fail_stage(self, error_message: str):
+        await self.publish(
+            f"{self.stages[self.current_stage]} Error: {error_message}", 100
+        )
+        self.failed = True
+        logger.error(
+            f"{self.task_id}: {self.stages[self.current_stage]} Error: {error_message}"
+        )
+
+
+async def ppt_gen(task_id: str, task: dict, store: TaskStore) -> bool:
+    pptx_md5 = task["pptx"]
+    pdf_md5 = task["pdf"]
+    generation_config = Config(join(RUNS_DIR, task_id))
+    template_cache = get_template_cache(join(RUNS_DIR, "pptx", pptx_md5))
+    pptx_config = template_cache.config
+    progress = ProgressManager(task_id, STAGES, store)
+    parsedpdf_dir = join(RUNS_DIR, "pdf", pdf_md5)
+    ppt_image_folder = template_cache.slide_image_dir
+
+    await progress.publish("task initialized successfully", 10)
+
+    try:
+        # ppt parsing, blocking work runs in threads so that heartbeats keep being sent
+        presentation = await asyncio.to_thread(template_cache.load_presentation)
+        if not os.path.exists(ppt_image_folder) or len(
+            os.listdir(ppt_image_folder)
+        ) != len(presentation):
+            await ppt_to_images_async(
+                join(pptx_config.RUN_DIR, "source.pptx"), ppt_image_folder
+            )
+            assert len(os.listdir(ppt_image_folder)) == len(presentation) + len(
+                presentation.error_history
+            ), "Number of parsed slides and images do not match"
+
+            for err_idx, _ in presentation.error_history:
+                os.remove(join(ppt_image_folder, f"slide_{err_idx:04d}.jpg"))
+            for i, slide in enumerate(presentation.slides, 1):
+                slide.slide_idx = i
+                os.rename(
+                    join(ppt_image_folder, f"slide_{slide.real_idx:04d}.jpg"),
+                    join(ppt_image_folder, f"slide_{slide.slide_idx:04d}.jpg"),
+                )
+
+        labler = ImageLabler(presentation, pptx_config)
+        image_stats = template_cache.load_json("image_stats.json")
+        if image_stats is not None:
+            labler.apply_stats(image_stats)
+        else:
+            await labler.caption_images_async(models.vision_model)
+            template_cache.dump_json("image_stats.json", labler.image_stats)
+        await progress.report_progress()
+
+        # pdf parsing
+        if not os.path.exists(join(parsedpdf_dir, "source.md")):
+            text_content = await parse_pdf(
+                join(RUNS_DIR, "pdf", pdf_md5, "source.pdf"),
+                parsedpdf_dir,
+            )
+            logger.info(f"{task_id}: pdf parsing finished")
+        else:
+            text_content = open(
+                join(parsedpdf_dir, "source.md"), encoding="utf-8"
+            ).read()
+        await progress.report_progress()
+
+        # document refine
+        if not os.path.exists(join(parsedpdf_dir, "refined_doc.json")):
+            source_doc = await Document.from_markdown(
+                text_content,
+                models.language_model,
+                models.vision_model,
+                parsedpdf_dir,
+            )
+            json.dump(
+                source_doc.model_dump(),
+                open(join(parsedpdf_dir, "refined_doc.json"), "w"),
+                ensure_ascii=False,
+                indent=4,
+            )
+        else:
+            source_doc = json.load(
+                open(join(parsedpdf_dir, "refined_doc.json"), encoding="utf-8")
+            )
+            source_doc = Document.model_validate(source_doc)
+        await progress.report_progress()
+
+        # Slide Induction
+        slide_induction = template_cache.load_json("slide_induction.json")
+        if slide_induction is None:
+            layout_presentation = await asyncio.to_thread(
+                template_cache.load_presentation
+            )
+            await asyncio.to_thread(
+                layout_presentation.save,
+                join(pptx_config.RUN_DIR, "template.pptx"),
+                layout_only=True,
+            )
+            await ppt_to_images_async(
+                join(pptx_config.RUN_DIR, "template.pptx"),
+                join(pptx_config.RUN_DIR, "template_images"),
+            )
+            slide_inducter = SlideInducter(
+                presentation,
+                ppt_image_folder,
+                join(pptx_config.RUN_DIR, "template_images"),
+                pptx_config,
+                models.image_model,
+                models.language_model,
+                models.vision_model,
+            )
+            layout_induction = await slide_inducter.layout_induct()
+            slide_induction = await slide_inducter.content_induct(layout_induction)
+            template_cache.dump_json("slide_induction.json", slide_induction)
+        await progress.report_progress()
+
+        # PPT Generation with PPTAgent
+        ppt_agent = PPTAgent(
+            models.language_model,
+            models.vision_model,
+            error_exit=False,
+            retry_times=5,
+        )
+        ppt_agent.set_reference(
+            slide_induction=slide_induction,
+            presentation=presentation,
+        )
+
+        prs, _ = await ppt_agent.generate_pres(
+            source_doc=source_doc,
+            num_slides=task["numberOfPages"],
+            checkpoint_dir=join(generation_config.RUN_DIR, "slides"),
+        )
+        await asyncio.to_thread(prs.save, join(generation_config.RUN_DIR, "final.pptx"))
+        logger.info(f"{task_id}: generation finished")
+        await progress.report_progress()
+        return True
+    except Exception as e:
+        await progress.fail_stage(str(e))
+        traceback.print_exc()
+        return False
+
+
+async def run_task(task_id: str, task: dict, store: TaskStore, worker: str):
+    """
+    Run a claimed task, sending heartbeats so that it is claimed again if this worker dies.
+    """
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(store.lease / 4)
+            await asyncio.to_thread(store.heartbeat, task_id, worker)
+
+    heartbeat_task = asyncio.create_task(heartbeat())
+    try:
+        succeeded = await ppt_gen(task_id, task, store)
+    finally:
+        heartbeat_task.cancel()
+    finished = await asyncio.to_thread(
+        store.finish_task, task_id, worker, "done" if succeeded else "failed"
+    )
+    if not finished:
+        logger.warning(
+            "worker %s lost task %s to another worker, its result is discarded",
+            worker,
+            task_id,
+        )
+
+
+async def run_worker(store: TaskStore, concurrency: int = WORKER_CONCURRENCY):
+    """
+    Claim and run tasks forever, running at most `concurrency` tasks at once.
+    """
+    worker = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    assert await models.test_connections(), "Model connection test failed"
+    logger.info("worker %s started", worker)
+    running: set[asyncio.Task] = set()
+    try:
+        while True:
+            running = {t for t in running if not t.done()}
+            if len(running) >= concurrency:
+                await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            claimed = await asyncio.to_thread(store.claim_task, worker)
+            if claimed is None:
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+            task_id, task = claimed
+            logger.info("worker %s claimed task %s", worker, task_id)
+            running.add(asyncio.create_task(run_task(task_id, task, store, worker)))
+    finally:
+        await close_http_session()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PPTAgent UI generation worker")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY)
+    parser.add_argument(
+        "--rerun", help="queue a task again instead of running the worker"
+    )
+    args = parser.parse_args()
+    store = TaskStore(TASK_DB)
+    if args.rerun is not None:
+        store.requeue_task(args.rerun.replace("|", "/"))
+        return
+    warmup_language_id()
+    asyncio.run(run_worker(store, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
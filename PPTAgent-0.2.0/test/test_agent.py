@@ -0,0 +1,28 @@
+import os
+
+from pptagent.agent import Agent, Turn
+from pptagent.llms import AsyncLLM
+from pptagent.utils import get_prompt_template, load_prompt, package_join
+
+
+def test_role_registry():
+    llm = AsyncLLM("test", "http://localhost/v1", "key")
+    llm_mapping = {"language": llm, "vision": llm}
+    for role in os.listdir(package_join("roles")):
+        name = role.removesuffix(".yaml")
+        agent = Agent(name, llm_mapping)
+        other = Agent(name, llm_mapping)
+        assert agent.config is other.config
+        assert agent.template is other.template
+    assert get_prompt_template("category_split.txt") is get_prompt_template(
+        "category_split.txt"
+    )
+    assert "{{" not in get_prompt_template("category_split.txt").render(slides="")
+    assert load_prompt("caption.txt") is load_prompt("caption.txt")
+
+    agent._history.append(Turn(id=0, prompt="", response="", message=[]))
+    agent.input_tokens = 10
+    clone = agent.clone()
+    assert clone.template is agent.template and clone.llm is agent.llm
+    assert clone.history == [] and clone.input_tokens == 0
+    assert len(agent.history) == 1
@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import test_utils, web
+
+from pptagent import llms
+from pptagent.batch import BatchCollector, run_local_batch
+from pptagent.llms import AsyncLLM
+
+
+def completion_body(content: str) -> dict:
+    return {
+        "id": "chatcmpl",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "test",
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }
+        ],
+    }
+
+
+async def test_batch_collector():
+    batches = []
+
+    async def runner(requests: list[dict]) -> dict[str, dict]:
+        batches.append(len(requests))
+        await asyncio.sleep(0.01)
+        results = {}
+        for request in requests:
+            prompt = request["body"]["messages"][-1]["content"]
+            if prompt == "fail":
+                results[request["custom_id"]] = {
+                    "custom_id": request["custom_id"],
+                    "error": {"message": "invalid request"},
+                }
+            else:
+                results[request["custom_id"]] = {
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "body": completion_body(prompt)},
+                }
+        return results
+
+    collector = BatchCollector(runner, max_batch_size=3, max_wait=0.05)
+    prompts = [f"prompt {i}" for i in range(5)] + ["fail"]
+    completions = await asyncio.gather(
+        *[
+            collector.submit({"model": "test", "messages": [{"content": p}]})
+            for p in prompts
+        ],
+        return_exceptions=True,
+    )
+    assert batches == [3, 3]
+    for prompt, completion in zip(prompts[:-1], completions):
+        assert completion.choices[0].message.content == prompt
+    assert isinstance(completions[-1], RuntimeError)
+
+    # a partial batch is flushed after max_wait
+    start = time.perf_counter()
+    await collector.submit({"model": "test", "messages": [{"content": "last"}]})
+    assert batches[-1] == 1
+    assert time.perf_counter() - start >= 0.05
+
+
+async def test_async_llm_batch(monkeypatch: pytest.MonkeyPatch):
+    batch_sizes = []
+
+    async def chat_completions(request: web.Request):
+        body = await request.json()
+        return web.json_response(
+            completion_body(body["messages"][-1]["content"][0]["text"])
+        )
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    async with test_utils.TestServer(app) as server:
+        llm = AsyncLLM("test", str(server.make_url("/v1")), "key", use_batch=True)
+
+        async def runner(requests: list[dict]) -> dict[str, dict]:
+            batch_sizes.append(len(requests))
+            return await run_local_batch(llm.client, requests)
+
+        collector = BatchCollector(runner, max_batch_size=4, max_wait=0.05)
+        monkeypatch.setattr(llms, "get_batch_collector", lambda client: collector)
+        prompts = [f"prompt {i}" for i in range(6)]
+        responses = await asyncio.gather(*[llm(p) for p in prompts])
+    assert responses == prompts
+    assert batch_sizes == [4, 2]
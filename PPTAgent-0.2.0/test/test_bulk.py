@@ -0,0 +1,48 @@
+import json
+import os
+import tempfile
+from os.path import join
+
+from pptagent.bulk import BulkJob, BulkRunner, load_manifest
+from pptagent.utils import package_join
+from test.conftest import test_config
+
+
+def test_load_manifest():
+    manifest_dir = tempfile.mkdtemp()
+    with open(join(manifest_dir, "paper.md"), "w", encoding="utf-8") as f:
+        f.write("# Paper\ncontent")
+    template = package_join("templates", "default", "source.pptx")
+    with open(join(manifest_dir, "manifest.jsonl"), "w", encoding="utf-8") as f:
+        for pages in [8, 12]:
+            f.write(
+                json.dumps(
+                    {"template": template, "document": "paper.md", "pages": pages}
+                )
+                + "\n"
+            )
+    jobs = load_manifest(join(manifest_dir, "manifest.jsonl"))
+    assert jobs[0].document == join(manifest_dir, "paper.md")
+    assert jobs[0].job_id.startswith("paper-")
+    assert jobs[0].job_id != jobs[1].job_id
+    assert (
+        jobs[0].job_id == load_manifest(join(manifest_dir, "manifest.jsonl"))[0].job_id
+    )
+
+
+async def test_bulk_runner_resume():
+    output_dir = tempfile.mkdtemp()
+    runner = BulkRunner(output_dir, test_config.models, max_jobs=2)
+    finished = BulkJob("template.pptx", "finished.pdf", 8, job_id="finished")
+    os.makedirs(runner.job_dir(finished))
+    open(join(runner.job_dir(finished), "final.pptx"), "wb").close()
+    missing = BulkJob("missing.pptx", "missing.pdf", 8, job_id="missing")
+
+    summary = await runner.run([finished, missing])
+    assert summary["skipped"] == 1
+    assert summary["failed"] == 1
+    assert summary["decks_per_hour"] == 0
+    with open(join(runner.job_dir(missing), "status.json"), encoding="utf-8") as f:
+        status = json.load(f)
+    assert status["stage"] == "template"
+    assert status["error"] is not None
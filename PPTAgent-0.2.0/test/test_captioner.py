@@ -0,0 +1,69 @@
+import asyncio
+import tempfile
+from os.path import join
+
+import pytest
+
+from pptagent.captioner import CaptionService
+
+
+async def test_caption_service():
+    store_path = join(tempfile.mkdtemp(), "captions.jsonl")
+    service = CaptionService(store_path, max_concurrency=2)
+    # shares the store, like another process
+    other_service = CaptionService(store_path)
+    calls = []
+
+    async def generate():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        return "a chart"
+
+    key = CaptionService.text_key("document_table", "gpt", "| a | b |")
+    captions = await asyncio.gather(*[service.caption(key, generate) for _ in range(5)])
+    assert captions == ["a chart"] * 5
+    assert len(calls) == 1
+
+    # captions persist across services, and are appended to the store once
+    assert await CaptionService(store_path).caption(key, generate) == "a chart"
+    assert await other_service.caption(key, generate) == "a chart"
+    assert len(calls) == 1
+    new_key = CaptionService.text_key("document_table", "gpt", "| b |")
+    assert await other_service.caption(new_key, generate) == "a chart"
+    assert service.get(new_key) is None
+    assert await service.caption(new_key, generate) == "a chart"
+    assert len(calls) == 2
+    with open(store_path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 2
+
+    async def fail():
+        raise ValueError("model error")
+
+    other_key = CaptionService.text_key("document_table", "gpt", "| c |")
+    with pytest.raises(ValueError):
+        await asyncio.gather(*[service.caption(other_key, fail) for _ in range(3)])
+    assert service.get(other_key) is None
+
+
+async def test_caption_service_cancel():
+    service = CaptionService(None)
+    started = asyncio.Event()
+
+    async def hang():
+        started.set()
+        await asyncio.sleep(10)
+
+    async def generate():
+        return "a chart"
+
+    key = CaptionService.text_key("document_table", "gpt", "| a |")
+    owner = asyncio.create_task(service.caption(key, hang))
+    await started.wait()
+    waiter = asyncio.create_task(service.caption(key, generate))
+    await asyncio.sleep(0)
+    owner.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await owner
+    # the waiting request generates the caption itself
+    assert await waiter == "a chart"
+    assert service.get(key) == "a chart"
@@ -1,6 +1,16 @@
 import pytest
 
-from pptagent.document import Document
+from pptagent.document import Document, Section, SubSection
+from pptagent.document.doc_utils import (
+    calculate_hierarchical_counts,
+    count_markdown_chunks,
+    get_tree_structure,
+    process_markdown_content,
+    split_large_chunks,
+    split_markdown_by_headings,
+)
+from pptagent.document.element import SubSectionIndex, link_medias
+from pptagent.utils import edit_distance
 from test.conftest import test_config
 
 
@@ -23,3 +33,75 @@ def test_document_from_dict():
     document = Document(**test_config.get_document_json())
     document.get_overview(include_summary=True)
     document.metainfo
+
+
+def test_hierarchical_counts():
+    markdown = "# A\naa\n## B\nbbb\n### C\nc\n## D\ndddd\n# E\ne"
+    chunks = calculate_hierarchical_counts(count_markdown_chunks(markdown))
+    assert [c["total_char_count"] for c in chunks] == [10, 4, 1, 4, 1]
+    assert get_tree_structure(markdown, add_tag=False).splitlines()[1] == (
+        "  ├─ B [Direct:3 | Total Characters:4]"
+    )
+
+
+def test_media_context():
+    paragraphs = [" ".join([f"paragraph {i}"] * 4) for i in range(6)]
+    markdown = "\n\n".join(paragraphs[:3] + ["![fig](fig.png)"] + paragraphs[3:])
+    cleaned, medias = process_markdown_content(markdown, max_chunk_size=64)
+    assert cleaned == "\n\n".join(paragraphs)
+    pre_chunk, after_chunk = medias[0]["near_chunks"]
+    assert pre_chunk == "".join(p + "\n\n" for p in paragraphs[:2])
+    assert after_chunk == "".join(p + "\n\n" for p in paragraphs[4:6])
+
+
+async def test_split_markdown_by_headings():
+    sections = ["# A\n" + "a" * 600, "# B\nb", "# C\n" + "c" * 600]
+    markdown = "\n".join(sections)
+    assert await split_markdown_by_headings(
+        markdown, ["# A", "# B", "# C"], "", None
+    ) == [
+        sections[0] + "\n\n" + sections[1],
+        sections[2],
+    ]
+
+
+def test_split_large_chunks(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr("pptagent.document.doc_utils.MAX_CHUNK_SIZE", 100)
+    parts = [f"# H{i}\n" + "x" * 40 for i in range(8)]
+    assert split_large_chunks(["\n".join(parts)]) == [
+        "\n".join(parts[i : i + 2]) for i in range(0, 8, 2)
+    ]
+    # sections without headings to split at are kept as is
+    assert split_large_chunks(["y" * 200, "# H\n" + "y" * 200]) == [
+        "y" * 200,
+        "# H\n" + "y" * 200,
+    ]
+
+
+def test_link_medias():
+    words = ["agent", "slide", "layout", "table", "image", "model", "render"]
+    contents = [
+        " ".join(words[(i * j) % 7] for j in range(60 + i * 7)) for i in range(8)
+    ]
+    contents.append(contents[3])
+    subsections = [SubSection(title=f"s{i}", content=c) for i, c in enumerate(contents)]
+    index = SubSectionIndex(subsections)
+    for i, content in enumerate(contents):
+        text = content[len(content) // 3 :] + " agent model"
+        similarities = [edit_distance(text, c) for c in contents]
+        assert (
+            index.most_similar(text)
+            is subsections[similarities.index(max(similarities))]
+        )
+    assert index.most_similar(contents[3]) is subsections[3]
+
+    section = Section(
+        title="t", summary="", content=list(subsections), markdown_content=""
+    )
+    medias = [
+        {"markdown_content": "![](a.png)", "near_chunks": [contents[5], ""]},
+        {"markdown_content": "![](b.png)", "near_chunks": ["short", ""]},
+    ]
+    link_medias(medias, section)
+    assert section.content[0].markdown_content == "![](b.png)"
+    assert section.content[7].markdown_content == "![](a.png)"
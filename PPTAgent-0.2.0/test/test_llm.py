@@ -1,7 +1,11 @@
+import time
 from copy import deepcopy
 
 import pytest
+from aiohttp import test_utils, web
 
+from pptagent.llms import AsyncLLM
+from pptagent.replay import LLMRecorder, LLMReplayer, set_llm_recorder
 from test.conftest import test_config
 
 
@@ -50,3 +54,51 @@ def test_sync_llm():
     response = sync_language_model("Hello, how are you?", max_tokens=1)
     assert response is not None, "Sync LLM returned None response"
     assert len(response) > 0, "Sync LLM returned empty response"
+
+
+async def test_record_replay(tmp_path):
+    async def chat_completions(request: web.Request):
+        body = await request.json()
+        prompt = body["messages"][-1]["content"][0]["text"]
+        return web.json_response(
+            {
+                "id": "chatcmpl",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": "test",
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": f"echo {prompt}"},
+                    }
+                ],
+            }
+        )
+
+    trace_file = str(tmp_path / "calls.jsonl")
+    prompts = ["first prompt", "second prompt", "first prompt"]
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    try:
+        async with test_utils.TestServer(app) as server:
+            llm = AsyncLLM("test", str(server.make_url("/v1")), "key")
+            set_llm_recorder(LLMRecorder(trace_file))
+            recorded = [await llm(p) for p in prompts]
+            await llm.client.close()
+
+        # the server is gone, calls are answered from the trace
+        set_llm_recorder(LLMReplayer(trace_file))
+        assert [await llm(p) for p in prompts] == recorded
+
+        replayer = LLMReplayer(trace_file, strict=True)
+        set_llm_recorder(replayer)
+        with pytest.raises(RuntimeError):
+            await replayer.complete(
+                {"model": "test", "messages": [{"role": "user", "content": "new"}]}
+            )
+        # a changed prompt is matched to the most similar recorded one
+        set_llm_recorder(LLMReplayer(trace_file))
+        assert await llm("second prompt!") == "echo second prompt"
+    finally:
+        set_llm_recorder(None)
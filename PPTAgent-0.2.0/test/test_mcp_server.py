@@ -0,0 +1,37 @@
+import json
+import shutil
+import tempfile
+from os.path import join
+
+from pptagent.llms import AsyncLLM
+from pptagent.mcp_server import MCPSession
+from pptagent.pptgen import PPTAgent
+from pptagent.template_cache import TemplateCache
+from pptagent.utils import package_join
+
+
+def test_mcp_sessions():
+    template_dir = join(tempfile.mkdtemp(), "default")
+    shutil.copytree(package_join("templates", "default"), template_dir)
+    template_cache = TemplateCache(template_dir)
+    llm = AsyncLLM("test", "http://localhost/v1", "key")
+    with open(join(template_dir, "slide_induction.json"), encoding="utf-8") as f:
+        reference = PPTAgent(llm, llm).set_reference(
+            slide_induction=json.load(f),
+            presentation=template_cache.load_presentation(),
+        )
+
+    sessions = [MCPSession(), MCPSession()]
+    for session in sessions:
+        session.set_reference("default", reference)
+    first, second = (session.agent for session in sessions)
+    assert first.presentation is second.presentation is reference.presentation
+    assert first.layouts is reference.layouts
+    assert first.staffs["coder"] is not second.staffs["coder"]
+    assert first.staffs["coder"].template is reference.staffs["coder"].template
+
+    # slides are built into a presentation of each session
+    empty_prs = sessions[0].get_empty_prs()
+    assert first.empty_prs is empty_prs
+    assert sessions[1].get_empty_prs() is not empty_prs
+    assert reference.empty_prs is not empty_prs
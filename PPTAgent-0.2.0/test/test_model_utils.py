@@ -1,9 +1,13 @@
+import io
 import tempfile
+import zipfile
 from os.path import exists, join
 
 import pytest
+from aiohttp import test_utils, web
 
-from pptagent.model_utils import parse_pdf
+from pptagent import model_utils
+from pptagent.model_utils import language_id, parse_pdf
 from test.conftest import test_config
 
 
@@ -16,3 +20,55 @@ async def test_parse_pdf():
             temp_dir,
         )
         assert exists(join(temp_dir, "source.md"))
+
+
+async def test_parse_pdf_streaming(monkeypatch):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zip_ref:
+        zip_ref.writestr("source/source.md", "# Title\n\n![](images/fig.png)\n")
+        zip_ref.writestr("source/images/fig.png", b"png")
+
+    async def mineru(request: web.Request) -> web.Response:
+        form = await request.post()
+        assert form["files"].file.read() == b"%PDF-1.4"
+        return web.Response(body=archive.getvalue(), content_type="application/zip")
+
+    app = web.Application()
+    app.router.add_post("/parse", mineru)
+    async with test_utils.TestServer(app) as server:
+        monkeypatch.setattr(model_utils, "MINERU_API", str(server.make_url("/parse")))
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with open(join(temp_dir, "source.pdf"), "wb") as f:
+                f.write(b"%PDF-1.4")
+            progress = []
+            markdown = await parse_pdf(
+                join(temp_dir, "source.pdf"),
+                join(temp_dir, "parsed"),
+                lambda *args: progress.append(args),
+            )
+            assert markdown.startswith("# Title")
+            assert exists(join(temp_dir, "parsed", "images", "fig.png"))
+            assert progress[-1] == ("extract", 2, 2)
+        await model_utils.close_http_session()
+
+
+def test_language_id(monkeypatch):
+    calls = []
+
+    class FakeLidModel:
+        def predict(self, windows: list[str]):
+            calls.append(windows)
+            labels = [("__label__zh" if "中" in w else "__label__en",) for w in windows]
+            return labels, [(0.9,)] * len(windows)
+
+    monkeypatch.setattr(model_utils, "_LID_MODEL", FakeLidModel())
+    monkeypatch.setattr(model_utils, "_LID_CACHE", {})
+    # an english front matter does not decide the language of a long chinese document
+    text = "Title\n" * 100 + "中文内容。" * 20000
+    assert language_id(text).lid == "zh"
+    assert language_id(text).lid == "zh"
+    assert len(calls) == 1
+    assert len(calls[0]) == model_utils.LID_WINDOWS
+    assert all(len(w) <= model_utils.LID_WINDOW_SIZE for w in calls[0])
+    assert language_id("short text\nin english").lid == "en"
+    assert calls[-1] == ["short text in english"]
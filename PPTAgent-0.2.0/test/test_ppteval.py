@@ -0,0 +1,92 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+from os.path import exists, join
+
+import pytest
+
+from pptagent.ppteval import EvalRunner, aggregate_scores
+from pptagent.utils import package_join
+
+
+class FakeModel:
+    def __init__(self, fail_on: str | None = None):
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+        self.fail_on = fail_on
+
+    async def __call__(self, prompt: str, images: str | None = None, **kwargs):
+        self.calls.append(images)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        if self.fail_on is not None and self.fail_on in prompt:
+            raise ValueError("model error")
+        if kwargs.get("return_json"):
+            return {"score": 4, "reason": "good"}
+        return f"description of {images}"
+
+
+async def test_eval_runner():
+    run_dir = tempfile.mkdtemp()
+    prs_file = join(run_dir, "final.pptx")
+    shutil.copyfile(package_join("templates", "default", "source.pptx"), prs_file)
+    os.makedirs(join(run_dir, "final"))
+    slide_folder = join(run_dir, "slides")
+    os.makedirs(slide_folder)
+    for i in range(1, 5):
+        open(join(slide_folder, f"slide_{i:04d}.jpg"), "wb").close()
+
+    vision_model = FakeModel()
+    runner = EvalRunner(FakeModel(fail_on="description of"), vision_model, 3)
+    with pytest.raises(ValueError):
+        await runner.evaluate(prs_file, slide_folder)
+    assert vision_model.max_running == 3
+    assert len(vision_model.calls) == 8
+    assert exists(join(slide_folder, "slide_0001.json"))
+
+    # descriptions and recorded scores are reused
+    language_model = FakeModel()
+    runner = EvalRunner(language_model, vision_model, 4)
+    assert await runner.run([prs_file], [slide_folder]) == {
+        "vision": 4,
+        "content": 4,
+        "logic": 4,
+    }
+    assert len(vision_model.calls) == 8
+    assert len(language_model.calls) == 8
+    with open(join(run_dir, "evals.json"), encoding="utf-8") as f:
+        assert len(json.load(f)["vision"]) == 4
+    assert not exists(join(run_dir, "evals.jsonl"))
+    assert aggregate_scores([prs_file])["logic"] == 4
+
+
+async def test_eval_runner_renders_slides(monkeypatch):
+    from pptagent.presentation import presentation as presentation_module
+
+    rendered = []
+
+    async def render(file: str, output_dir: str):
+        rendered.append(file)
+        open(join(output_dir, "slide_0001.jpg"), "wb").close()
+
+    monkeypatch.setattr(presentation_module, "ppt_to_images_async", render)
+    run_dir = tempfile.mkdtemp()
+    prs_file = join(run_dir, "final.pptx")
+    shutil.copyfile(package_join("templates", "default", "source.pptx"), prs_file)
+
+    vision_model = FakeModel()
+    runner = EvalRunner(FakeModel(), vision_model, 4)
+    num_slides = await runner.evaluate(prs_file, score_presentation=False)
+    assert num_slides == len(rendered) > 0
+    assert len(vision_model.calls) == 2 * num_slides
+
+    # unchanged slides are neither rendered nor described again
+    os.remove(join(run_dir, "evals.json"))
+    await runner.evaluate(prs_file, score_presentation=False)
+    assert len(rendered) == num_slides
+    assert len(vision_model.calls) == 2 * num_slides
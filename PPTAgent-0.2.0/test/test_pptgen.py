@@ -5,7 +5,7 @@ import pytest
 from pptagent.document import Document
 from pptagent.multimodal import ImageLabler
 from pptagent.pptgen import PPTAgent
-from pptagent.presentation import Presentation
+from pptagent.presentation import ImageIndex, Presentation
 from test.conftest import test_config
 
 
@@ -48,4 +48,17 @@ async def test_pptgen():
     # TODO
     result = await pptgen.generate_pres(document, 3)
     prs, history = result
-    print(f"staffs history\n: {history}\n")
\ No newline at end of file
+    print(f"staffs history\n: {history}\n")
+
+
+def test_image_index(tmp_path):
+    images = []
+    for name in ["figure_1.png", "figure_2.png", "table_1.png"]:
+        (tmp_path / name).touch()
+        images.append(str(tmp_path / name))
+    index = ImageIndex(images + [str(tmp_path / "missing.png")])
+    assert index.resolve(images[0]) == images[0]
+    assert index.resolve("images/table_1.png") == images[2]
+    assert index.resolve(images[1][:-4] + ".jpg") == images[1]
+    assert index.resolve("chart.svg") is None
+    assert index.resolve(str(tmp_path / "missing.png")) is None
@@ -1,8 +1,13 @@
+import os
 import tempfile
 from copy import deepcopy
+from os.path import join
 
-from pptagent.presentation import Presentation
-from pptagent.utils import Config
+from pptx.util import Pt
+
+import pptagent.presentation.presentation as presentation_module
+from pptagent.presentation import ClosureType, Picture, Presentation
+from pptagent.utils import Config, package_join
 from test.conftest import test_config
 
 
@@ -13,3 +18,97 @@ def test_presentation():
         sld.to_html(show_image=False)
     deepcopy(presentation)
     presentation.save("test.pptx", layout_only=True)
+
+
+def test_slide_fork():
+    presentation = Presentation.from_file(
+        package_join("templates", "default", "source.pptx"), Config(tempfile.mkdtemp())
+    )
+    slide = next(s for s in presentation.slides if any(s.iter_paragraphs()))
+    html = slide.to_html(show_image=False)
+    forked = slide.fork()
+    for shape, forked_shape in zip(slide, forked):
+        assert forked_shape.sp is shape.sp
+        forked_shape._closures[ClosureType.DELETE].append(None)
+        forked_shape.width = forked_shape.width + 10
+    for para in forked.iter_paragraphs():
+        para.text = "edited"
+    assert slide.to_html(show_image=False) == html
+    assert all(len(shape.closures) == 0 for shape in slide)
+
+
+async def test_render_slide_cache(monkeypatch):
+    rendered = []
+
+    async def render(file: str, output_dir: str):
+        rendered.append(file)
+        open(join(output_dir, "slide_0001.jpg"), "wb").close()
+
+    monkeypatch.setattr(presentation_module, "ppt_to_images_async", render)
+    presentation = Presentation.from_file(
+        package_join("templates", "default", "source.pptx"), Config(tempfile.mkdtemp())
+    )
+    loaded = []
+    load_prs = presentation_module.load_prs
+    monkeypatch.setattr(
+        presentation_module,
+        "load_prs",
+        lambda file: loaded.append(file) or load_prs(file),
+    )
+    cache_dir = tempfile.mkdtemp()
+    image = await presentation.render_slide(presentation.slides[0], cache_dir)
+    assert image == await presentation.render_slide(
+        presentation.slides[0].fork(), cache_dir
+    )
+    assert image != await presentation.render_slide(presentation.slides[1], cache_dir)
+    assert len(rendered) == 2
+    # the source file is loaded once, for the package slides are rendered in
+    assert len(loaded) == 1
+    assert len(presentation._render_prs.prs.slides) == 0
+
+
+def test_parallel_parsing(monkeypatch):
+    source = package_join("templates", "default", "source.pptx")
+    presentation = Presentation.from_file(source, Config(tempfile.mkdtemp()))
+    monkeypatch.setattr(presentation_module, "SLIDES_PER_WORKER", 4)
+    parallel = Presentation.from_file(source, Config(tempfile.mkdtemp()), max_workers=3)
+    assert len(parallel) == len(presentation)
+    for slide, parallel_slide in zip(presentation.slides, parallel.slides):
+        assert parallel_slide.slide_idx == slide.slide_idx
+        assert parallel_slide.to_html(show_image=False) == slide.to_html(
+            show_image=False
+        )
+        for picture in parallel_slide.shape_filter(Picture):
+            assert os.path.exists(picture.img_path)
+
+
+def test_render_cache():
+    from pptagent.apis import replace_paragraph
+
+    presentation = Presentation.from_file(
+        package_join("templates", "default", "source.pptx"), Config(tempfile.mkdtemp())
+    )
+    slide = next(s for s in presentation.slides if any(s.iter_paragraphs()))
+    html = slide.to_html(show_image=False)
+    assert slide.to_html(show_image=False) is html
+    assert slide.to_html(show_image=False, paragraph_id=False) != html
+    text = slide.to_text()
+    assert slide.to_text() is text
+
+    forked = slide.fork()
+    shape = next(s for s in forked if s.text_frame.is_textframe)
+    para = next(p for p in shape.text_frame.paragraphs if p.idx != -1)
+    replace_paragraph(forked, shape.shape_idx, para.idx, "edited paragraph")
+    assert "edited paragraph" in forked.to_html(show_image=False)
+    assert "edited paragraph" in forked.to_text()
+    assert slide.to_html(show_image=False) is html
+
+    sized_html = forked.to_html(show_image=False, size=True)
+    shape.width = Pt(shape.width + 10)
+    assert forked.to_html(show_image=False, size=True) != sized_html
+
+    # shapes are told apart by tokens which, unlike id(), are never reused
+    assert len({s.render_token for s in slide.shapes}) == len(slide.shapes)
+    copied = deepcopy(shape)
+    assert copied.render_token != shape.render_token
+    assert copied.render_token == copied.render_token
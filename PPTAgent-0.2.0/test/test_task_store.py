@@ -0,0 +1,54 @@
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join
+
+from pptagent_ui.task_store import TaskStore
+
+
+def test_task_store():
+    db_path = join(tempfile.mkdtemp(), "tasks.db")
+    store = TaskStore(db_path)
+    for i in range(3):
+        store.create_task(f"task{i}", {"numberOfPages": i})
+
+    # each task is claimed by exactly one worker
+    with ThreadPoolExecutor(4) as executor:
+        claims = list(
+            executor.map(
+                lambda i: TaskStore(db_path).claim_task(f"worker{i}"), range(4)
+            )
+        )
+    claimed = sorted(claim[0] for claim in claims if claim is not None)
+    assert claimed == ["task0", "task1", "task2"]
+    assert store.get_task("task1")["status"] == "running"
+
+    store.publish("task0", 10, "task initialized successfully")
+    store.publish("task0", 100, "Stage: Success!")
+    events = store.events_since("task0")
+    assert [event["progress"] for event in events] == [10, 100]
+    assert store.events_since("task0", events[0]["event_id"]) == events[1:]
+    owner = store.get_task("task0")["worker"]
+    assert store.finish_task("task0", owner, "done")
+
+    # running tasks without heartbeat are claimed again
+    assert TaskStore(db_path, lease=3600).claim_task("worker") is None
+    task_id, payload = TaskStore(db_path, lease=0).claim_task("worker")
+    assert task_id == "task1" and payload == {"numberOfPages": 1}
+    assert store.get_task("task1")["attempts"] == 2
+
+    # only the worker that claimed a task last can finish it
+    assert not store.finish_task("task1", owner, "failed")
+    assert store.get_task("task1")["status"] == "running"
+
+    # abandoned tasks are failed after the maximum number of claims
+    store = TaskStore(db_path, lease=0, max_attempts=3)
+    assert store.claim_task("worker")[0] in ("task1", "task2")
+    while (claim := store.claim_task("worker")) is not None:
+        assert store.get_task(claim[0])["attempts"] <= 3
+    assert store.get_task("task1")["status"] == "failed"
+    assert store.events_since("task1")[-1]["progress"] == 100
+
+    store.requeue_task("task0")
+    assert store.events_since("task0") == []
+    assert store.get_task("task0")["status"] == "queued"
+    assert store.get_task("task0")["attempts"] == 0
@@ -0,0 +1,59 @@
+import asyncio
+import json
+import tempfile
+from os.path import join
+from types import SimpleNamespace
+
+import pytest
+
+from pptagent.telemetry import (
+    Tracer,
+    get_tracer,
+    set_tracer,
+    trace_llm_call,
+    trace_scope,
+)
+
+
+def completion(prompt_tokens: int, completion_tokens: int, cached_tokens: int):
+    return SimpleNamespace(
+        usage=SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens),
+        )
+    )
+
+
+async def test_trace_scopes():
+    trace_file = join(tempfile.mkdtemp(), "trace.jsonl")
+    default_tracer = get_tracer()
+    set_tracer(Tracer(trace_file))
+
+    async def generate_slide(slide_idx: int):
+        with trace_scope(slide=slide_idx) as slide_scope:
+            for role in ["editor", "coder"]:
+                with trace_scope(role=role):
+                    with trace_llm_call("gpt") as call:
+                        await asyncio.sleep(0)
+                        call.completion = completion(100, 10, 50)
+        return slide_scope.usage
+
+    try:
+        usages = await asyncio.gather(*[generate_slide(i) for i in range(1, 4)])
+        with pytest.raises(ValueError):
+            with trace_scope(role="coder"), trace_llm_call("gpt"):
+                raise ValueError("invalid response")
+        summary = get_tracer().summary()
+    finally:
+        set_tracer(default_tracer)
+
+    assert all(usage.prompt_tokens == 200 for usage in usages)
+    assert summary["slide"]["2"]["completion_tokens"] == 20
+    assert summary["role"]["coder"]["calls"] == 4
+    assert summary["model"]["gpt"]["cached_tokens"] == 300
+    with open(trace_file, encoding="utf-8") as f:
+        spans = [json.loads(line) for line in f]
+    assert len(spans) == 7
+    assert spans[-1]["status"] == "error"
+    assert {"model", "role", "slide"} <= spans[0]["attributes"].keys()
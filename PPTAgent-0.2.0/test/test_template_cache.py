@@ -0,0 +1,55 @@
+import shutil
+import tempfile
+from os.path import exists, join
+
+from pptagent.template_cache import PRESENTATION_CACHE, TemplateCache
+from pptagent.utils import package_join
+
+
+def test_template_cache():
+    template_dir = tempfile.mkdtemp()
+    shutil.copy(
+        package_join("templates", "default", "source.pptx"),
+        join(template_dir, "source.pptx"),
+    )
+
+    cache = TemplateCache(template_dir)
+    presentation = cache.load_presentation()
+    assert exists(join(template_dir, PRESENTATION_CACHE))
+
+    # a fresh cache instance is served from the pickled presentation
+    cached = TemplateCache(template_dir).load_presentation()
+    assert len(cached) == len(presentation)
+    assert cached.prs.core_properties.last_modified_by == "PPTAgent"
+    for slide, cached_slide in zip(presentation.slides, cached.slides):
+        assert slide.to_html(show_image=False) == cached_slide.to_html(show_image=False)
+    cached.empty_copy().save(join(template_dir, "template.pptx"), layout_only=True)
+
+    # each load is an independent copy
+    cached.slides.clear()
+    assert len(cache.load_presentation()) == len(presentation)
+
+    cache.dump_json("slide_induction.json", {"language": {"lid": "en"}})
+    induction = cache.load_json("slide_induction.json")
+    induction.pop("language")
+    assert cache.load_json("slide_induction.json") == {"language": {"lid": "en"}}
+    assert cache.load_json("image_stats.json") is None
+
+
+def test_template_cache_dir():
+    template_dir = tempfile.mkdtemp()
+    shutil.copy(
+        package_join("templates", "default", "source.pptx"),
+        join(template_dir, "source.pptx"),
+    )
+
+    # the parsed presentation is cached apart from the template
+    cache_dir = join(tempfile.mkdtemp(), "default")
+    presentation = TemplateCache(template_dir, cache_dir=cache_dir).load_presentation()
+    assert exists(join(cache_dir, PRESENTATION_CACHE))
+    assert not exists(join(template_dir, PRESENTATION_CACHE))
+
+    # failing to write the cache, e.g. to a read-only directory, only disables it
+    unwritable = join(cache_dir, PRESENTATION_CACHE)
+    cache = TemplateCache(template_dir, cache_dir=join(unwritable, "default"))
+    assert len(cache.load_presentation()) == len(presentation)
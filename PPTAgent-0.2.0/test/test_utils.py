@@ -1,9 +1,28 @@
+import io
+import json
 import os
+import random
+import socket
+import subprocess
+import sys
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join
 
 import pytest
+from PIL import Image as PILImage
+from pptx.parts.image import Image
 
-from pptagent.utils import get_json_from_response, package_join, ppt_to_images
+from pptagent.soffice import _listening_pid_owns, rasterize_pdf
+from pptagent.utils import (
+    crop_whitespace,
+    deferred_image_conversion,
+    get_json_from_response,
+    manual_scan_crop,
+    package_join,
+    parsing_image,
+    ppt_to_images,
+)
 from test.conftest import test_config
 
 
@@ -106,7 +125,181 @@ def test_json_not_found():
     assert "JSON not found" in str(excinfo.value)
 
 
+def random_json(rng: random.Random, depth: int = 0):
+    if depth > 3 or rng.random() < 0.3:
+        return rng.choice(
+            [
+                rng.randint(-100, 100),
+                rng.random(),
+                None,
+                True,
+                "".join(rng.choice('ab{}[]"\\ \n') for _ in range(rng.randint(0, 8))),
+            ]
+        )
+    if rng.random() < 0.5:
+        return [random_json(rng, depth + 1) for _ in range(rng.randint(1, 4))]
+    return {f"key{i}": random_json(rng, depth + 1) for i in range(rng.randint(1, 4))}
+
+
+def test_extract_json_fuzz():
+    """Test extracting random JSON surrounded by prose with stray brackets and quotes."""
+    rng = random.Random(0)
+    noise = ["Sure!", "see {this}", "a ] b", 'say "{hi"', "x [y", "}", "(1, 2)"]
+    for _ in range(500):
+        obj = {"value": random_json(rng)}
+        text = json.dumps(obj, indent=rng.choice([None, 2]))
+        before = " ".join(rng.choices(noise, k=rng.randint(0, 3)))
+        after = " ".join(rng.choices(noise, k=rng.randint(0, 3)))
+        assert get_json_from_response(f"{before}\n{text}\n{after}") == obj
+
+
+def test_extract_json_malformed():
+    """Test repairing malformed JSON and extracting it from long responses."""
+    assert get_json_from_response('Result: {"a": 1, "b": [1, 2,]}') == {
+        "a": 1,
+        "b": [1, 2],
+    }
+    assert get_json_from_response('Result: {"a": 1, "b": [1, 2') == {
+        "a": 1,
+        "b": [1, 2],
+    }
+    code = "def f(x): return {x: [x]} if x else {}\n" * 500
+    result = get_json_from_response(code + '{"action": "done"}' + code)
+    assert result == {"action": "done"}
+
+
+def test_extract_json_truncated():
+    """Test that a truncated object is repaired as a whole, not replaced by a nested value."""
+    response = '{"title": {"data": ["A"]}, "main_content": {"data": ["B"]}'
+    assert get_json_from_response(response) == {
+        "title": {"data": ["A"]},
+        "main_content": {"data": ["B"]},
+    }
+    outline = {"outline": [{"name": "Intro", "description": "Opening"}]}
+    response = "Here is the outline:\n" + json.dumps(outline, indent=2)[:-1]
+    assert get_json_from_response(response) == outline
+
+
+def test_extract_json_multiple_values():
+    """Test that the largest of several JSON values is returned."""
+    response = 'First {"a": 1}, then {"b": 2, "c": [3]}'
+    assert get_json_from_response(response) == {"b": 2, "c": [3]}
+
+
 def test_ppt_to_images_conversion():
     """Test converting a PPTX file to images."""
     # Run the conversion
     ppt_to_images(test_config.ppt, tempfile.mkdtemp())
+
+
+def test_rasterize_pdf():
+    """Test rasterizing each page of a pdf to an image."""
+    pdf_dir = tempfile.mkdtemp()
+    pages = [PILImage.new("RGB", (960, 540), (i * 20, 0, 0)) for i in range(10)]
+    pages[0].save(join(pdf_dir, "source.pdf"), save_all=True, append_images=pages[1:])
+
+    output_dir = tempfile.mkdtemp()
+    assert rasterize_pdf(join(pdf_dir, "source.pdf"), output_dir) == 10
+    assert sorted(os.listdir(output_dir))[-1] == "slide_0010.jpg"
+    assert PILImage.open(join(output_dir, "slide_0001.jpg")).size == (960, 540)
+
+    # small decks are rendered in process, concurrently from several threads
+    output_dirs = [tempfile.mkdtemp() for _ in range(8)]
+    pages[0].save(join(pdf_dir, "small.pdf"), save_all=True, append_images=pages[1:3])
+    with ThreadPoolExecutor(8) as executor:
+        counts = executor.map(
+            lambda output_dir: rasterize_pdf(join(pdf_dir, "small.pdf"), output_dir),
+            output_dirs,
+        )
+        assert list(counts) == [3] * 8
+    assert all(len(os.listdir(output_dir)) == 3 for output_dir in output_dirs)
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/net/tcp"), reason="requires /proc")
+def test_listening_pid_owns():
+    """Test telling which process listens on a port, as soffice listeners check their ports."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        sock.listen()
+        port = sock.getsockname()[1]
+        assert _listening_pid_owns(os.getpid(), port)
+        with subprocess.Popen(["sleep", "5"]) as process:
+            assert not _listening_pid_owns(process.pid, port)
+            process.kill()
+
+
+def test_crop_whitespace():
+    """Test cropping an image to its non-white content."""
+    img = PILImage.new("RGB", (1000, 600), (255, 255, 255))
+    assert crop_whitespace(img).size == (1000, 600)
+
+    # near-white pixels are anti-aliasing, not content
+    img.paste((250, 250, 250), (0, 0, 1000, 10))
+    img.paste((0, 0, 0), (100, 50, 300, 80))
+    img.putpixel((310, 200), (255, 247, 255))
+    assert crop_whitespace(img).size == (251, 191)
+    assert crop_whitespace(img, padding=0).getbbox() == (0, 0, 211, 151)
+
+    # the padding is clipped at the borders
+    img.putpixel((999, 599), (0, 0, 0))
+    assert crop_whitespace(img).size == (920, 570)
+
+    img_path = join(tempfile.mkdtemp(), "table.png")
+    img.save(img_path)
+    manual_scan_crop(img_path)
+    assert PILImage.open(img_path).size == (920, 570)
+
+
+def test_deferred_image_conversion():
+    """Test converting the images collected while parsing at once."""
+    image_dir = tempfile.mkdtemp()
+    blob = io.BytesIO()
+    PILImage.new("RGB", (10, 10), (255, 0, 0)).save(blob, "TIFF")
+    image = Image.from_blob(blob.getvalue())
+    image_path = join(image_dir, f"{image.sha1}.{image.ext}")
+
+    with deferred_image_conversion() as batch:
+        for slide_idx in (1, 2):
+            batch.current_slide = slide_idx
+            assert parsing_image(image, image_path) == image_path[:-5] + ".png"
+    assert not os.path.exists(image_path[:-5] + ".png")
+    assert list(batch.owners.values()) == [{1, 2}]
+    assert batch.run() == {}
+    assert PILImage.open(image_path[:-5] + ".png").size == (10, 10)
+
+    # without a batch, images are converted at once
+    os.remove(image_path[:-5] + ".png")
+    parsing_image(image, image_path)
+    assert os.path.exists(image_path[:-5] + ".png")
+
+
+def test_lazy_import():
+    code = (
+        "import sys, pptagent\n"
+        "heavy = {'openai', 'fastmcp', 'torch', 'html2image', 'pptagent.pptgen'}\n"
+        "print(sorted(heavy & set(sys.modules)))\n"
+        "from pptagent import Config, PPTAgent\n"
+        "print('openai' in sys.modules)"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout.splitlines()
+    assert output == ["[]", "False"]
+
+    # parsing presentations needs neither the LLM clients nor the http stack
+    code = (
+        "import sys, pptagent.presentation\n"
+        "heavy = {'aiohttp', 'openai', 'pptagent.llms', 'pptagent.response'}\n"
+        "print(sorted(heavy & set(sys.modules)))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout.splitlines()
+    assert output == ["[]"]
+
+    # nor do LLM calls need the fuzzy matching of replayed calls
+    code = "import sys, pptagent.llms\nprint('rapidfuzz' in sys.modules)"
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout.splitlines()
+    assert output == ["False"]